@@ -0,0 +1,262 @@
+"""
+Realized Accuracy: ประเมินผลทำนายที่บันทึกไว้ในตาราง predictions กับราคาปิดจริงของแท่งเป้าหมาย
+เมื่อแท่งนั้นปิดแล้ว และสะสมผลลงตาราง accuracy_stats / accuracy_calibration แบบ incremental
+(แต่ละรายการถูกนับครั้งเดียวในธุรกรรมเดียวกับที่บันทึกราคาจริง)
+
+/performance อ่านผลรวมเหล่านี้โดยตรง ไม่ต้องรัน backtest หรือโมเดลทุกคำขอ
+"""
+
+import logging
+import math
+from bisect import bisect_right
+
+import clock
+import db
+from data_service import fetch_klines, parse_klines, interval_to_ms, was_stale
+from scheduler import COINS
+
+logger = logging.getLogger("accuracy")
+
+# ค่าเฉลี่ยแบบ rolling ใช้ EWMA ที่มีน้ำหนักเทียบเท่าหน้าต่าง ROLLING_WINDOW รายการล่าสุด
+ROLLING_WINDOW = 50
+ROLLING_ALPHA = 2 / (ROLLING_WINDOW + 1)
+
+# ขอบของกลุ่ม Calibration ตามขนาดการเปลี่ยนแปลงที่ทำนาย (|%|)
+CALIBRATION_EDGES = [0.1, 0.25, 0.5, 1.0, 2.0]
+
+# จำนวนผลทำนายสูงสุดที่ประเมินต่อรอบ (ที่เหลือรอรอบถัดไป)
+MAX_EVALUATIONS = 5000
+
+# จำนวนรอบสูงสุดที่ลองหาราคาจริงของรายการหนึ่ง (เช่น แท่งหายจาก Binance หรือเหรียญที่เลิกรองรับ)
+# เกินแล้วถือว่าประเมินไม่ได้ และไม่ดึงมาอีก เพื่อไม่ให้ค้างอยู่หน้าหน้าต่าง MAX_EVALUATIONS ตลอดไป
+MAX_EVALUATION_ATTEMPTS = 3
+
+
+def bucket_label(bucket):
+    """ชื่อกลุ่ม Calibration เช่น "0.25-0.5%" """
+    if bucket == 0:
+        return f"<{CALIBRATION_EDGES[0]}%"
+    if bucket == len(CALIBRATION_EDGES):
+        return f">={CALIBRATION_EDGES[-1]}%"
+    return f"{CALIBRATION_EDGES[bucket - 1]}-{CALIBRATION_EDGES[bucket]}%"
+
+
+def _realized_closes(symbol, timeframe, target_times):
+    """
+    ราคาปิดจริงของแท่งเป้าหมาย คืนค่า ({เวลาเปิดแท่ง: ราคาปิด}, stale) (ดึงช่วงเดียวครอบทุกแท่ง)
+    """
+    step = interval_to_ms(timeframe)
+    first, last = min(target_times), max(target_times)
+    data = fetch_klines(symbol, timeframe, limit=(last - first) // step + 1, start_time=first)
+    times, ohlcv = parse_klines(data)
+    return dict(zip(times.tolist(), ohlcv[:, 3].tolist())), was_stale(data)
+
+
+class _Aggregate:
+    """ผลรวมสะสมของหนึ่ง (coin, timeframe, model_version) ที่อัปเดตทีละรายการ"""
+
+    def __init__(self, row=None):
+        row = dict(row) if row is not None else {}
+        self.samples = row.get("samples", 0)
+        self.sum_abs_error = row.get("sum_abs_error", 0.0)
+        self.sum_sq_error = row.get("sum_sq_error", 0.0)
+        self.sum_abs_pct_error = row.get("sum_abs_pct_error", 0.0)
+        self.hits = row.get("hits", 0)
+        self.rolling_abs_error = row.get("rolling_abs_error")
+        self.rolling_abs_pct_error = row.get("rolling_abs_pct_error")
+        self.rolling_hit_rate = row.get("rolling_hit_rate")
+        self.last_target_time = row.get("last_target_time")
+        self.calibration = {}  # bucket -> [samples, sum_predicted_change, sum_realized_change, hits] ของรอบนี้
+
+    @staticmethod
+    def _ewma(previous, value):
+        return value if previous is None else previous + ROLLING_ALPHA * (value - previous)
+
+    def add(self, current, predicted, actual, target_time):
+        error = predicted - actual
+        pct_error = abs(error) / actual * 100
+        predicted_change = (predicted - current) / current * 100
+        realized_change = (actual - current) / current * 100
+        # ทิศทางถูกเมื่อเครื่องหมายการเปลี่ยนแปลงตรงกัน (รวมกรณีทำนายว่าไม่เปลี่ยนและไม่เปลี่ยนจริง)
+        hit = predicted_change * realized_change > 0 or predicted_change == realized_change == 0
+
+        self.samples += 1
+        self.sum_abs_error += abs(error)
+        self.sum_sq_error += error * error
+        self.sum_abs_pct_error += pct_error
+        self.hits += int(hit)
+        self.rolling_abs_error = self._ewma(self.rolling_abs_error, abs(error))
+        self.rolling_abs_pct_error = self._ewma(self.rolling_abs_pct_error, pct_error)
+        self.rolling_hit_rate = self._ewma(self.rolling_hit_rate, float(hit))
+        self.last_target_time = max(self.last_target_time or 0, target_time)
+
+        # การเปลี่ยนแปลงจริงวัดในทิศทางที่ทำนาย (บวก = ไปทางที่ทำนาย)
+        direction = 1.0 if predicted_change >= 0 else -1.0
+        bucket = self.calibration.setdefault(bisect_right(CALIBRATION_EDGES, abs(predicted_change)), [0, 0.0, 0.0, 0])
+        bucket[0] += 1
+        bucket[1] += abs(predicted_change)
+        bucket[2] += direction * realized_change
+        bucket[3] += int(hit)
+
+
+def evaluate_pending(limit=MAX_EVALUATIONS):
+    """
+    ประเมินผลทำนายที่แท่งเป้าหมายปิดแล้วแต่ยังไม่ได้ประเมิน
+
+    Returns:
+        จำนวนผลทำนายที่ประเมินในรอบนี้
+    """
+    now = clock.now_ms()
+    conn = db.get_db()
+    try:
+        rows = conn.execute("""
+            SELECT id, coin, timeframe, current_price, predicted_price, target_time,
+                   COALESCE(model_version, 'unknown') AS model_version
+            FROM predictions
+            WHERE actual_price IS NULL AND target_time IS NOT NULL AND evaluation_attempts < ?
+            ORDER BY target_time
+            LIMIT ?
+        """, (MAX_EVALUATION_ATTEMPTS, limit)).fetchall()
+
+        groups = {}
+        for row in rows:
+            if row["target_time"] + interval_to_ms(row["timeframe"]) <= now:
+                groups.setdefault((row["coin"], row["timeframe"]), []).append(row)
+
+        evaluated = 0
+        unresolved = []
+        for (coin, timeframe), pending in groups.items():
+            symbol = COINS.get(coin)
+            if symbol is None:
+                logger.warning(f"Unknown coin {coin} in pending predictions, skipping")
+                unresolved.extend(row["id"] for row in pending)
+                continue
+            try:
+                closes, stale = _realized_closes(symbol, timeframe, [row["target_time"] for row in pending])
+            except Exception as e:
+                logger.error(f"Failed to fetch realized closes for {coin}/{timeframe}: {e}")
+                continue
+            if stale:
+                continue  # ข้อมูลสำรองอาจยังไม่มีแท่งล่าสุด รอรอบถัดไป
+
+            aggregates = {}
+            updates = []
+            for row in pending:
+                actual = closes.get(row["target_time"])
+                if actual is None or not row["current_price"]:
+                    unresolved.append(row["id"])
+                    continue
+                version = row["model_version"]
+                if version not in aggregates:
+                    stored = conn.execute(
+                        "SELECT * FROM accuracy_stats WHERE coin = ? AND timeframe = ? AND model_version = ?",
+                        (coin, timeframe, version)
+                    ).fetchone()
+                    aggregates[version] = _Aggregate(stored)
+                aggregates[version].add(row["current_price"], row["predicted_price"], actual, row["target_time"])
+                updates.append((actual, row["id"]))
+
+            if not updates:
+                continue
+            _save_group(conn, coin, timeframe, aggregates, updates)
+            evaluated += len(updates)
+
+        if unresolved:
+            _record_failed_attempts(conn, unresolved)
+        if evaluated:
+            logger.info(f"Evaluated {evaluated} predictions against realized closes")
+        return evaluated
+    finally:
+        conn.close()
+
+
+def _record_failed_attempts(conn, ids):
+    """นับรอบที่หาราคาจริงไม่ได้ (ดึงข้อมูลสำเร็จแต่ไม่มีแท่งเป้าหมาย) ของรายการเหล่านี้"""
+    with conn:
+        conn.executemany(
+            "UPDATE predictions SET evaluation_attempts = evaluation_attempts + 1 WHERE id = ?",
+            [(i,) for i in ids]
+        )
+    logger.warning(f"No realized close for {len(ids)} predictions "
+                   f"(skipped for good after {MAX_EVALUATION_ATTEMPTS} attempts)")
+
+
+def _save_group(conn, coin, timeframe, aggregates, updates):
+    """บันทึกราคาจริงและผลรวมที่อัปเดตแล้วของหนึ่ง (coin, timeframe) ในธุรกรรมเดียว"""
+    with conn:
+        conn.executemany("UPDATE predictions SET actual_price = ? WHERE id = ? AND actual_price IS NULL", updates)
+        for version, agg in aggregates.items():
+            conn.execute("""
+                INSERT OR REPLACE INTO accuracy_stats
+                    (coin, timeframe, model_version, samples, sum_abs_error, sum_sq_error, sum_abs_pct_error, hits,
+                     rolling_abs_error, rolling_abs_pct_error, rolling_hit_rate, last_target_time, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (coin, timeframe, version, agg.samples, agg.sum_abs_error, agg.sum_sq_error, agg.sum_abs_pct_error,
+                  agg.hits, agg.rolling_abs_error, agg.rolling_abs_pct_error, agg.rolling_hit_rate,
+                  agg.last_target_time))
+            conn.executemany("""
+                INSERT INTO accuracy_calibration
+                    (coin, timeframe, model_version, bucket, samples, sum_predicted_change, sum_realized_change, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (coin, timeframe, model_version, bucket) DO UPDATE SET
+                    samples = samples + excluded.samples,
+                    sum_predicted_change = sum_predicted_change + excluded.sum_predicted_change,
+                    sum_realized_change = sum_realized_change + excluded.sum_realized_change,
+                    hits = hits + excluded.hits
+            """, [(coin, timeframe, version, bucket, *values) for bucket, values in agg.calibration.items()])
+
+
+def get_performance(coin, timeframe, model_version=None):
+    """
+    อ่านความแม่นยำจริงที่สะสมไว้ของ (coin, timeframe) - ใช้เวอร์ชัน model_version ถ้ามีผลแล้ว
+    ไม่งั้นใช้เวอร์ชันที่ถูกประเมินล่าสุด (None = ยังไม่มีผลทำนายที่ประเมินแล้ว)
+    """
+    conn = db.get_db()
+    try:
+        stats = conn.execute("""
+            SELECT * FROM accuracy_stats
+            WHERE coin = ? AND timeframe = ? AND samples > 0
+            ORDER BY model_version = ? DESC, last_target_time DESC
+            LIMIT 1
+        """, (coin, timeframe, model_version)).fetchone()
+        if stats is None:
+            return None
+        buckets = conn.execute("""
+            SELECT * FROM accuracy_calibration
+            WHERE coin = ? AND timeframe = ? AND model_version = ?
+            ORDER BY bucket
+        """, (coin, timeframe, stats["model_version"])).fetchall()
+        latest = conn.execute("""
+            SELECT current_price, predicted_price, created_at FROM predictions
+            WHERE coin = ? AND timeframe = ?
+            ORDER BY id DESC LIMIT 1
+        """, (coin, timeframe)).fetchone()
+    finally:
+        conn.close()
+
+    n = stats["samples"]
+    return {
+        "model_version": stats["model_version"],
+        "samples": n,
+        "mae": stats["sum_abs_error"] / n,
+        "rmse": math.sqrt(stats["sum_sq_error"] / n),
+        "accuracy": max(0.0, 100 - stats["sum_abs_pct_error"] / n),
+        "hit_rate": stats["hits"] / n,
+        "rolling_mae": stats["rolling_abs_error"],
+        "rolling_accuracy": max(0.0, 100 - stats["rolling_abs_pct_error"]),
+        "rolling_hit_rate": stats["rolling_hit_rate"],
+        "calibration": [
+            {
+                "bucket": bucket_label(b["bucket"]),
+                "samples": b["samples"],
+                "mean_predicted_change_pct": b["sum_predicted_change"] / b["samples"],
+                "mean_realized_change_pct": b["sum_realized_change"] / b["samples"],
+                "hit_rate": b["hits"] / b["samples"]
+            }
+            for b in buckets
+        ],
+        "current_price": latest["current_price"] if latest else None,
+        "predicted_price": latest["predicted_price"] if latest else None,
+        "predicted_at": latest["created_at"] if latest else None,
+        "evaluated_through": stats["last_target_time"]
+    }
@@ -7,71 +7,151 @@ Features: close, open, high, low, volume, price_change, volatility,
 
 import numpy as np
 import joblib
+import json
 import os
-from tensorflow.keras.models import load_model
-from sklearn.preprocessing import MinMaxScaler
-from data_service import get_training_data, get_klines
-from datetime import datetime, timedelta
+import queue
+import threading
+import time
+import clock
+from data_service import (
+    get_klines, interval_to_ms, compute_features, was_stale, CandleList,
+    FEATURE_COLUMNS, RAW_COLUMNS, INDICATOR_WARMUP
+)
+from feature_store import get_features
+from shared_weights import MappedModel, weights_path
+from model_cache import ModelCache
+from datetime import datetime
 
 # ค่า Window size สำหรับการทำนาย (ต้องตรงกับตอน training)
 WINDOW = 20
 
-# รายการ Features ที่ใช้ (ต้องตรงกับตอน training)
-FEATURE_COLUMNS = [
-    "close", "open", "high", "low", "volume",
-    "price_change", "volatility",
-    "ma_5", "ma_10", "ma_20",
-    "macd", "rsi", "bb_position",
-    "volume_change", "price_position"
-]
-
-# ตัวแปร Global เก็บโมเดลและ scaler
-models = {}
+# จำนวนแถวที่ predict_price ใช้ fit scaler (WINDOW + 100 แท่ง หลังตัดแถว warmup ของ indicators)
+SCALING_ROWS = WINDOW + 100 - INDICATOR_WARMUP
+
+# จำนวนแท่งที่ทำนายล่วงหน้าได้สูงสุดต่อคำขอ (autoregressive rollout)
+MAX_HORIZON = 48
+# จำนวนแท่งจริงท้ายสุดที่ใช้เป็นบริบทของ indicators ตอนต่อแท่งที่ทำนาย (window ยาวสุด = 20)
+ROLLOUT_CONTEXT = 30
+
+# จำนวน window ต่อหนึ่ง forward pass เมื่อทำนายย้อนหลังยาวๆ (จำกัดหน่วยความจำ)
+SERIES_CHUNK = 4096
+
+# Micro-batching: จำนวน window สูงสุดต่อ forward pass และเวลารอรวมคำขอ (มิลลิวินาที)
+INFERENCE_MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", "64"))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", "5"))
+
+# MC Dropout: จำนวน forward pass แบบสุ่มต่อคำขอที่ขอช่วงความเชื่อมั่น (รวมเป็น batch เดียวขนาด K × windows)
+MC_DROPOUT_SAMPLES = int(os.environ.get("MC_DROPOUT_SAMPLES", "30"))
+
+# ชนิดข้อมูลตลอดเส้นทางการทำนาย (ตรงกับน้ำหนักของโมเดล - Keras ไม่ต้องแปลงชนิดทุกครั้งที่เรียก)
+INFERENCE_DTYPE = np.float32
+
+# โหมด Shared Weights: map น้ำหนักจาก weights_{key}.bin (ใช้หน่วยความจำชุดเดียวกันทุก worker และไม่โหลด TensorFlow)
+SHARED_WEIGHTS = os.environ.get("SHARED_WEIGHTS", "0") == "1"
+# ระยะห่างขั้นต่ำระหว่างการตรวจว่ามีไฟล์น้ำหนักใหม่มาแทนที่หรือไม่ (วินาที)
+REMAP_CHECK_SECONDS = 1.0
+
+# งบของ Model Cache (0 = ไม่จำกัด) - โมเดลที่ไม่ได้ใช้นานที่สุดจะถูกเอาออกเมื่อเกินงบ
+MODEL_CACHE_MAX_MODELS = int(os.environ.get("MODEL_CACHE_MAX_MODELS", "32"))
+MODEL_CACHE_MAX_MB = float(os.environ.get("MODEL_CACHE_MAX_MB", "0"))
+
+# เวอร์ชันของโมเดลแต่ละคีย์ (อิงเวลาแก้ไขไฟล์โมเดล) ใช้สร้าง ETag
+model_versions = {}
 scalers = {}
 
 # ใช้ absolute path จากตำแหน่งของไฟล์นี้
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 MODELS_DIR = os.path.join(os.path.dirname(CURRENT_DIR), "models")
 
-def load_specific_model(timeframe):
-    """โหลดโมเดลและ Scaler สำหรับ timeframe ที่ระบุ (ใช้สำหรับ Reload หลัง Retrain)"""
-    global models, scalers
+def model_key(timeframe, symbol=None):
+    """คีย์ของโมเดลใน models (และชื่อไฟล์): "{symbol}_{timeframe}" สำหรับโมเดลเฉพาะเหรียญ หรือ timeframe สำหรับโมเดลรวม"""
+    return f"{symbol}_{timeframe}" if symbol else timeframe
+
+def _model_file(key):
+    """ไฟล์โมเดลของ key: ไฟล์น้ำหนักที่ map ได้ (โหมด Shared Weights ถ้ามี) หรือ .h5"""
+    mapped_path = weights_path(MODELS_DIR, key)
+    if SHARED_WEIGHTS and os.path.exists(mapped_path):
+        return mapped_path
+    return os.path.join(MODELS_DIR, f"lstm_{key}.h5")
+
+def _probe_model_file(key):
+    """ตัวระบุไฟล์โมเดลของ key (path, mtime) หรือ None ถ้าไม่มีไฟล์ - ใช้ตอบ `key in models` โดยไม่ต้องโหลด"""
+    path = _model_file(key)
+    try:
+        return path, os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _load_model_file(key):
+    """loader ของ Model Cache: โหลดโมเดลและ Scaler ของ key จากไฟล์ (None ถ้าไม่มีไฟล์หรือโหลดไม่สำเร็จ)"""
+    model_path = _model_file(key)
+    scaler_path = os.path.join(MODELS_DIR, f"scaler_{key}.pkl")
+    
+    if SHARED_WEIGHTS and not model_path.endswith(".bin"):
+        print(f"  ⚠ Mapped weights not found for {key} (run shared_weights.py), loading .h5 instead")
     
-    model_path = os.path.join(MODELS_DIR, f"lstm_{timeframe}.h5")
-    scaler_path = os.path.join(MODELS_DIR, f"scaler_{timeframe}.pkl")
+    print(f"Loading {key} model from: {model_path}")
     
-    print(f"Loading {timeframe} model from: {model_path}")
+    if os.path.exists(model_path):
+        model_versions[key] = str(int(os.path.getmtime(model_path)))
+    else:
+        model_versions[key] = "none"
     
+    model = None
     try:
-        if os.path.exists(model_path):
-            models[timeframe] = load_model(model_path, compile=False)
-            print(f"  ✓ Loaded {timeframe} model successfully")
+        if model_path.endswith(".bin"):
+            model = MappedModel(model_path)
+            print(f"  ✓ Mapped {key} weights ({model.nbytes / 1024:.0f} KB)")
+        elif os.path.exists(model_path):
+            from tensorflow.keras.models import load_model
+            model = load_model(model_path, compile=False)
+            print(f"  ✓ Loaded {key} model successfully")
         else:
             print(f"  ✗ Model not found: {model_path}")
-            if timeframe in models:
-                del models[timeframe]
     except Exception as e:
         import traceback
-        print(f"  ✗ Failed to load {timeframe} model: {type(e).__name__}: {e}")
+        print(f"  ✗ Failed to load {key} model: {type(e).__name__}: {e}")
         traceback.print_exc()
-        if timeframe in models:
-            del models[timeframe]
     
     try:
         if os.path.exists(scaler_path):
-            scalers[timeframe] = joblib.load(scaler_path)
-            print(f"  ✓ Loaded {timeframe} scaler")
+            scalers[key] = joblib.load(scaler_path)
+            print(f"  ✓ Loaded {key} scaler")
         else:
             print(f"  ⚠ Scaler not found: {scaler_path}")
-            if timeframe in scalers:
-                del scalers[timeframe]
+            scalers.pop(key, None)
     except Exception as e:
-        print(f"  ⚠ Failed to load {timeframe} scaler: {e}")
-        if timeframe in scalers:
-            del scalers[timeframe]
+        print(f"  ⚠ Failed to load {key} scaler: {e}")
+        scalers.pop(key, None)
+    
+    return model
+
+# โมเดลที่โหลดแล้ว (LRU cache ที่ใช้แทน dict ได้ - โมเดลที่ยังไม่ได้โหลดจะถูกโหลดเมื่อใช้ครั้งแรก)
+models = ModelCache(
+    _load_model_file, _probe_model_file,
+    max_models=MODEL_CACHE_MAX_MODELS, max_bytes=int(MODEL_CACHE_MAX_MB * 1024 * 1024)
+)
+
+def resolve_model(symbol, timeframe):
+    """เลือกโมเดลสำหรับเหรียญ: ใช้โมเดลเฉพาะเหรียญถ้ามี ไม่งั้นใช้โมเดลรวมของ timeframe (None = ไม่มีโมเดล)"""
+    if SHARED_WEIGHTS:
+        refresh_mapped_models()
+    for key in (model_key(timeframe, symbol), timeframe):
+        # `in` ตรวจเฉพาะว่ามีไฟล์ ส่วน get จะโหลดโมเดลที่ยังไม่อยู่ใน cache (None = โหลดไม่สำเร็จ)
+        if key in models and models.get(key) is not None:
+            return key
+    return None
+
+def load_specific_model(timeframe, symbol=None):
+    """โหลดโมเดลและ Scaler สำหรับ timeframe ที่ระบุใหม่ (ใช้สำหรับ Reload หลัง Retrain) - ระบุ symbol เพื่อโหลดโมเดลเฉพาะเหรียญ"""
+    # สลับ reference ทีเดียว - คำขอที่กำลังรันกับโมเดลเดิมยังทำงานต่อได้จนจบ
+    return models.reload(model_key(timeframe, symbol))
 
 def load_all_models():
-    """โหลดโมเดลทั้งหมดตอนเริ่มต้น"""
+    """
+    โหลดโมเดลรวมของแต่ละ timeframe ตอนเริ่มต้น (โมเดลที่ใช้บ่อยที่สุด)
+    โมเดลเฉพาะเหรียญจะถูกโหลดเมื่อมีคำขอครั้งแรกและอยู่ใน cache ตามงบ
+    """
     print("Loading AI models and scalers...")
     print(f"  Models directory: {MODELS_DIR}")
     print(f"  Directory exists: {os.path.exists(MODELS_DIR)}")
@@ -81,131 +161,668 @@ def load_all_models():
         
     print(f"Models loaded! ({len(models)} models, {len(scalers)} scalers)")
 
+_remap_lock = threading.Lock()
+_last_remap_check = 0.0
+
+def refresh_mapped_models(force=False):
+    """
+    โหมด Shared Weights: map ไฟล์น้ำหนักใหม่ของโมเดลที่ถูกแทนที่ (เช่นหลัง Retrain จาก worker อื่น)
+    ตรวจไม่เกินหนึ่งครั้งต่อ REMAP_CHECK_SECONDS (โมเดลที่ยังไม่อยู่ใน cache จะ map ไฟล์ล่าสุดตอนโหลดอยู่แล้ว)
+    """
+    global _last_remap_check
+    now = time.monotonic()
+    if not force and now - _last_remap_check < REMAP_CHECK_SECONDS:
+        return
+    if not _remap_lock.acquire(blocking=False):
+        return  # thread อื่นกำลังตรวจอยู่
+    try:
+        _last_remap_check = now
+        for key, model in models.copy().items():
+            if isinstance(model, MappedModel) and not model.is_current():
+                models.reload(key)
+    finally:
+        _remap_lock.release()
+
+def get_model_version(timeframe, symbol=None):
+    """ดึงเวอร์ชันของโมเดลที่ใช้กับเหรียญนี้ (เปลี่ยนทุกครั้งที่ Retrain)"""
+    key = resolve_model(symbol, timeframe) or timeframe
+    if key not in model_versions:
+        # โมเดลที่ยังไม่ได้โหลด: ใช้เวลาแก้ไขไฟล์ (ค่าเดียวกับที่จะได้ตอนโหลด)
+        identity = _probe_model_file(key)
+        return str(identity[1] // 1_000_000_000) if identity else "none"
+    return model_versions[key]
+
+def load_model_metadata(key):
+    """metadata ของการเทรนครั้งล่าสุดของโมเดล key (lstm_{key}.json ที่ train_model.py เขียน) - None ถ้าไม่มี"""
+    path = os.path.join(MODELS_DIR, f"lstm_{key}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def get_model_cache_stats():
+    """สถิติของ Model Cache: hit/miss, การโหลด, การเอาออก และการใช้งบ"""
+    return models.stats() if isinstance(models, ModelCache) else {"resident": len(models)}
+
 # โหลดโมเดลทั้งหมดทันทีเมื่อ import
 load_all_models()
 
 
-def predict_price(symbol: str = "BTCUSDT", timeframe: str = "1h"):
+class _InferenceRequest:
+    """คำขอทำนายหนึ่งรายการที่รอผลจาก batch"""
+    __slots__ = ("X", "samples", "seed", "done", "result", "error")
+    
+    def __init__(self, X, samples=0, seed=None):
+        self.X = X
+        self.samples = samples
+        self.seed = seed
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceBatcher:
+    """
+    รวมคำขอทำนายที่เข้ามาพร้อมกันซึ่งใช้โมเดลเดียวกันเป็น forward pass เดียว
+    
+    แต่ละโมเดล (คีย์ใน models) มี worker thread ของตัวเอง: รับคำขอแรกแล้วรอคำขออื่นต่ออีกไม่เกิน max_wait_ms
+    หรือจนจำนวน window ครบ max_batch จากนั้นเรียก model.predict ครั้งเดียวและแจกผลคืนให้ผู้เรียกแต่ละราย
+    (มีเพียง worker เท่านั้นที่เรียก TensorFlow จึงไม่มี thread แย่งกันใน runtime)
+    คำขอแบบ MC Dropout (samples > 0) ถูกรันแยกเป็น forward pass ของตัวเองที่เปิด Dropout
+    """
+    
+    def __init__(self, max_batch=INFERENCE_MAX_BATCH, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "windows": 0, "max_batch_seen": 0, "sampled_windows": 0}
+    
+    def predict(self, key, X, samples=0, seed=None):
+        """
+        ส่ง windows (n, WINDOW, features) เข้าคิวของโมเดล key และรอผล shape (n, 1)
+        samples > 0 = MC Dropout: ผล shape (samples, n) หรือ None ถ้าโมเดลไม่มี Dropout
+        """
+        request = _InferenceRequest(X, samples, seed)
+        self._queue_for(key).put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+    
+    def _queue_for(self, key):
+        with self._lock:
+            if key not in self._queues:
+                q = queue.Queue()
+                self._queues[key] = q
+                worker = threading.Thread(
+                    target=self._worker, args=(key, q), name=f"inference-{key}", daemon=True
+                )
+                worker.start()
+            return self._queues[key]
+    
+    def _collect(self, q):
+        """รวมคำขอจากคิวจนครบ max_batch หรือหมดเวลารอ"""
+        batch = [q.get()]
+        size = len(batch[0].X) * max(1, batch[0].samples)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.X) * max(1, request.samples)
+        return batch
+    
+    def _worker(self, key, q):
+        while True:
+            batch = self._collect(q)
+            try:
+                self._run_plain(key, [r for r in batch if not r.samples])
+                for request in batch:
+                    if request.samples:
+                        self._run_sampled(key, request)
+            finally:
+                for request in batch:
+                    request.done.set()
+    
+    def _run_plain(self, key, plain):
+        """คำขอปกติทั้งหมดใน batch: forward pass เดียว แล้วแจกผลคืนตามลำดับ"""
+        if not plain:
+            return
+        try:
+            X = plain[0].X if len(plain) == 1 else np.concatenate([r.X for r in plain])
+            pred = models[key].predict(X, batch_size=len(X), verbose=0)
+            
+            offset = 0
+            for request in plain:
+                request.result = pred[offset:offset + len(request.X)]
+                offset += len(request.X)
+            
+            with self._lock:
+                self.stats["requests"] += len(plain)
+                self.stats["batches"] += 1
+                self.stats["windows"] += len(X)
+                self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(X))
+        except Exception as e:
+            for request in plain:
+                request.error = e
+    
+    def _run_sampled(self, key, request):
+        """คำขอ MC Dropout: samples × windows ใน forward pass เดียวที่เปิด Dropout"""
+        try:
+            request.result = _dropout_samples(models[key], request.X, request.samples, request.seed)
+            with self._lock:
+                self.stats["requests"] += 1
+                self.stats["sampled_windows"] += len(request.X) * request.samples
+        except Exception as e:
+            request.error = e
+
+
+def _dropout_samples(model, X, samples, seed=None):
+    """
+    MC Dropout: ทำนาย windows X ซ้ำ `samples` ครั้งโดยเปิด Dropout เป็น batch เดียว (samples × n windows)
+    layer ก่อน Dropout ตัวแรกคำนวณครั้งเดียว และ BatchNormalization ยังใช้สถิติตอนเทรน
+    คืน shape (samples, n) หรือ None ถ้าโมเดลไม่มี Dropout
+    """
+    rng = np.random.default_rng(seed)
+    if isinstance(model, MappedModel):
+        if not model.dropout_layers:
+            return None  # ไฟล์น้ำหนักรุ่นเก่า (export ใหม่ด้วย shared_weights.py)
+        return model.predict_samples(X, samples, rng).reshape(samples, len(X))
+    
+    layers = getattr(model, "layers", None) or []
+    kinds = [type(layer).__name__ for layer in layers]
+    if "Dropout" not in kinds:
+        return None
+    # เรียกทีละ layer: เปิดเฉพาะ Dropout (training=True ทั้งโมเดลจะทำให้ BatchNormalization ใช้สถิติของ batch)
+    first = kinds.index("Dropout")
+    x = X
+    for layer in layers[:first]:
+        x = layer(x, training=False)
+    x = np.asarray(x)
+    x = np.tile(x, (samples,) + (1,) * (x.ndim - 1))
+    for layer in layers[first:]:
+        if type(layer).__name__ == "Dropout":
+            keep = 1.0 - layer.rate
+            x = np.asarray(x)
+            x = x * (rng.random(x.shape, dtype=INFERENCE_DTYPE) < keep) / INFERENCE_DTYPE(keep)
+        else:
+            x = layer(x, training=False)
+    return np.asarray(x).reshape(samples, len(X))
+
+
+# Batcher กลางที่ใช้กับทุกคำขอทำนาย
+batcher = InferenceBatcher()
+
+
+def _infer(key, X):
+    """ทำนายด้วยโมเดล key ผ่าน micro-batcher (รวมกับคำขออื่นที่เข้ามาพร้อมกัน)"""
+    return batcher.predict(key, X)
+
+
+def get_inference_stats():
+    """สถิติของ micro-batcher: จำนวนคำขอ, จำนวน batch และขนาดเฉลี่ย"""
+    with batcher._lock:
+        stats = dict(batcher.stats)
+    stats["avg_batch_windows"] = round(stats["windows"] / stats["batches"], 2) if stats["batches"] else 0.0
+    stats["max_batch"] = batcher.max_batch
+    stats["max_wait_ms"] = batcher.max_wait * 1000
+    return stats
+
+
+# buffer ชั่วคราวที่ใช้ซ้ำต่อ thread (ไม่ต้องจองใหม่ทุกคำขอ)
+_scratch = threading.local()
+# ขนาดสูงสุด (จำนวนค่า) ของ buffer ที่เก็บไว้ใช้ซ้ำ - ใหญ่กว่านี้ (เช่น predict_series) จองใหม่ทุกครั้ง
+# เพื่อไม่ให้ทุก thread ใน threadpool ถือ buffer ขนาดใหญ่ที่สุดที่เคยเห็นไว้ตลอดอายุ process
+SCRATCH_MAX_ELEMENTS = 64 * 1024
+
+
+def _scratch_buffer(name, shape):
+    """คืน buffer INFERENCE_DTYPE ขนาด shape ที่ใช้ซ้ำภายใน thread เดียวกัน (จองใหม่เมื่อขนาดไม่พอ)"""
+    size = int(np.prod(shape))
+    if size > SCRATCH_MAX_ELEMENTS:
+        return np.empty(shape, dtype=INFERENCE_DTYPE)
+    buffers = _scratch.__dict__.setdefault("buffers", {})
+    buf = buffers.get(name)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=INFERENCE_DTYPE)
+        buffers[name] = buf
+    return buf[:size].reshape(shape)
+
+
+def _fit_scaling(data):
+    """Dynamic Scaling แบบเดียวกับ MinMaxScaler(0, 1): คืน (min, range) ต่อ feature (range 0 -> 1)"""
+    mn = data.min(axis=0)
+    rng = data.max(axis=0) - mn
+    rng[rng == 0] = 1
+    return mn, rng
+
+
+def _unscale_close(pred_scaled, mn, rng):
+    """แปลงผลทำนาย (scaled) กลับเป็นราคาด้วย affine ของคอลัมน์ close (แทน inverse_transform ทั้ง 15 คอลัมน์)"""
+    return pred_scaled[:, 0].astype(np.float64) * float(rng[0]) + float(mn[0])
+
+
+def predict_price(symbol: str = "BTCUSDT", timeframe: str = "1h", with_stale: bool = False):
     """
     ทำนายราคาถัดไปสำหรับเหรียญและ timeframe ที่กำหนด
+    with_stale = คืนค่า (ราคาปัจจุบัน, ราคาที่ทำนาย, stale) โดย stale บอกว่าข้อมูลที่ใช้มาจากข้อมูลสำรองหรือไม่
     """
     # ดึงข้อมูลพร้อม features
-    df, _ = get_training_data(symbol=symbol, interval=timeframe, limit=WINDOW + 100)
-    data = df[FEATURE_COLUMNS].values
+    df, _ = get_features(symbol=symbol, interval=timeframe, limit=WINDOW + 100)
+    current_price = float(df["close"].iloc[-1])
+    status = (was_stale(df),) if with_stale else ()
     
     # ถ้าไม่มีโมเดล ให้คืนค่าราคาปัจจุบัน
-    if timeframe not in models:
-        current = float(data[-1, 0])  # คอลัมน์แรกคือ close
-        return current, current
-    
-    model = models[timeframe]
+    key = resolve_model(symbol, timeframe)
+    if key is None:
+        return (current_price, current_price, *status)
     
-    # ใช้ Dynamic Scaling
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    scaled = scaler.fit_transform(data)
+    # ใช้ Dynamic Scaling (float32 ตลอดทาง)
+    data = df[FEATURE_COLUMNS].to_numpy(dtype=INFERENCE_DTYPE)
+    mn, rng = _fit_scaling(data)
     
-    # เตรียม input sequence
-    X = scaled[-WINDOW:].reshape(1, WINDOW, len(FEATURE_COLUMNS))
+    # เตรียม input sequence ลง buffer เดิมของ thread
+    X = _scratch_buffer("price_X", (1, WINDOW, len(FEATURE_COLUMNS)))
+    np.subtract(data[-WINDOW:], mn, out=X[0])
+    np.divide(X[0], rng, out=X[0])
     
-    # ทำนาย
-    pred_scaled = model.predict(X, verbose=0)
+    # ทำนาย (รวม batch กับคำขออื่นที่เข้ามาพร้อมกัน)
+    pred_scaled = _infer(key, X)
     
     # แปลงกลับเป็นราคาจริง
-    dummy = np.zeros((1, len(FEATURE_COLUMNS)))
-    dummy[0, 0] = pred_scaled[0, 0]
-    pred = scaler.inverse_transform(dummy)
+    predicted_price = float(_unscale_close(pred_scaled, mn, rng)[0])
+    
+    return (current_price, predicted_price, *status)
+
+
+def _format_time(ms):
+    """แปลงเวลา (ms) เป็น label ของกราฟ"""
+    return datetime.fromtimestamp(ms / 1000).strftime("%H:%M")
+
+
+def _history_start(times, since, minimum):
+    """หา index ของแท่งแรกที่ต้องคืนค่า (แท่งที่เปิดตั้งแต่ since)"""
+    if since is None:
+        return minimum
+    return max(minimum, int(np.searchsorted(times, since)))
+
+
+def _fallback_history(df, history_limit, since, timeframe="1h", horizon=1):
+    """ผลลัพธ์กรณีไม่มีโมเดล: คืนค่าราคาจริงเท่านั้น"""
+    data = df[FEATURE_COLUMNS].values
+    times = df["time"].values
     
-    current_price = float(data[-1, 0])
-    predicted_price = float(pred[0, 0])
+    start = _history_start(times, since, len(data) - history_limit)
+    actual_prices = [float(p) for p in data[start:, 0]]
+    timestamps = [int(t) for t in times[start:]]
+    current = actual_prices[-1] if actual_prices else float(data[-1, 0])
     
-    return current_price, predicted_price
+    return {
+        "times": [_format_time(t) for t in timestamps],
+        "timestamps": timestamps,
+        "actual_prices": actual_prices,
+        "predicted_prices": actual_prices,
+        "current": current,
+        "predicted": current,
+        **_forecast_fields(times[-1], timeframe, [current] * horizon),
+        "next_cursor": int(times[-1])
+    }
 
 
-def predict_with_history(symbol: str = "BTCUSDT", timeframe: str = "1h", history_limit: int = 50):
+def _history_context(df, since):
     """
-    ทำนายราคาพร้อมคืนค่าข้อมูลย้อนหลังสำหรับแสดงกราฟ
+    เตรียมข้อมูลสำหรับทำนายย้อนหลัง: Dynamic Scaling และ input windows ทั้งหมด
+    (หนึ่ง window ต่อแท่งที่ต้องแสดง + หนึ่ง window สำหรับจุดอนาคต) รวมเป็น array เดียว
     """
-    # ดึงข้อมูลพร้อม features
-    df, _ = get_training_data(symbol=symbol, interval=timeframe, limit=history_limit + WINDOW + 50)
-    data = df[FEATURE_COLUMNS].values
+    data = df[FEATURE_COLUMNS].to_numpy(dtype=INFERENCE_DTYPE)
     times = df["time"].values
     
-    # ถ้าไม่มีโมเดล ให้คืนค่าราคาจริงเท่านั้น
-    if timeframe not in models:
-        actual_prices = [float(p) for p in data[-history_limit:, 0]]
-        time_labels = []
-        for t in times[-history_limit:]:
-            dt = datetime.fromtimestamp(t / 1000)
-            time_labels.append(dt.strftime("%H:%M"))
-        
-        return {
-            "times": time_labels,
-            "actual_prices": actual_prices,
-            "predicted_prices": actual_prices,
-            "current": actual_prices[-1],
-            "predicted": actual_prices[-1]
-        }
-    
-    model = models[timeframe]
-    
-    # ใช้ Dynamic Scaling
-    scaler = MinMaxScaler(feature_range=(0, 1))
-    scaled = scaler.fit_transform(data)
-    
-    # สร้าง predictions
-    actual_prices = []
-    predicted_prices = []
-    time_labels = []
-    
-    for i in range(WINDOW, len(scaled)):
-        # สร้าง input sequence
-        X = scaled[i-WINDOW:i].reshape(1, WINDOW, len(FEATURE_COLUMNS))
-        
-        # ทำนาย
-        pred_scaled = model.predict(X, verbose=0)
-        
-        # แปลงกลับเป็นราคาจริง
-        dummy = np.zeros((1, len(FEATURE_COLUMNS)))
-        dummy[0, 0] = pred_scaled[0, 0]
-        pred = scaler.inverse_transform(dummy)[0, 0]
+    # ใช้ Dynamic Scaling (ผลลัพธ์ชั่วคราวเขียนลง buffer เดิม เพราะ X ด้านล่างเป็นสำเนาอยู่แล้ว)
+    mn, rng = _fit_scaling(data)
+    scaled = _scratch_buffer("history_scaled", data.shape)
+    np.subtract(data, mn, out=scaled)
+    np.divide(scaled, rng, out=scaled)
+    
+    # window ที่ k คือ scaled[k:k+WINDOW] ใช้ทำนายแท่งที่ k+WINDOW (แท่งสุดท้าย = จุดอนาคต)
+    start = _history_start(times, since, WINDOW)
+    windows = np.lib.stride_tricks.sliding_window_view(scaled, WINDOW, axis=0)
+    X = np.ascontiguousarray(windows[start - WINDOW:].transpose(0, 2, 1))
+    
+    return {"close": df["close"].to_numpy(dtype=np.float64), "times": times, "mn": mn, "rng": rng, "start": start, "X": X}
+
+
+def _forecast_fields(last_time, timeframe, prices):
+    """ราคาที่ทำนายล่วงหน้าหลายแท่ง (แท่งแรก = predicted) พร้อมเวลาเปิดของแต่ละแท่ง"""
+    step = interval_to_ms(timeframe)
+    return {
+        "forecast_timestamps": [int(last_time) + step * (k + 1) for k in range(len(prices))],
+        "forecast_prices": [float(p) for p in prices]
+    }
+
+
+def _ema_at(close, macd, i):
+    """
+    กู้ค่า (ema_12, ema_26) ของแถว i จาก close/macd ของแถว i และ i+1
+    (Features เก็บเพียง macd = ema_12 - ema_26 แต่ EMA ทั้งสองเป็น recursion ที่รู้สัมประสิทธิ์)
+    """
+    a12, a26 = 2 / 13, 2 / 27
+    # macd[i+1] = (a12 - a26) * close[i+1] + (a26 - a12) * ema_12[i] + (1 - a26) * macd[i]
+    ema_12 = (macd[i + 1] - (a12 - a26) * close[i + 1] - (1 - a26) * macd[i]) / (a26 - a12)
+    return ema_12, ema_12 - macd[i]
+
+
+def _rollout_state(df, ctx, timeframe):
+    """สถานะสำหรับทำนายต่อหลายแท่ง: แท่งจริงท้ายสุด (OHLCV), EMA, window ล่าสุด และ scaling เดิม"""
+    data = df[FEATURE_COLUMNS].to_numpy(dtype=np.float64)[-ROLLOUT_CONTEXT:]
+    times = df["time"].to_numpy()[-ROLLOUT_CONTEXT:]
+    
+    # ใช้เฉพาะช่วงท้ายที่แท่งต่อเนื่องกัน (แถวที่ถูกตัดเพราะ Feature เป็น NaN ทำให้บริบทขาด)
+    gaps = np.flatnonzero(np.diff(times) != interval_to_ms(timeframe))
+    if len(gaps):
+        data = data[gaps[-1] + 1:]
+    
+    close = data[:, FEATURE_COLUMNS.index("close")]
+    macd = data[:, FEATURE_COLUMNS.index("macd")]
+    return {
+        "ohlcv": data[:, [FEATURE_COLUMNS.index(c) for c in RAW_COLUMNS]],
+        "ema_seed": _ema_at(close, macd, 0) if len(data) > 1 else None,
+        "usable": len(data) > INDICATOR_WARMUP,
+        "window": ctx["X"][-1].copy(),
+        "mn": ctx["mn"],
+        "rng": ctx["rng"]
+    }
+
+
+def _rollout(key, states, first_scaled, horizon):
+    """
+    ทำนายต่อแบบ autoregressive หลายเหรียญพร้อมกัน (ใช้โมเดล key เดียวกัน)
+    
+    แต่ละรอบสร้างแท่งสมมติจากราคาที่ทำนาย (open = close ก่อนหน้า, volume เท่าเดิม)
+    คำนวณ Features ของแท่งนั้นต่อจากบริบทเดิม เลื่อน window แล้วรัน forward pass เดียวของทุกเหรียญ
+    ไม่มีการดึงข้อมูลใหม่ - จำนวน forward pass เท่ากับ horizon - 1
+    
+    Returns:
+        array ราคา shape (len(states), horizon)
+    """
+    paths = np.empty((len(states), horizon))
+    scaled = np.asarray(first_scaled[:, 0], dtype=np.float64)
+    windows = np.stack([state["window"] for state in states])
+    
+    for k in range(horizon):
+        for i, state in enumerate(states):
+            paths[i, k] = scaled[i] * float(state["rng"][0]) + float(state["mn"][0])
+        if k == horizon - 1:
+            break
         
-        # เก็บค่า
-        actual_prices.append(float(data[i, 0]))
-        predicted_prices.append(float(pred))
+        for i, state in enumerate(states):
+            if state["usable"]:
+                last_close, volume = state["ohlcv"][-1, 3], state["ohlcv"][-1, 4]
+                price = paths[i, k]
+                candle = [last_close, max(last_close, price), min(last_close, price), price, volume]
+                state["ohlcv"] = np.vstack([state["ohlcv"], candle])
+                features = compute_features(state["ohlcv"], ema_seed=state["ema_seed"])[-1, :len(FEATURE_COLUMNS)]
+                new_row = (features - state["mn"]) / state["rng"]
+            else:
+                # บริบทไม่พอคำนวณ indicators: ใช้ Features ของแท่งก่อนหน้าซ้ำ
+                new_row = windows[i, -1].copy()
+            windows[i, :-1] = windows[i, 1:]
+            windows[i, -1] = new_row
         
-        # แปลงเวลา
-        dt = datetime.fromtimestamp(times[i] / 1000)
-        time_labels.append(dt.strftime("%H:%M"))
-    
-    # ทำนายจุดถัดไป (อนาคต)
-    current_price = float(data[-1, 0])
-    X_final = scaled[-WINDOW:].reshape(1, WINDOW, len(FEATURE_COLUMNS))
-    next_pred_scaled = model.predict(X_final, verbose=0)
-    
-    dummy = np.zeros((1, len(FEATURE_COLUMNS)))
-    dummy[0, 0] = next_pred_scaled[0, 0]
-    next_predicted = float(scaler.inverse_transform(dummy)[0, 0])
-    
-    # เพิ่มจุดทำนายอนาคต
-    predicted_prices.append(next_predicted)
-    actual_prices.append(current_price)
-    
-    # เพิ่ม label เวลาอนาคต
-    last_time = datetime.fromtimestamp(times[-1] / 1000)
-    if timeframe == "5m":
-        future_minutes = 5
-    elif timeframe == "1h":
-        future_minutes = 60
-    else:  # 4h
-        future_minutes = 240
-    
-    future_time = last_time + timedelta(minutes=future_minutes)
-    time_labels.append(future_time.strftime("%H:%M"))
+        scaled = np.array(_infer(key, windows)[:, 0], dtype=np.float64)
     
+    return paths
+
+
+def _confidence_bands(key, ctx, confidence):
+    """
+    ช่วงความเชื่อมั่นของราคาที่ทำนายจากทุก window ด้วย MC Dropout (MC_DROPOUT_SAMPLES × windows ใน forward pass เดียว)
+    seed มาจากเวลาแท่งล่าสุด คำขอซ้ำของแท่งเดียวกันจึงได้ช่วงเดิม (สอดคล้องกับ ETag) - None = โมเดลไม่มี Dropout
+    """
+    samples = batcher.predict(key, ctx["X"], samples=MC_DROPOUT_SAMPLES, seed=int(ctx["times"][-1]))
+    if samples is None:
+        return None
+    prices = samples.astype(np.float64) * float(ctx["rng"][0]) + float(ctx["mn"][0])
+    tail = (1 - confidence) / 2
+    lower, median, upper = np.quantile(prices, [tail, 0.5, 1 - tail], axis=0)
     return {
-        "times": time_labels,
+        "confidence": confidence,
+        "samples": MC_DROPOUT_SAMPLES,
+        "lower": [float(p) for p in lower],
+        "median": [float(p) for p in median],
+        "upper": [float(p) for p in upper]
+    }
+
+
+def _history_result(ctx, pred_scaled, timeframe, path=None, bands=None):
+    """
+    แปลงผลทำนาย (scaled) ของทุก window กลับเป็นราคาจริงและจัดรูปแบบสำหรับกราฟ
+    path = ราคาที่ทำนายล่วงหน้าหลายแท่ง (None = แท่งเดียว)
+    bands = ช่วงความเชื่อมั่นจาก _confidence_bands (None = ไม่ได้ขอ)
+    """
+    close, times, start = ctx["close"], ctx["times"], ctx["start"]
+    
+    # แปลงกลับเป็นราคาจริง
+    preds = _unscale_close(pred_scaled, ctx["mn"], ctx["rng"])
+    
+    current_price = float(close[-1])
+    next_predicted = float(preds[-1])
+    
+    # เพิ่มจุดทำนายอนาคตต่อท้ายแท่งจริง
+    timestamps = [int(t) for t in times[start:]]
+    timestamps.append(int(times[-1]) + interval_to_ms(timeframe))
+    actual_prices = [float(p) for p in close[start:]] + [current_price]
+    
+    result = {
+        "times": [_format_time(t) for t in timestamps],
+        "timestamps": timestamps,
         "actual_prices": actual_prices,
-        "predicted_prices": predicted_prices,
+        "predicted_prices": [float(p) for p in preds],
         "current": current_price,
-        "predicted": next_predicted
+        "predicted": next_predicted,
+        **_forecast_fields(times[-1], timeframe, [next_predicted] if path is None else path),
+        "next_cursor": int(times[-1])
     }
+    if bands is not None:
+        result["bands"] = bands
+    return result
+
+
+def predict_with_history(symbol: str = "BTCUSDT", timeframe: str = "1h", history_limit: int = 50, since=None,
+                         horizon: int = 1, confidence: float = 0.0):
+    """
+    ทำนายราคาพร้อมคืนค่าข้อมูลย้อนหลังสำหรับแสดงกราฟ
+    
+    ถ้าระบุ since (เวลาเปิดแท่งเทียนล่าสุดที่ client มีอยู่, ms) จะคืนเฉพาะแท่งที่เปิดตั้งแต่เวลานั้น
+    (รวมแท่งเดิมซึ่งอาจยังไม่ปิด) และรันโมเดลเฉพาะแท่งเหล่านั้น
+    ข้อมูลที่ใช้ Scaling ยังเป็นชุดเดิม ค่าที่ได้จึงตรงกับการโหลดทั้งกราฟ
+    
+    horizon = จำนวนแท่งที่ทำนายล่วงหน้า (forecast_prices) โดยทำนายต่อจากข้อมูลชุดเดียวกัน
+    confidence = ระดับความเชื่อมั่นของช่วงราคา (เช่น 0.9) จาก MC Dropout - คืนใน "bands" (0 = ไม่คำนวณ)
+    ผลลัพธ์มี "stale" = ข้อมูลที่ดึงในคำขอนี้มาจากข้อมูลสำรองหรือไม่
+    """
+    horizon = max(1, min(int(horizon), MAX_HORIZON))
+    
+    # ดึงข้อมูลพร้อม features
+    df, _ = get_features(symbol=symbol, interval=timeframe, limit=history_limit + WINDOW + 50)
+    
+    # ถ้าไม่มีโมเดล ให้คืนค่าราคาจริงเท่านั้น
+    key = resolve_model(symbol, timeframe)
+    if key is None:
+        return {**_fallback_history(df, history_limit, since, timeframe, horizon), "stale": was_stale(df)}
+    
+    # ทำนายทุก window ใน forward pass เดียว
+    ctx = _history_context(df, since)
+    pred_scaled = _infer(key, ctx["X"])
+    
+    path = None
+    if horizon > 1:
+        path = _rollout(key, [_rollout_state(df, ctx, timeframe)], pred_scaled[-1:], horizon)[0]
+    
+    bands = _confidence_bands(key, ctx, confidence) if confidence else None
+    return {**_history_result(ctx, pred_scaled, timeframe, path, bands), "stale": was_stale(df)}
+
+
+def predict_batch(pairs, history_limit: int = 50, horizon: int = 1):
+    """
+    ทำนายหลายเหรียญ/หลาย timeframe ในครั้งเดียว
+    
+    Args:
+        pairs: รายการ (symbol, timeframe)
+        horizon: จำนวนแท่งที่ทำนายล่วงหน้า
+    
+    Returns:
+        Dict {(symbol, timeframe): ผลลัพธ์แบบเดียวกับ predict_with_history (รวม "stale") หรือ {"error": ...}}
+    
+    ดึงข้อมูลแต่ละชุด (symbol, timeframe) เพียงครั้งเดียว แล้วรวม windows ของทุกเหรียญ
+    ที่ใช้โมเดลเดียวกันเป็น batch เดียวก่อนส่งเข้าโมเดล (รวมถึงทุกรอบของการทำนายล่วงหน้า)
+    """
+    horizon = max(1, min(int(horizon), MAX_HORIZON))
+    results = {}
+    contexts = {}
+    stale = {}
+    
+    for symbol, timeframe in dict.fromkeys(pairs):
+        try:
+            df, _ = get_features(symbol=symbol, interval=timeframe, limit=history_limit + WINDOW + 50)
+            stale[(symbol, timeframe)] = was_stale(df)
+            key = resolve_model(symbol, timeframe)
+            if key is None:
+                results[(symbol, timeframe)] = _fallback_history(df, history_limit, None, timeframe, horizon)
+            else:
+                ctx = _history_context(df, None)
+                state = _rollout_state(df, ctx, timeframe) if horizon > 1 else None
+                contexts.setdefault((key, timeframe), []).append((symbol, ctx, state))
+        except Exception as e:
+            results[(symbol, timeframe)] = {"error": str(e)}
+    
+    # หนึ่ง forward pass ต่อโมเดล (และต่อรอบของการทำนายล่วงหน้า)
+    for (key, timeframe), group in contexts.items():
+        try:
+            X = np.concatenate([ctx["X"] for _, ctx, _ in group])
+            pred_scaled = _infer(key, X)
+            
+            ends = np.cumsum([len(ctx["X"]) for _, ctx, _ in group])
+            paths = [None] * len(group)
+            if horizon > 1:
+                paths = _rollout(key, [state for _, _, state in group], pred_scaled[ends - 1], horizon)
+        except Exception as e:
+            # โมเดลโหลดไม่ได้/forward pass ล้มเหลว: แจ้ง error เฉพาะคู่ที่ใช้โมเดลนี้ คู่อื่นยังได้ผลตามปกติ
+            for symbol, _, _ in group:
+                results[(symbol, timeframe)] = {"error": str(e)}
+            continue
+        
+        for (symbol, ctx, _), end, path in zip(group, ends, paths):
+            results[(symbol, timeframe)] = _history_result(ctx, pred_scaled[end - len(ctx["X"]):end], timeframe, path)
+    
+    for pair, pair_stale in stale.items():
+        if "error" not in results[pair]:
+            results[pair]["stale"] = pair_stale
+    return results
+
+
+def predict_series(symbol: str = "BTCUSDT", timeframe: str = "1h", limit: int = 5000):
+    """
+    ทำนายราคาถัดไป ณ ทุกแท่งในประวัติยาวๆ แบบเดียวกับที่ predict_price ทำตอนแท่งนั้นเป็นแท่งล่าสุด
+    (Dynamic Scaling จาก SCALING_ROWS แถวล่าสุดของแต่ละแท่ง) โดยรวม windows เป็น batch ใหญ่
+    
+    Returns:
+        Tuple (times, close, forecast) - forecast[t] คือราคาที่ทำนายไว้สำหรับแท่ง t+1
+        (NaN ถ้าข้อมูลก่อนหน้าไม่พอหรือไม่มีโมเดล)
+    """
+    df, _ = get_features(symbol=symbol, interval=timeframe, limit=limit)
+    data = df[FEATURE_COLUMNS].to_numpy(dtype=INFERENCE_DTYPE)
+    times = df["time"].values
+    close = df["close"].to_numpy(dtype=np.float64)
+    forecast = np.full(len(data), np.nan)
+    
+    key = resolve_model(symbol, timeframe)
+    if key is None or len(data) < SCALING_ROWS:
+        return times, close, forecast
+    
+    model = models[key]
+    
+    # min/max ของ SCALING_ROWS แถวล่าสุด ณ แต่ละแท่ง (แถว j ของผลลัพธ์ = แท่ง j + SCALING_ROWS - 1)
+    scaling_view = np.lib.stride_tricks.sliding_window_view(data, SCALING_ROWS, axis=0)
+    mins = scaling_view.min(axis=-1)
+    ranges = scaling_view.max(axis=-1) - mins
+    ranges[ranges == 0] = 1  # เหมือน MinMaxScaler เมื่อ feature มีค่าคงที่
+    
+    # window ที่ k = data[k:k+WINDOW] ใช้ทำนายหลังแท่ง k + WINDOW - 1
+    windows = np.lib.stride_tricks.sliding_window_view(data, WINDOW, axis=0).transpose(0, 2, 1)
+    offset = SCALING_ROWS - WINDOW
+    
+    for j in range(0, len(mins), SERIES_CHUNK):
+        mn = mins[j:j + SERIES_CHUNK]
+        rng = ranges[j:j + SERIES_CHUNK]
+        X = _scratch_buffer("series_X", (len(mn), WINDOW, len(FEATURE_COLUMNS)))
+        np.subtract(windows[j + offset:j + offset + len(mn)], mn[:, None, :], out=X)
+        np.divide(X, rng[:, None, :], out=X)
+        pred_scaled = model.predict(X, batch_size=min(len(X), 1024), verbose=0)
+        forecast[j + SCALING_ROWS - 1:j + SCALING_ROWS - 1 + len(mn)] = (
+            pred_scaled[:, 0].astype(np.float64) * rng[:, 0] + mn[:, 0]
+        )
+    
+    return times, close, forecast
+
+
+def predict_candles(timeframe, candles):
+    """
+    ทำนายราคาถัดไป ณ แท่งที่ระบุในอดีตของหลายเหรียญใน timeframe เดียว (ใช้ backfill ผลทำนายที่พลาดไป)
+    แต่ละแท่งใช้ Dynamic Scaling จาก SCALING_ROWS แถวล่าสุด ณ แท่งนั้นเหมือน predict_series และ windows
+    ของทุกเหรียญที่ใช้โมเดลเดียวกันถูกรวมเป็น batch เดียว
+
+    Args:
+        candles: {symbol: [เวลาเปิดแท่ง (ms), ...]}
+
+    Returns:
+        {symbol: CandleList [(เวลาเปิดแท่ง, ราคาปิดของแท่งนั้น, ราคาที่ทำนายสำหรับแท่งถัดไป), ...]}
+        (was_stale(ผลของ symbol) = ข้อมูลที่ใช้มาจากข้อมูลสำรอง)
+        (ข้ามแท่งที่ไม่มีในข้อมูลหรือข้อมูลก่อนหน้าไม่พอ - ไม่มีโมเดลจะคืนราคาปัจจุบันแบบเดียวกับ predict_price)
+    """
+    step = interval_to_ms(timeframe)
+    groups = {}  # model key -> [(symbol, indices, close, X)]
+    results = {}
+    for symbol, wanted in candles.items():
+        if not wanted:
+            continue
+        limit = (clock.now_ms() - min(wanted)) // step + SCALING_ROWS + INDICATOR_WARMUP + 1
+        df, _ = get_features(symbol=symbol, interval=timeframe, limit=limit)
+        data = df[FEATURE_COLUMNS].to_numpy(dtype=INFERENCE_DTYPE)
+        times = df["time"].to_numpy(dtype=np.int64)
+        close = df["close"].to_numpy(dtype=np.float64)
+        stale = was_stale(df)
+
+        idx = np.searchsorted(times, np.asarray(sorted(wanted), dtype=np.int64))
+        idx = idx[idx < len(times)]
+        idx = idx[np.isin(times[idx], wanted) & (idx >= SCALING_ROWS - 1)]
+        if len(idx) == 0:
+            results[symbol] = CandleList(stale=stale)
+            continue
+
+        key = resolve_model(symbol, timeframe)
+        if key is None:
+            results[symbol] = CandleList([(int(times[i]), float(close[i]), float(close[i])) for i in idx], stale=stale)
+            continue
+
+        scaling = np.lib.stride_tricks.sliding_window_view(data, SCALING_ROWS, axis=0)[idx - SCALING_ROWS + 1]
+        mn = scaling.min(axis=-1)
+        rng = scaling.max(axis=-1) - mn
+        rng[rng == 0] = 1
+        windows = np.lib.stride_tricks.sliding_window_view(data, WINDOW, axis=0)[idx - WINDOW + 1].transpose(0, 2, 1)
+        X = (windows - mn[:, None, :]) / rng[:, None, :]
+        groups.setdefault(key, []).append((symbol, times[idx], close[idx], X, mn[:, 0], rng[:, 0], stale))
+
+    for key, group in groups.items():
+        X = np.concatenate([item[3] for item in group])
+        pred_scaled = models[key].predict(X, batch_size=min(len(X), 1024), verbose=0)[:, 0].astype(np.float64)
+        offset = 0
+        for symbol, candle_times, closes, part, mn, rng, stale in group:
+            predicted = pred_scaled[offset:offset + len(part)] * rng + mn
+            offset += len(part)
+            results[symbol] = CandleList(zip(candle_times.tolist(), closes.tolist(), predicted.tolist()), stale=stale)
+    return results
@@ -1,7 +1,7 @@
 import numpy as np
-from data_service import get_klines
+from data_service import get_klines, was_stale
 
-def backtest(symbol: str = "BTCUSDT", timeframe: str = "1h"):
+def backtest(symbol: str = "BTCUSDT", timeframe: str = "1h", with_stale: bool = False):
     """
     รันการทดสอบย้อนหลัง (Backtest) แบบง่าย โดยใช้ Naive Prediction (ใช้ราคาก่อนหน้า)
     เพื่อใช้เป็นค่าพื้นฐาน (Baseline) เปรียบเทียบกับ AI Model
@@ -9,6 +9,7 @@ def backtest(symbol: str = "BTCUSDT", timeframe: str = "1h"):
     Args:
         symbol: คู่เหรียญ (เช่น BTCUSDT, ETHUSDT)
         timeframe: ช่วงเวลา (5m, 1h, 4h)
+        with_stale: คืนค่าสถานะ stale ของข้อมูลที่ใช้ต่อท้ายด้วย
     
     Returns:
         Tuple ของ (mae, rmse)
@@ -28,4 +29,6 @@ def backtest(symbol: str = "BTCUSDT", timeframe: str = "1h"):
     mae = np.mean(np.abs(y_true - y_pred))
     rmse = np.sqrt(np.mean((y_true - y_pred) ** 2))
     
+    if with_stale:
+        return float(mae), float(rmse), was_stale(df)
     return float(mae), float(rmse)
@@ -0,0 +1,51 @@
+"""
+นาฬิกากลางของระบบ
+ทุกส่วนที่ต้องใช้ "เวลาปัจจุบัน" (data_service, scheduler, main, db) ให้เรียกผ่านโมดูลนี้
+เพื่อให้โหมด Replay แทนที่ด้วยนาฬิกาจำลองที่เดินเร็วกว่าเวลาจริงได้
+"""
+
+import time as _time
+from datetime import datetime
+
+
+class SimulatedClock:
+    """นาฬิกาจำลอง: เวลาจะเปลี่ยนเมื่อสั่ง set() หรือ advance() เท่านั้น"""
+
+    def __init__(self, start: float):
+        self._now = float(start)
+
+    def time(self) -> float:
+        return self._now
+
+    def set(self, timestamp: float):
+        self._now = float(timestamp)
+
+    def advance(self, seconds: float):
+        self._now += seconds
+
+
+# None = ใช้เวลาจริงของเครื่อง
+_clock = None
+
+
+def use_clock(clock):
+    """เปลี่ยนนาฬิกาของทั้งระบบ (ส่ง None เพื่อกลับไปใช้เวลาจริง)"""
+    global _clock
+    _clock = clock
+
+
+def time() -> float:
+    """เวลาปัจจุบัน (epoch วินาที)"""
+    if _clock is not None:
+        return _clock.time()
+    return _time.time()
+
+
+def now_ms() -> int:
+    """เวลาปัจจุบัน (epoch มิลลิวินาที) รูปแบบเดียวกับเวลาแท่งเทียนของ Binance"""
+    return int(time() * 1000)
+
+
+def now() -> datetime:
+    """เวลาปัจจุบันแบบ datetime (local time เหมือน datetime.now())"""
+    return datetime.fromtimestamp(time())
@@ -1,13 +1,492 @@
 import requests
 import pandas as pd
 import numpy as np
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import clock
+import rate_limit
+from scipy.signal import lfilter
 from datetime import datetime
 
-def get_klines(symbol="BTCUSDT", interval="1h", limit=300):
-    """ดึงข้อมูลแท่งเทียนพื้นฐานสำหรับการทำนาย"""
-    url = "https://api.binance.com/api/v3/klines"
+logger = logging.getLogger("data_service")
+
+BINANCE_KLINES_URL = "https://api.binance.com/api/v3/klines"
+
+# ความยาวของแท่งเทียนแต่ละ Timeframe (นาที)
+INTERVAL_MINUTES = {
+    "5m": 5,
+    "15m": 15,
+    "1h": 60,
+    "4h": 240,
+    "1d": 1440
+}
+
+
+def interval_to_ms(interval):
+    """แปลง Timeframe เป็นความยาวแท่งเทียนหน่วยมิลลิวินาที"""
+    return INTERVAL_MINUTES[interval] * 60 * 1000
+
+
+# ============================================================================
+# แหล่งข้อมูลแท่งเทียน: Binance (ปกติ) หรือไฟล์ที่บันทึกไว้ (โหมด Replay)
+# ============================================================================
+
+# โฟลเดอร์ไฟล์ Replay ({symbol}_{interval}.json) - None = ดึงจาก Binance
+_replay_dir = os.environ.get("REPLAY_DATA_DIR") or None
+_replay_cache = {}
+
+
+def set_replay_source(directory):
+    """เปิดโหมด Replay ให้ดึงแท่งเทียนจากไฟล์ในโฟลเดอร์ที่ระบุ (None = กลับไปใช้ Binance)"""
+    global _replay_dir
+    _replay_dir = directory
+    _replay_cache.clear()
+
+
+def replay_active():
+    """กำลังเล่นข้อมูลจากไฟล์ Replay อยู่หรือไม่"""
+    return _replay_dir is not None
+
+
+def replay_file_path(directory, symbol, interval):
+    """ตำแหน่งไฟล์แท่งเทียนที่บันทึกไว้ของ symbol/interval"""
+    return os.path.join(directory, f"{symbol}_{interval}.json")
+
+
+def _load_replay_rows(symbol, interval):
+    """โหลดไฟล์ Replay (cache ไว้ในหน่วยความจำ) คืนค่า (เวลาเปิดแท่ง, แถวดิบ)"""
+    key = (symbol, interval)
+    if key not in _replay_cache:
+        with open(replay_file_path(_replay_dir, symbol, interval), encoding="utf-8") as f:
+            rows = json.load(f)
+        _replay_cache[key] = ([int(r[0]) for r in rows], rows)
+    return _replay_cache[key]
+
+
+def _replay_klines(symbol, interval, limit, start_time=None):
+    """
+    จำลอง /api/v3/klines จากไฟล์ที่บันทึกไว้ โดยเห็นเฉพาะแท่งที่เปิดแล้ว ณ เวลาของนาฬิกาจำลอง
+    """
+    times, rows = _load_replay_rows(symbol, interval)
+    now_ms = clock.now_ms()
+    end = bisect.bisect_right(times, now_ms)
+    
+    if start_time is not None:
+        begin = bisect.bisect_left(times, int(start_time))
+        window = rows[begin:min(end, begin + limit)]
+    else:
+        window = rows[max(0, end - limit):end]
+    
+    if window and int(window[-1][0]) + interval_to_ms(interval) > now_ms:
+        window = window[:-1] + [_open_candle_at_now(window[-1])]
+    return window
+
+
+def _open_candle_at_now(row):
+    """
+    ตัดแท่งที่ยังไม่ปิด ณ เวลาจำลอง: ไฟล์เก็บเฉพาะค่าสุดท้ายของแท่ง
+    ราคาเดียวที่รู้แน่ ณ ตอนนี้คือราคาเปิด (ไม่ให้ high/low/close/volume ในอนาคตรั่วเข้าโมเดล)
+    """
+    opened = list(row)
+    opened[2] = opened[3] = opened[4] = row[1]
+    opened[5] = opened[7] = opened[9] = opened[10] = "0"
+    opened[8] = 0
+    return opened
+
+
+# Binance คืนแท่งเทียนได้สูงสุด 1000 แท่งต่อคำขอ
+MAX_KLINES_PER_REQUEST = 1000
+
+
+# Timeout ต่อคำขอ (connect, read) วินาที - ป้องกัน thread ค้างเมื่อ Binance ช้า
+UPSTREAM_TIMEOUT = (3.05, float(os.environ.get("UPSTREAM_READ_TIMEOUT", "5")))
+
+# จำนวนแท่งเทียนล่าสุดที่เก็บไว้ต่อ (symbol, interval) เพื่อใช้ตอน upstream มีปัญหา
+MAX_CACHED_CANDLES = 5000
+
+
+class UpstreamUnavailableError(RuntimeError):
+    """Binance ใช้งานไม่ได้และไม่มีข้อมูลสำรองให้ใช้แทน"""
+
+
+class CircuitBreaker:
+    """
+    Circuit Breaker ของ upstream
+    - closed: เรียกได้ตามปกติ
+    - open: ล้มเหลวติดกันครบ failure_threshold ครั้ง -> หยุดเรียกชั่วคราว (fail fast)
+    - half_open: ครบ reset_timeout แล้ว ปล่อยให้ทดลองเรียก (probe) ได้ครั้งละหนึ่งคำขอ
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or clock.time() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def allow_request(self):
+        """คืนค่า "closed" (เรียกได้), "probe" (คำขอทดลองหลังวงจรเปิด) หรือ None (ห้ามเรียก)"""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if not self._probing and clock.time() - self._opened_at >= self.reset_timeout:
+                self._probing = True
+                return "probe"
+            return None
+    
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Upstream circuit opened after %d failures", self._failures)
+                self._opened_at = clock.time()
+
+
+class CandleList(list):
+    """
+    ผลการดึงแท่งเทียน (หรือผลที่คำนวณจากแท่งเหล่านั้น) พร้อมสถานะ stale ของการดึงครั้งนี้
+    (True = มาจากข้อมูลสำรองเพราะ upstream มีปัญหา) ผู้เรียกอ่านจากผลลัพธ์ที่ได้ ไม่ใช่สถานะกลางของ process
+    """
+
+    def __init__(self, rows=(), stale=False):
+        super().__init__(rows)
+        self.stale = stale
+
+
+def was_stale(data):
+    """ผลลัพธ์จาก fetch_klines / get_klines / get_training_data มาจากข้อมูลสำรองหรือไม่"""
+    if isinstance(data, pd.DataFrame):
+        return bool(data.attrs.get("stale", False))
+    return bool(getattr(data, "stale", False))
+
+
+_breaker = CircuitBreaker()
+# งบ request weight ของ Binance (ใช้ร่วมกันทุกคำขอใน process ระดับความสำคัญอ่านจาก rate_limit.priority)
+_governor = rate_limit.WeightGovernor()
+_last_good = {}
+# ชุดข้อมูลที่การดึงครั้งล่าสุดได้ข้อมูลสำรอง - ใช้แสดงสถานะใน /debug/upstream เท่านั้น
+# (ผู้เรียกต้องใช้ was_stale() ของผลลัพธ์ตัวเอง เพราะ thread อื่นอาจเปลี่ยนค่านี้ได้ตลอด)
+_stale_keys = set()
+_refreshing = set()
+_cache_lock = threading.Lock()
+
+
+def _request_klines(symbol, interval, limit, start_time=None, end_time=None):
+    """เรียก Binance /api/v3/klines หนึ่งครั้ง (มี timeout) หลังได้รับงบ weight จาก governor"""
     params = {"symbol": symbol, "interval": interval, "limit": limit}
-    data = requests.get(url, params=params).json()
+    if start_time is not None:
+        params["startTime"] = int(start_time)
+    if end_time is not None:
+        params["endTime"] = int(end_time)
+    _governor.acquire(rate_limit.klines_weight(limit))
+    response = requests.get(BINANCE_KLINES_URL, params=params, timeout=UPSTREAM_TIMEOUT)
+    _governor.observe(response.headers, response.status_code)
+    response.raise_for_status()
+    data = response.json()
+    if not isinstance(data, list):
+        raise ValueError(f"Unexpected klines response: {data}")
+    return data
+
+
+def _fetch_upstream(symbol, interval, limit, start_time=None):
+    """ดึงจาก Binance โดยแบ่งหน้าอัตโนมัติถ้า limit เกิน 1000"""
+    if limit <= MAX_KLINES_PER_REQUEST:
+        return _request_klines(symbol, interval, limit, start_time)
+    
+    pages = []
+    remaining = limit
+    cursor = start_time
+    end_time = None
+    while remaining > 0:
+        size = min(remaining, MAX_KLINES_PER_REQUEST)
+        if start_time is not None:
+            page = _request_klines(symbol, interval, size, start_time=cursor)
+        else:
+            page = _request_klines(symbol, interval, size, end_time=end_time)
+        if not page:
+            break
+        
+        pages.append(page)
+        remaining -= len(page)
+        if len(page) < size:
+            break
+        if start_time is not None:
+            cursor = int(page[-1][0]) + 1
+        else:
+            end_time = int(page[0][0]) - 1
+    
+    if start_time is None:
+        pages.reverse()
+    return [row for page in pages for row in page]
+
+
+def _remember(key, rows):
+    """เก็บแท่งเทียนล่าสุดที่ดึงสำเร็จ (รวมกับของเดิม แท่งใหม่แทนที่แท่งเวลาเดียวกัน)"""
+    with _cache_lock:
+        merged = {int(r[0]): r for r in _last_good.get(key, [])}
+        merged.update((int(r[0]), r) for r in rows)
+        _last_good[key] = [merged[t] for t in sorted(merged)][-MAX_CACHED_CANDLES:]
+        _stale_keys.discard(key)
+
+
+def _serve_stale(key, limit, start_time):
+    """คืนข้อมูลล่าสุดที่ดึงสำเร็จแทน upstream (และทำเครื่องหมายว่าเป็นข้อมูลเก่า)"""
+    with _cache_lock:
+        rows = _last_good.get(key)
+        if not rows:
+            raise UpstreamUnavailableError(f"Upstream unavailable and no cached klines for {key[0]} {key[1]}")
+        _stale_keys.add(key)
+    
+    if start_time is not None:
+        begin = bisect.bisect_left([int(r[0]) for r in rows], int(start_time))
+        return CandleList(rows[begin:begin + limit], stale=True)
+    return CandleList(rows[-limit:], stale=True)
+
+
+def _refresh_in_background(key, limit, start_time):
+    """ทดลองดึงข้อมูลใหม่ใน background thread (probe ของ circuit breaker) โดยไม่ให้ผู้ใช้รอ"""
+    with _cache_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    
+    def refresh():
+        try:
+            rows = _fetch_upstream(key[0], key[1], limit, start_time)
+            _breaker.record_success()
+            _remember(key, rows)
+        except Exception as e:
+            _breaker.record_failure()
+            logger.warning("Background refresh of %s %s failed: %s", key[0], key[1], e)
+        finally:
+            with _cache_lock:
+                _refreshing.discard(key)
+    
+    # thread ใหม่ไม่สืบทอด contextvar - ส่ง context ปัจจุบันไปด้วยเพื่อคงระดับความสำคัญของคำขอ
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(refresh,), name=f"refresh-{key[0]}-{key[1]}", daemon=True
+    ).start()
+
+
+def get_upstream_status():
+    """สถานะของ circuit breaker, งบ request weight และชุดข้อมูลที่กำลังใช้ข้อมูลเก่า"""
+    return {
+        "circuit": _breaker.state,
+        "stale": sorted(f"{symbol}:{interval}" for symbol, interval in _stale_keys),
+        "cached_series": len(_last_good),
+        "base_series": {symbol: len(series) for symbol, series in _base_series.items()},
+        "rate_limit": _governor.status()
+    }
+
+
+def fetch_klines(symbol="BTCUSDT", interval="1h", limit=500, start_time=None):
+    """
+    ดึงแท่งเทียนดิบ (รูปแบบเดียวกับ Binance /api/v3/klines) จากแหล่งข้อมูลปัจจุบัน
+    ถ้า limit เกิน 1000 จะแบ่งหน้าอัตโนมัติ (ย้อนหลังจากแท่งล่าสุด หรือไปข้างหน้าจาก start_time)
+    เมื่อตั้ง RESAMPLE_BASE_INTERVAL จะสร้าง Timeframe ที่เป็นพหุคูณของแท่งฐานจากแท่งฐานชุดเดียวต่อ symbol
+    
+    คืน CandleList: เมื่อ Binance ช้า/ล้มเหลว จะคืนข้อมูลล่าสุดที่ดึงสำเร็จแทน (was_stale(ผลลัพธ์) = True)
+    และเมื่อ circuit breaker เปิดจะไม่เรียก Binance เลยจนกว่าจะถึงเวลาทดลองใหม่ใน background
+    ถ้างบ request weight ไม่พอภายในเวลารอของระดับความสำคัญ จะใช้ข้อมูลสำรองเช่นกัน (ไม่นับเป็นความล้มเหลวของ upstream)
+    """
+    if _replay_dir is not None:
+        return CandleList(_replay_klines(symbol, interval, limit, start_time))
+    window = _resample_window(interval, limit, start_time)
+    if window is not None:
+        return _resampled_klines(symbol, interval, *window)
+    return _fetch_direct(symbol, interval, limit, start_time)
+
+
+def _fetch_direct(symbol, interval, limit, start_time=None):
+    """ดึง interval นั้นจาก Binance โดยตรง (ผ่าน governor และ circuit breaker พร้อมข้อมูลสำรอง)"""
+    key = (symbol, interval)
+    permit = _breaker.allow_request()
+    if permit is None:
+        return _serve_stale(key, limit, start_time)
+    if permit == "probe" and key in _last_good:
+        _refresh_in_background(key, limit, start_time)
+        return _serve_stale(key, limit, start_time)
+    
+    try:
+        rows = _fetch_upstream(symbol, interval, limit, start_time)
+    except rate_limit.ThrottledError as e:
+        if permit == "probe":
+            _breaker.record_failure()  # คืนสิทธิ์ probe ให้รอบถัดไป
+        logger.warning("Upstream request for %s %s deferred: %s", symbol, interval, e)
+        return _serve_stale(key, limit, start_time)
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status is not None and 400 <= status < 500 and status not in (418, 429):
+            # คำขอผิด (เช่น symbol ไม่ถูกต้อง) ไม่ใช่ปัญหาของ upstream
+            _breaker.record_success()
+            raise
+        _breaker.record_failure()
+        logger.warning("Upstream error for %s %s: %s", symbol, interval, e)
+        return _serve_stale(key, limit, start_time)
+    except (requests.RequestException, ValueError) as e:
+        _breaker.record_failure()
+        logger.warning("Upstream error for %s %s: %s", symbol, interval, e)
+        return _serve_stale(key, limit, start_time)
+    
+    _breaker.record_success()
+    _remember(key, rows)
+    return CandleList(rows)
+
+
+# ============================================================================
+# Resample: สร้าง Timeframe ที่สูงกว่าจากแท่งฐานชุดเดียวต่อ symbol
+# (ดึงแค่แท่งฐานใหม่จาก Binance แล้วรวมเป็น 15m/1h/4h/1d เองแบบ vectorized - เพิ่ม Timeframe ไม่ต้องเรียก upstream เพิ่ม)
+# ============================================================================
+
+# Timeframe ของแท่งฐาน เช่น "1m" หรือ "5m" (ว่าง = ดึงทุก Timeframe จาก Binance แยกกันเหมือนเดิม)
+RESAMPLE_BASE_INTERVAL = os.environ.get("RESAMPLE_BASE_INTERVAL", "")
+# จำนวนแท่งฐานสูงสุดที่เก็บต่อ symbol - คำขอที่ต้องย้อนหลังเกินนี้ (เช่นข้อมูลเทรน) ดึง Timeframe นั้นโดยตรง
+MAX_BASE_CANDLES = int(os.environ.get("MAX_BASE_CANDLES", "12000"))
+# ไม่ดึงแท่งฐานใหม่ซ้ำภายในช่วงนี้ (วินาที) - คำขอหลาย Timeframe พร้อมกันใช้การดึงครั้งเดียว
+BASE_REFRESH_SECONDS = 1.0
+
+_UNIT_MINUTES = {"m": 1, "h": 60, "d": 1440}
+
+# คอลัมน์ของแถว klines ที่เก็บ: 0 open_time, 1-5 OHLCV, 6 close_time, 7 quote_volume, 8 trades,
+# 9 taker_buy_base, 10 taker_buy_quote - คอลัมน์ปริมาณรวมกันได้ตรงๆ เมื่อรวมแท่ง
+KLINE_FIELDS = 11
+_SUM_FIELDS = [5, 7, 8, 9, 10]
+
+_base_series = {}  # symbol -> array (n, KLINE_FIELDS) ของแท่งฐานเรียงตามเวลา
+_base_refreshed = {}  # symbol -> เวลาที่ดึงแท่งฐานล่าสุด
+_base_stale = {}  # symbol -> การดึงแท่งฐานครั้งล่าสุดได้ข้อมูลสำรองหรือไม่ (อ่านพร้อม series ภายใต้ lock)
+_base_lock = threading.Lock()
+
+
+def _interval_minutes(interval):
+    """ความยาว interval (นาที) ทั้งที่อยู่ใน INTERVAL_MINUTES และรูปแบบของ Binance เช่น "1m", "3d" """
+    if interval in INTERVAL_MINUTES:
+        return INTERVAL_MINUTES[interval]
+    return int(interval[:-1]) * _UNIT_MINUTES[interval[-1]]
+
+
+def _is_resampled(interval):
+    """interval นี้สร้างจากแท่งฐานได้หรือไม่ (เปิดโหมด resample และยาวเป็นพหุคูณของแท่งฐาน)"""
+    if not RESAMPLE_BASE_INTERVAL:
+        return False
+    base = _interval_minutes(RESAMPLE_BASE_INTERVAL)
+    return _interval_minutes(interval) % base == 0 and _interval_minutes(interval) <= _UNIT_MINUTES["d"]
+
+
+def _resample_window(interval, limit, start_time):
+    """
+    ช่วงเวลาเปิดแท่ง [first, end) ของคำขอที่ตอบจากแท่งฐานได้ หรือ None ถ้าต้องดึงโดยตรง
+    (ปิดโหมด resample, interval ไม่ใช่พหุคูณ หรือย้อนหลังเกินจำนวนแท่งฐานที่เก็บ)
+    """
+    if not _is_resampled(interval):
+        return None
+    step = _interval_minutes(interval) * 60_000
+    current = clock.now_ms() // step * step
+    if start_time is None:
+        first = current - (limit - 1) * step
+    else:
+        first = -(-int(start_time) // step) * step  # แท่งแรกที่เปิดตั้งแต่ start_time
+    end = min(first + limit * step, current + step)
+    if (current + step - first) // (_interval_minutes(RESAMPLE_BASE_INTERVAL) * 60_000) > MAX_BASE_CANDLES:
+        return None
+    return first, end
+
+
+def resample_klines(base, interval):
+    """
+    รวมแท่งฐาน (array (n, KLINE_FIELDS) เรียงตามเวลา) เป็นแท่งของ interval แบบ vectorized
+    แท่งแบ่งตามเวลา epoch (UTC) เหมือน Binance และแท่งสุดท้ายอาจยังไม่ปิด (รวมเฉพาะแท่งฐานที่มีถึงตอนนี้)
+    """
+    if len(base) == 0:
+        return np.empty((0, KLINE_FIELDS))
+    step = _interval_minutes(interval) * 60_000
+    buckets = base[:, 0].astype(np.int64) // step * step
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(base)] - 1
+
+    out = np.empty((len(starts), KLINE_FIELDS))
+    out[:, 0] = buckets[starts]
+    out[:, 1] = base[starts, 1]
+    out[:, 2] = np.maximum.reduceat(base[:, 2], starts)
+    out[:, 3] = np.minimum.reduceat(base[:, 3], starts)
+    out[:, 4] = base[ends, 4]
+    out[:, 6] = buckets[starts] + step - 1
+    out[:, _SUM_FIELDS] = np.add.reduceat(base[:, _SUM_FIELDS], starts, axis=0)
+    return out
+
+
+def _to_klines(values):
+    """แปลง array กลับเป็นแถวรูปแบบเดียวกับ Binance /api/v3/klines"""
+    return [
+        [int(r[0]), r[1], r[2], r[3], r[4], r[5], int(r[6]), r[7], int(r[8]), r[9], r[10], "0"]
+        for r in values.tolist()
+    ]
+
+
+def _base_candles(symbol, since):
+    """
+    แท่งฐานของ symbol ตั้งแต่เวลา since (ms) ถึงปัจจุบัน คืนค่า (array, stale)
+    ดึงจาก Binance เฉพาะแท่งหลังแท่งล่าสุดที่เก็บไว้ (แท่งล่าสุดถูกดึงซ้ำเพราะอาจยังไม่ปิด)
+    """
+    base_step = _interval_minutes(RESAMPLE_BASE_INTERVAL) * 60_000
+    now = clock.now_ms()
+    with _base_lock:
+        series = _base_series.get(symbol)
+        stale = _base_stale.get(symbol, False)
+        fresh = clock.time() - _base_refreshed.get(symbol, float("-inf")) < BASE_REFRESH_SECONDS
+
+    covered = series is not None and len(series) > 0 and series[0, 0] <= since
+    if not (covered and fresh):
+        fetch_from = int(series[-1, 0]) if covered else since
+        rows = _fetch_direct(symbol, RESAMPLE_BASE_INTERVAL, (now - fetch_from) // base_step + 1, start_time=fetch_from)
+        stale = was_stale(rows)
+        fetched = np.array([row[:KLINE_FIELDS] for row in rows], dtype=np.float64).reshape(-1, KLINE_FIELDS)
+        with _base_lock:
+            series = _base_series.get(symbol)
+            if series is not None and len(fetched):
+                # แท่งที่ดึงใหม่แทนที่แท่งเวลาเดียวกันของเดิม
+                keep = (series[:, 0] < fetched[0, 0]) | (series[:, 0] > fetched[-1, 0])
+                fetched = np.concatenate([series[keep], fetched])
+                fetched = fetched[np.argsort(fetched[:, 0], kind="stable")]
+            if series is None or len(fetched):
+                series = _base_series[symbol] = fetched[-MAX_BASE_CANDLES:]
+            _base_refreshed[symbol] = clock.time()
+            _base_stale[symbol] = stale
+
+    return series[np.searchsorted(series[:, 0], since):], stale
+
+
+def _resampled_klines(symbol, interval, first, end):
+    """แท่งของ interval ที่เปิดในช่วง [first, end) สร้างจากแท่งฐาน"""
+    base, stale = _base_candles(symbol, first)
+    base = base[base[:, 0] < end]
+    return CandleList(_to_klines(resample_klines(base, interval)), stale=stale)
+
+
+def get_klines(symbol="BTCUSDT", interval="1h", limit=300, start_time=None):
+    """ดึงข้อมูลแท่งเทียนพื้นฐานสำหรับการทำนาย (start_time = ดึงเฉพาะแท่งที่เปิดตั้งแต่เวลานี้ ms)"""
+    data = fetch_klines(symbol, interval, limit, start_time)
 
     df = pd.DataFrame(data, columns=[
         "time", "open", "high", "low", "close", "volume",
@@ -17,14 +496,14 @@ def get_klines(symbol="BTCUSDT", interval="1h", limit=300):
     for col in ["open", "high", "low", "close", "volume"]:
         df[col] = df[col].astype(float)
     
-    return df[["time", "close"]]
+    df = df[["time", "close"]]
+    df.attrs["stale"] = was_stale(data)
+    return df
 
 
-def get_ohlcv_data(symbol="BTCUSDT", interval="1h", limit=50):
-    """ดึงข้อมูล OHLCV สำหรับตารางประวัติ"""
-    url = "https://api.binance.com/api/v3/klines"
-    params = {"symbol": symbol, "interval": interval, "limit": limit}
-    data = requests.get(url, params=params).json()
+def get_ohlcv_data(symbol="BTCUSDT", interval="1h", limit=50, start_time=None):
+    """ดึงข้อมูล OHLCV สำหรับตารางประวัติ (start_time = ดึงเฉพาะแท่งที่เปิดตั้งแต่เวลานี้ ms)"""
+    data = fetch_klines(symbol, interval, limit, start_time)
     
     result = []
     for row in data:
@@ -32,6 +511,7 @@ def get_ohlcv_data(symbol="BTCUSDT", interval="1h", limit=50):
         dt = datetime.fromtimestamp(timestamp / 1000)
         
         result.append({
+            "timestamp": timestamp,
             "date": dt.strftime("%Y-%m-%d"),
             "time": dt.strftime("%H:%M:%S"),
             "open": float(row[1]),
@@ -43,58 +523,166 @@ def get_ohlcv_data(symbol="BTCUSDT", interval="1h", limit=50):
         })
     
     # ส่งคืนข้อมูลเรียงจากใหม่สุดไปเก่าสุด
-    return list(reversed(result))
+    return CandleList(reversed(result), stale=was_stale(data))
+
+
+# คอลัมน์ Feature ที่โมเดลใช้ (ลำดับต้องตรงกับตอนเทรน)
+FEATURE_COLUMNS = [
+    "close", "open", "high", "low", "volume",
+    "price_change", "volatility",
+    "ma_5", "ma_10", "ma_20",
+    "macd", "rsi", "bb_position",
+    "volume_change", "price_position"
+]
+
+# จำนวนแท่งแรกที่ indicator ยังคำนวณไม่ได้ (rolling 20 แท่ง) และถูกตัดทิ้งด้วย dropna
+INDICATOR_WARMUP = 19
+
+
+# คอลัมน์ราคาดิบ (ลำดับเดียวกับในข้อมูลจาก Binance) และคอลัมน์ผลลัพธ์ของ compute_features
+RAW_COLUMNS = ["open", "high", "low", "close", "volume"]
+KERNEL_COLUMNS = FEATURE_COLUMNS + ["ema_12", "ema_26"]
+_COL = {name: i for i, name in enumerate(KERNEL_COLUMNS)}
+
+
+def parse_klines(data, dtype=np.float64):
+    """
+    แปลงข้อมูลดิบจาก Binance เป็น NumPy arrays โดยตรง (ไม่ผ่าน DataFrame แบบ object)
+
+    Returns:
+        (times: int64 shape (n,), ohlcv: dtype shape (n, 5) ตามลำดับ RAW_COLUMNS)
+    """
+    n = len(data)
+    times = np.fromiter((row[0] for row in data), dtype=np.int64, count=n)
+    ohlcv = np.array([row[1:6] for row in data], dtype=dtype).reshape(n, 5)
+    return times, ohlcv
+
+
+def _rolling_mean(values, window, out):
+    """ค่าเฉลี่ยเคลื่อนที่ด้วย cumulative sum (NaN ในช่วง warmup) เขียนผลลง out"""
+    out[:window - 1] = np.nan
+    if len(values) < window:
+        out[:] = np.nan
+        return out
+    # ลบค่าแรกออกก่อน cumsum เพื่อลดความคลาดเคลื่อนจากผลรวมที่ใหญ่มาก
+    base = values[0]
+    csum = np.cumsum(values - base)
+    out[window - 1] = csum[window - 1]
+    out[window:] = csum[window:] - csum[:-window]
+    out[window - 1:] /= window
+    out[window - 1:] += base
+    return out
+
+
+def _ema(values, span, seed=None):
+    """EMA แบบ adjust=False (เหมือน pandas ewm) ด้วย recursive filter - seed คือค่า EMA ของแถวแรก"""
+    alpha = 2.0 / (span + 1)
+    x = values.copy()
+    if seed is not None:
+        x[0] = seed
+    # y[t] = alpha * x[t] + (1 - alpha) * y[t-1] โดยให้ y[0] = x[0]
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], x, zi=[(1.0 - alpha) * x[0]])
+    return y
+
+
+def compute_features(ohlcv, ema_seed=None, out=None):
+    """
+    คำนวณ Features ทั้งหมดจาก OHLCV ลงเมทริกซ์เดียว (แถวช่วง warmup จะเป็น NaN)
+    ให้ผลเท่ากับการคำนวณด้วย pandas (rolling / ewm / pct_change) แบบเดิม
+
+    Args:
+        ohlcv: array shape (n, 5) ตามลำดับ RAW_COLUMNS เรียงตามเวลา
+        ema_seed: (ema_12, ema_26) ของแถวแรก - ใช้ต่อ EMA จากค่าที่คำนวณไว้แล้ว
+                  (None = เริ่ม EMA จากราคาปิดแถวแรก)
+        out: เมทริกซ์ shape (n, len(KERNEL_COLUMNS)) ที่จองไว้แล้ว (None = สร้างใหม่)
+
+    Returns:
+        เมทริกซ์ Features ตามลำดับ KERNEL_COLUMNS
+    """
+    n = len(ohlcv)
+    if out is None:
+        out = np.empty((n, len(KERNEL_COLUMNS)), dtype=ohlcv.dtype)
+    if n == 0:
+        return out
+
+    open_, high, low, close, volume = (ohlcv[:, i] for i in range(5))
+    col = lambda name: out[:, _COL[name]]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        col("close")[:] = close
+        col("open")[:] = open_
+        col("high")[:] = high
+        col("low")[:] = low
+        col("volume")[:] = volume
+
+        col("price_change")[0] = np.nan
+        np.divide(close[1:], close[:-1], out=col("price_change")[1:])
+        col("price_change")[1:] -= 1
+        col("price_change")[1:] *= 100
+        np.divide(high - low, close, out=col("volatility"))
+        col("volatility")[:] *= 100
+
+        for window in (5, 10, 20):
+            _rolling_mean(close, window, col(f"ma_{window}"))
+
+        seeds = ema_seed or (None, None)
+        col("ema_12")[:] = _ema(close, 12, seeds[0])
+        col("ema_26")[:] = _ema(close, 26, seeds[1])
+        np.subtract(col("ema_12"), col("ema_26"), out=col("macd"))
+
+        # RSI: ค่าเฉลี่ย 14 แท่งของส่วนที่ขึ้น/ลง (แท่งแรกไม่มี delta นับเป็น 0 เหมือน pandas where)
+        delta = np.zeros(n, dtype=out.dtype)
+        delta[1:] = close[1:] - close[:-1]
+        rsi = col("rsi")
+        gain = _rolling_mean(np.maximum(delta, 0), 14, np.empty(n, dtype=out.dtype))
+        loss = _rolling_mean(np.maximum(-delta, 0), 14, np.empty(n, dtype=out.dtype))
+        # window ที่ไม่มีแท่งขึ้น/ลงเลยต้องได้ 0 พอดี (กันเศษจากการลบ cumsum)
+        for values, mean in ((delta > 0, gain), (delta < 0, loss)):
+            if n >= 14:
+                counts = np.cumsum(values)
+                in_window = counts[13:] - np.concatenate(([0], counts[:-14]))
+                mean[13:][in_window == 0] = 0.0
+        np.divide(gain, loss, out=rsi)
+        rsi += 1
+        np.divide(100, rsi, out=rsi)
+        np.subtract(100, rsi, out=rsi)
+
+        # Bollinger Bands (std แบบ ddof=1 คำนวณสองรอบต่อ window เพื่อความแม่นยำ)
+        bb = col("bb_position")
+        bb[:] = np.nan
+        if n >= 20:
+            windows = np.lib.stride_tricks.sliding_window_view(close, 20)
+            std = windows.std(axis=1, ddof=1)
+            middle = col("ma_20")[19:]
+            upper = middle + std * 2
+            lower = middle - std * 2
+            np.divide(close[19:] - lower, upper - lower, out=bb[19:])
+            # ราคาคงที่ทั้ง window: pandas ได้ 0/0 = NaN
+            bb[19:][std == 0] = np.nan
+
+        col("volume_change")[0] = np.nan
+        np.divide(volume[1:], volume[:-1], out=col("volume_change")[1:])
+        col("volume_change")[1:] -= 1
+        col("volume_change")[1:] *= 100
+        np.divide(close - low, high - low, out=col("price_position"))
+
+    return out
+
+
+def feature_frame(times, features):
+    """ตัดแถวที่มี Feature เป็น NaN (เหมือน dropna) แล้วแปลงเป็น DataFrame ของ time + FEATURE_COLUMNS"""
+    values = features[:, :len(FEATURE_COLUMNS)]
+    mask = ~np.isnan(values).any(axis=1)
+    df = pd.DataFrame(values[mask], columns=FEATURE_COLUMNS)
+    df.insert(0, "time", times[mask])
+    return df
 
 
 def get_training_data(symbol="BTCUSDT", interval="1h", limit=1000):
     """ดึงข้อมูลสำหรับเทรนโมเดลแบบ Multi-Feature"""
-    url = "https://api.binance.com/api/v3/klines"
-    params = {"symbol": symbol, "interval": interval, "limit": limit}
-    data = requests.get(url, params=params).json()
-
-    df = pd.DataFrame(data, columns=[
-        "time", "open", "high", "low", "close", "volume",
-        "close_time", "quote_volume", "trades", "taker_buy_base", "taker_buy_quote", "ignore"
-    ])
-    
-    for col in ["open", "high", "low", "close", "volume"]:
-        df[col] = df[col].astype(float)
-    
-    # สร้าง Features เพิ่มเติม (Feature Engineering)
-    df["price_change"] = df["close"].pct_change() * 100
-    df["volatility"] = (df["high"] - df["low"]) / df["close"] * 100
-    df["ma_5"] = df["close"].rolling(window=5).mean()
-    df["ma_10"] = df["close"].rolling(window=10).mean()
-    df["ma_20"] = df["close"].rolling(window=20).mean()
-    df["ema_12"] = df["close"].ewm(span=12, adjust=False).mean()
-    df["ema_26"] = df["close"].ewm(span=26, adjust=False).mean()
-    df["macd"] = df["ema_12"] - df["ema_26"]
-    
-    # คำนวณ RSI
-    delta = df["close"].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    df["rsi"] = 100 - (100 / (1 + rs))
-    
-    # คำนวณ Bollinger Bands
-    df["bb_middle"] = df["close"].rolling(window=20).mean()
-    bb_std = df["close"].rolling(window=20).std()
-    df["bb_upper"] = df["bb_middle"] + (bb_std * 2)
-    df["bb_lower"] = df["bb_middle"] - (bb_std * 2)
-    df["bb_position"] = (df["close"] - df["bb_lower"]) / (df["bb_upper"] - df["bb_lower"])
-    
-    df["volume_change"] = df["volume"].pct_change() * 100
-    df["price_position"] = (df["close"] - df["low"]) / (df["high"] - df["low"])
-    
-    df = df.dropna()
-    
-    feature_columns = [
-        "close", "open", "high", "low", "volume",
-        "price_change", "volatility",
-        "ma_5", "ma_10", "ma_20",
-        "macd", "rsi", "bb_position",
-        "volume_change", "price_position"
-    ]
+    data = fetch_klines(symbol, interval, limit)
+    times, ohlcv = parse_klines(data)
+    df = feature_frame(times, compute_features(ohlcv))
+    df.attrs["stale"] = was_stale(data)
     
-    return df[["time"] + feature_columns], feature_columns
+    return df, list(FEATURE_COLUMNS)
@@ -1,13 +1,20 @@
 import sqlite3
+import json
 import logging
+import os
+import clock
+from datetime import datetime, timezone
 
 # ตั้งค่า Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("db")
 
+# ไฟล์ฐานข้อมูล (โหมด Replay จะเปลี่ยนไปใช้ไฟล์แยก)
+DB_PATH = os.environ.get("CRYPTO_AI_DB", "crypto_ai.db")
+
 def get_db():
     """เชื่อมต่อฐานข้อมูล"""
-    conn = sqlite3.connect("crypto_ai.db")
+    conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -16,6 +23,9 @@ def init_db():
     conn = get_db()
     cur = conn.cursor()
     
+    # ฐานข้อมูลใหม่: เปิด incremental vacuum ไว้ตั้งแต่ต้น (ต้องตั้งก่อนสร้างตาราง - ดู retention.py)
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
     # สร้างตาราง predictions หากยังไม่มี
     cur.execute("""
         CREATE TABLE IF NOT EXISTS predictions (
@@ -29,23 +39,317 @@ def init_db():
         )
     """)
     
+    # คอลัมน์สำหรับวัดความแม่นยำจริง (เพิ่มให้ฐานข้อมูลเดิมด้วย): แท่งที่ใช้ทำนาย, แท่งเป้าหมาย,
+    # เวอร์ชันโมเดล และราคาปิดจริงของแท่งเป้าหมาย (NULL = ยังไม่ได้ประเมิน)
+    existing = {row[1] for row in cur.execute("PRAGMA table_info(predictions)").fetchall()}
+    # evaluation_attempts = จำนวนรอบที่ประเมินแล้วหาราคาจริงไม่ได้ (ดู accuracy.MAX_EVALUATION_ATTEMPTS)
+    for column, column_type in [("candle_time", "INTEGER"), ("target_time", "INTEGER"),
+                                ("model_version", "TEXT"), ("actual_price", "REAL"),
+                                ("evaluation_attempts", "INTEGER NOT NULL DEFAULT 0")]:
+        if column not in existing:
+            cur.execute(f"ALTER TABLE predictions ADD COLUMN {column} {column_type}")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_predictions_pending
+        ON predictions (target_time) WHERE actual_price IS NULL AND target_time IS NOT NULL
+    """)
+    
+    # index สำหรับ retention (ตัดตามเวลา) และการอ่านผลทำนายล่าสุดของแต่ละเหรียญ/timeframe
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_predictions_created ON predictions (created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_predictions_latest ON predictions (coin, timeframe, id)")
+    
+    # ผลรวมของแถวที่พ้นช่วงเก็บแถวดิบแล้ว (period = 'hour' หรือ 'day') - ดู retention.py
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS prediction_rollups (
+            coin TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            period TEXT NOT NULL,
+            bucket_start TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            predictions INTEGER NOT NULL DEFAULT 0,
+            sum_current_price REAL NOT NULL DEFAULT 0,
+            sum_predicted_price REAL NOT NULL DEFAULT 0,
+            uptrends INTEGER NOT NULL DEFAULT 0,
+            evaluated INTEGER NOT NULL DEFAULT 0,
+            sum_abs_error REAL NOT NULL DEFAULT 0,
+            sum_sq_error REAL NOT NULL DEFAULT 0,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (coin, timeframe, period, bucket_start, model_version)
+        )
+    """)
+    
+    # ผลรวมสะสมของความแม่นยำจริงต่อ (เหรียญ, timeframe, เวอร์ชันโมเดล) - อัปเดตทีละรายการที่ประเมินแล้ว
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS accuracy_stats (
+            coin TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            sum_abs_error REAL NOT NULL DEFAULT 0,
+            sum_sq_error REAL NOT NULL DEFAULT 0,
+            sum_abs_pct_error REAL NOT NULL DEFAULT 0,
+            hits INTEGER NOT NULL DEFAULT 0,
+            rolling_abs_error REAL,
+            rolling_abs_pct_error REAL,
+            rolling_hit_rate REAL,
+            last_target_time INTEGER,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (coin, timeframe, model_version)
+        )
+    """)
+    
+    # Calibration: แบ่งตามขนาดการเปลี่ยนแปลงที่ทำนาย เทียบกับการเปลี่ยนแปลงจริงในทิศทางเดียวกัน
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS accuracy_calibration (
+            coin TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL DEFAULT 0,
+            sum_predicted_change REAL NOT NULL DEFAULT 0,
+            sum_realized_change REAL NOT NULL DEFAULT 0,
+            hits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (coin, timeframe, model_version, bucket)
+        )
+    """)
+    
+    # ผลลัพธ์ของ Parameter Sweep (หนึ่งแถวต่อชุดพารามิเตอร์) - UNIQUE ใช้สำหรับรันต่อจากที่ค้างไว้
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sweep_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sweep_id TEXT NOT NULL,
+            param_key TEXT NOT NULL,
+            symbol TEXT,
+            timeframe TEXT,
+            params TEXT,
+            total_return REAL,
+            max_drawdown REAL,
+            sharpe REAL,
+            hit_rate REAL,
+            trades INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (sweep_id, param_key)
+        )
+    """)
+    
+    # lease ของ Leader Election (ดู leader.py) - worker ที่ถือ lease เท่านั้นที่รัน Scheduler
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS leader_lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    
+    # ผลทำนายล่าสุดที่ใช้ร่วมกันระหว่าง worker (หนึ่งแถวต่อเหรียญ/timeframe/horizon ของแท่งปัจจุบัน)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS latest_predictions (
+            symbol TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            horizon INTEGER NOT NULL,
+            candle_time INTEGER NOT NULL,
+            model_version TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (symbol, timeframe, horizon)
+        )
+    """)
+    
+    # แท่งล่าสุดที่ Scheduler ทำนายแล้วของแต่ละ (coin, timeframe) - ใช้หาแท่งที่พลาดไประหว่างระบบหยุดทำงาน
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_state (
+            coin TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            last_candle_time INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (coin, timeframe)
+        )
+    """)
+    
+    # Histogram แบบ EWMA ของ Features จริงต่อ (symbol, timeframe) สำหรับ Drift Monitor พร้อมผลตรวจล่าสุด
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS drift_state (
+            symbol TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            model_version TEXT NOT NULL,
+            last_time INTEGER NOT NULL,
+            counts TEXT NOT NULL,
+            weight REAL NOT NULL,
+            report TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (symbol, timeframe)
+        )
+    """)
+    
     conn.commit()
     conn.close()
     logger.info("Database initialized successfully")
 
-def save_prediction(coin, timeframe, current, predicted, trend):
-    """บันทึกผลการทำนายลงฐานข้อมูล"""
+def enable_wal():
+    """เปิด WAL mode (ผู้อ่านหลาย process ไม่ถูกบล็อกโดยผู้เขียน) - ตั้งค่าครั้งเดียวแล้วติดอยู่กับไฟล์ฐานข้อมูล"""
+    conn = get_db()
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+def save_prediction(coin, timeframe, current, predicted, trend, candle_time=None, target_time=None, model_version=None):
+    """
+    บันทึกผลการทำนายลงฐานข้อมูล
+    candle_time / target_time = เวลาเปิดของแท่งล่าสุดที่ใช้ทำนาย / แท่งที่ทำนายราคาปิด (ms) ใช้ประเมินความแม่นยำจริงภายหลัง
+    """
     conn = get_db()
     cur = conn.cursor()
     
+    # ใช้เวลาจากนาฬิกากลาง (UTC รูปแบบเดียวกับ CURRENT_TIMESTAMP) เพื่อให้โหมด Replay บันทึกเวลาจำลอง
+    created_at = datetime.fromtimestamp(clock.time(), timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    
     try:
         cur.execute("""
-            INSERT INTO predictions (coin, timeframe, current_price, predicted_price, trend)
-            VALUES (?, ?, ?, ?, ?)
-        """, (coin, timeframe, current, predicted, trend))
+            INSERT INTO predictions
+                (coin, timeframe, current_price, predicted_price, trend, created_at, candle_time, target_time, model_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (coin, timeframe, current, predicted, trend, created_at, candle_time, target_time, model_version))
         conn.commit()
         logger.info(f"Saved prediction for {coin} {timeframe}")
     except Exception as e:
         logger.error(f"Error saving prediction: {e}")
     finally:
         conn.close()
+
+def save_predictions(rows):
+    """
+    บันทึกผลทำนายหลายแถว (dict ที่มี coin, timeframe, current_price, predicted_price, trend, created_at,
+    candle_time, target_time, model_version) และเลื่อนสถานะของ Scheduler ในธุรกรรมเดียว
+    """
+    conn = get_db()
+    try:
+        with conn:
+            conn.executemany("""
+                INSERT INTO predictions
+                    (coin, timeframe, current_price, predicted_price, trend, created_at, candle_time, target_time, model_version)
+                VALUES (:coin, :timeframe, :current_price, :predicted_price, :trend, :created_at,
+                        :candle_time, :target_time, :model_version)
+            """, rows)
+            _advance_scheduler_state(conn, [(row["coin"], row["timeframe"], row["candle_time"]) for row in rows])
+    finally:
+        conn.close()
+
+def _advance_scheduler_state(conn, entries):
+    """เลื่อนแท่งล่าสุดที่ทำนายแล้ว (ไม่ถอยหลัง เผื่อผลที่บันทึกไม่ตามลำดับ)"""
+    conn.executemany("""
+        INSERT INTO scheduler_state (coin, timeframe, last_candle_time) VALUES (?, ?, ?)
+        ON CONFLICT (coin, timeframe) DO UPDATE SET
+            last_candle_time = MAX(last_candle_time, excluded.last_candle_time),
+            updated_at = CURRENT_TIMESTAMP
+    """, entries)
+
+def save_scheduler_state(coin, timeframe, candle_time):
+    """บันทึกว่า Scheduler ทำนายแท่ง candle_time ของ (coin, timeframe) แล้ว"""
+    conn = get_db()
+    try:
+        with conn:
+            _advance_scheduler_state(conn, [(coin, timeframe, candle_time)])
+    finally:
+        conn.close()
+
+def get_scheduler_state():
+    """แท่งล่าสุดที่ทำนายแล้ว {(coin, timeframe): เวลาเปิดแท่ง (ms)}"""
+    conn = get_db()
+    try:
+        rows = conn.execute("SELECT coin, timeframe, last_candle_time FROM scheduler_state").fetchall()
+        return {(row["coin"], row["timeframe"]): row["last_candle_time"] for row in rows}
+    finally:
+        conn.close()
+
+def get_drift_state(symbol, timeframe):
+    """สถานะ Drift Monitor ของ (symbol, timeframe) (None = ยังไม่เคยตรวจ)"""
+    conn = get_db()
+    try:
+        row = conn.execute(
+            "SELECT * FROM drift_state WHERE symbol = ? AND timeframe = ?", (symbol, timeframe)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {
+        **dict(row),
+        "counts": json.loads(row["counts"]),
+        "report": json.loads(row["report"]) if row["report"] else None
+    }
+
+def save_drift_state(symbol, timeframe, model_version, last_time, counts, weight, report=None):
+    """บันทึก histogram สะสมและผลตรวจล่าสุดของ (symbol, timeframe) (แทนที่ของเดิม)"""
+    conn = get_db()
+    try:
+        with conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO drift_state
+                    (symbol, timeframe, model_version, last_time, counts, weight, report, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, (symbol, timeframe, model_version, last_time, json.dumps(counts), weight,
+                  json.dumps(report) if report is not None else None))
+    finally:
+        conn.close()
+
+def get_drift_reports():
+    """ผลตรวจ Drift ล่าสุดของทุก (symbol, timeframe)"""
+    conn = get_db()
+    try:
+        rows = conn.execute(
+            "SELECT report FROM drift_state WHERE report IS NOT NULL ORDER BY timeframe, symbol"
+        ).fetchall()
+        return [json.loads(row["report"]) for row in rows]
+    finally:
+        conn.close()
+
+def get_completed_sweep_keys(sweep_id):
+    """ดึง param_key ที่รันเสร็จแล้วของ sweep (ใช้ข้ามตอนรันต่อ)"""
+    conn = get_db()
+    try:
+        rows = conn.execute("SELECT param_key FROM sweep_results WHERE sweep_id = ?", (sweep_id,)).fetchall()
+        return {row["param_key"] for row in rows}
+    finally:
+        conn.close()
+
+def save_sweep_results(rows):
+    """บันทึกผล sweep หลายแถวในธุรกรรมเดียว (แถวที่มีอยู่แล้วจะถูกข้าม)"""
+    conn = get_db()
+    try:
+        conn.executemany("""
+            INSERT OR IGNORE INTO sweep_results
+                (sweep_id, param_key, symbol, timeframe, params, total_return, max_drawdown, sharpe, hit_rate, trades)
+            VALUES (:sweep_id, :param_key, :symbol, :timeframe, :params, :total_return, :max_drawdown, :sharpe, :hit_rate, :trades)
+        """, rows)
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error saving sweep results: {e}")
+    finally:
+        conn.close()
+
+def save_latest_prediction(symbol, timeframe, horizon, candle_time, model_version, payload):
+    """เผยแพร่ผลทำนายล่าสุดของ (symbol, timeframe, horizon) ให้ worker อื่นอ่าน (แทนที่ของเดิม)"""
+    conn = get_db()
+    try:
+        conn.execute("""
+            INSERT OR REPLACE INTO latest_predictions
+                (symbol, timeframe, horizon, candle_time, model_version, payload, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (symbol, timeframe, horizon, candle_time, model_version, json.dumps(payload)))
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Error saving latest prediction: {e}")
+    finally:
+        conn.close()
+
+def get_latest_prediction(symbol, timeframe, horizon, candle_time, model_version):
+    """ดึงผลทำนายที่เผยแพร่ไว้ ถ้าเป็นของแท่งและเวอร์ชันโมเดลเดียวกัน (None = ยังไม่มีหรือเก่าแล้ว)"""
+    conn = get_db()
+    try:
+        row = conn.execute("""
+            SELECT payload FROM latest_predictions
+            WHERE symbol = ? AND timeframe = ? AND horizon = ? AND candle_time = ? AND model_version = ?
+        """, (symbol, timeframe, horizon, candle_time, model_version)).fetchone()
+        return json.loads(row["payload"]) if row is not None else None
+    finally:
+        conn.close()
@@ -0,0 +1,341 @@
+"""
+Drift Monitor: Retrain เฉพาะโมเดลที่ตลาดเปลี่ยนไปจากช่วงที่เทรนจริง แทนการเทรนตามรอบเวลาคงที่
+
+- Feature drift: เทียบการกระจายของ FEATURE_COLUMNS ทั้ง 15 ตัวจากแท่งที่ปิดแล้ว กับ profile ช่วงเทรน
+  (ขอบ decile และสัดส่วนต่อช่องที่ train_model.py เก็บใน metadata) ด้วย PSI
+  histogram ของข้อมูลจริงสะสมแบบ EWMA ทีละแท่งใหม่ในตาราง drift_state จึงดึงเฉพาะแท่งที่ปิดหลังการตรวจครั้งก่อน
+- Error drift: ความคลาดเคลื่อนแบบ rolling ของผลทำนายจริง (accuracy_stats) เทียบกับ MAPE ตอน validation
+  (หรือค่าเฉลี่ยระยะยาวของโมเดลเวอร์ชันเดียวกันสำหรับโมเดลที่เทรนก่อนมี val_mape)
+- เมื่อพบ drift จะเข้าคิว Retrain ของ timeframe นั้น (ทีละงาน มี cooldown ต่อโมเดล) แล้ว reload โมเดลเมื่อ promote
+"""
+
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+from collections import deque
+
+import numpy as np
+
+import clock
+import db
+from data_service import FEATURE_COLUMNS, INDICATOR_WARMUP, interval_to_ms
+from feature_store import get_features
+
+logger = logging.getLogger("drift")
+
+# จำนวนช่องของ histogram (ขอบ = decile ของข้อมูลเทรน)
+PROFILE_BINS = 10
+# histogram ของข้อมูลจริงมีน้ำหนักเทียบเท่า DRIFT_WINDOW แท่งล่าสุด
+DRIFT_WINDOW = int(os.environ.get("DRIFT_WINDOW", "500"))
+DRIFT_DECAY = 1 - 1 / DRIFT_WINDOW
+# น้ำหนักขั้นต่ำของข้อมูลจริงก่อนตัดสิน feature drift
+MIN_LIVE_WEIGHT = 100
+# PSI > 0.25 = การกระจายเปลี่ยนอย่างมีนัยสำคัญ และต้องเปลี่ยนพร้อมกันอย่างน้อย MIN_DRIFTED_FEATURES ตัว
+PSI_THRESHOLD = 0.25
+MIN_DRIFTED_FEATURES = 3
+# error drift: rolling error สูงกว่า baseline ERROR_RATIO เท่า จากผลที่ประเมินแล้วอย่างน้อย MIN_ERROR_SAMPLES รายการ
+ERROR_RATIO = 1.5
+MIN_ERROR_SAMPLES = 30
+
+# Retrain อัตโนมัติเมื่อพบ drift (0 = ตรวจและรายงานอย่างเดียว) และระยะห่างขั้นต่ำระหว่างการเทรนของโมเดลเดียวกัน
+AUTO_RETRAIN = os.environ.get("DRIFT_AUTO_RETRAIN", "1") == "1"
+RETRAIN_MODE = os.environ.get("DRIFT_RETRAIN_MODE", "full")
+RETRAIN_COOLDOWN_HOURS = float(os.environ.get("DRIFT_RETRAIN_COOLDOWN_HOURS", "12"))
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_model.py")
+
+# คอลัมน์ระดับราคา: เทียบเป็นสัดส่วนกับราคาปิด (โมเดลใช้ Dynamic Scaling ต่อ window จึงไม่เห็นระดับราคาโดยตรง)
+_RELATIVE_TO_CLOSE = ["open", "high", "low", "ma_5", "ma_10", "ma_20", "macd"]
+# แท่งก่อนหน้าที่ต้องใช้คำนวณ drift_view ของแท่งแรก (ราคาปิดก่อนหน้า และค่าเฉลี่ย volume 20 แท่ง)
+VIEW_CONTEXT = 20
+
+
+def drift_view(df):
+    """
+    FEATURE_COLUMNS ในรูปที่ไม่ขึ้นกับระดับราคา (n, 15): close -> ผลตอบแทนต่อแท่ง, open/high/low/MA/MACD -> สัดส่วนกับ close,
+    volume -> เทียบกับค่าเฉลี่ย 20 แท่ง ส่วน indicator ที่ไม่มีหน่วยใช้ค่าเดิม
+    """
+    close = df["close"].astype(float)
+    view = df[FEATURE_COLUMNS].astype(float).copy()
+    view["close"] = close.pct_change()
+    for col in _RELATIVE_TO_CLOSE:
+        view[col] = df[col] / close - (0 if col == "macd" else 1)
+    view["volume"] = df["volume"] / df["volume"].rolling(VIEW_CONTEXT, min_periods=1).mean()
+    return view.replace([np.inf, -np.inf], np.nan).to_numpy(np.float64)
+
+
+def _histogram(view, edges, weights):
+    """น้ำหนักรวมต่อช่องของแต่ละคอลัมน์ (n_columns, PROFILE_BINS) - ไม่นับค่า NaN"""
+    hist = np.zeros((view.shape[1], PROFILE_BINS))
+    for c, col_edges in enumerate(edges):
+        values = view[:, c]
+        valid = ~np.isnan(values)
+        bins = np.searchsorted(col_edges, values[valid], side="right")
+        hist[c] = np.bincount(bins, weights=weights[valid], minlength=PROFILE_BINS)
+    return hist
+
+
+def drift_profile(df):
+    """profile ของข้อมูลเทรน (เก็บใน metadata): ขอบ decile และสัดส่วนของข้อมูลเทรนในแต่ละช่อง"""
+    view = drift_view(df)
+    quantiles = np.linspace(0, 1, PROFILE_BINS + 1)[1:-1]
+    edges = [np.nanquantile(view[:, c], quantiles) for c in range(view.shape[1])]
+    hist = _histogram(view, edges, np.ones(len(view)))
+    return {
+        "columns": list(FEATURE_COLUMNS),
+        "edges": [[float(v) for v in col_edges] for col_edges in edges],
+        "fractions": (hist / hist.sum(axis=1, keepdims=True)).round(6).tolist()
+    }
+
+
+def population_stability(live, reference, eps=1e-4):
+    """PSI ต่อคอลัมน์ระหว่าง histogram ของข้อมูลจริงกับสัดส่วนของข้อมูลเทรน"""
+    live = np.asarray(live, dtype=np.float64)
+    p = np.clip(live / np.maximum(live.sum(axis=1, keepdims=True), eps), eps, None)
+    q = np.clip(np.asarray(reference, dtype=np.float64), eps, None)
+    return ((p - q) * np.log(p / q)).sum(axis=1)
+
+
+def _update_live_histogram(symbol, timeframe, version, edges, state):
+    """
+    เติม histogram แบบ EWMA ด้วยแท่งที่ปิดหลัง state["last_time"] (เริ่มใหม่จาก DRIFT_WINDOW แท่งล่าสุด
+    เมื่อยังไม่มีสถานะ เปลี่ยนเวอร์ชันโมเดล หรือหยุดตรวจไปนานกว่าหน้าต่าง)
+
+    Returns:
+        (counts, weight, last_time)
+    """
+    step = interval_to_ms(timeframe)
+    last_closed = clock.now_ms() // step * step - step
+    if state is None or state["model_version"] != version or not state["counts"] \
+            or last_closed - state["last_time"] >= DRIFT_WINDOW * step:
+        counts, weight, last_time = np.zeros((len(FEATURE_COLUMNS), PROFILE_BINS)), 0.0, 0
+        new = DRIFT_WINDOW
+    else:
+        counts, weight, last_time = np.asarray(state["counts"]), state["weight"], state["last_time"]
+        new = (last_closed - last_time) // step
+    if new <= 0:
+        return counts, weight, last_time
+
+    df, _ = get_features(symbol, timeframe, new + INDICATOR_WARMUP + VIEW_CONTEXT, closed_only=True)
+    fresh = df["time"].to_numpy() > last_time
+    view = drift_view(df)[fresh]
+    if len(view):
+        # แท่งใหม่สุดมีน้ำหนัก 1 และน้ำหนักเดิมลดลงตามจำนวนแท่งที่เพิ่มเข้ามา
+        weights = DRIFT_DECAY ** np.arange(len(view) - 1, -1, -1)
+        counts = counts * DRIFT_DECAY ** len(view) + _histogram(view, edges, weights)
+        weight = weight * DRIFT_DECAY ** len(view) + weights.sum()
+        last_time = int(df["time"].iloc[-1])
+    return counts, weight, last_time
+
+
+def _error_stats(coin, timeframe, version):
+    """ผลรวมความคลาดเคลื่อนจริงของโมเดลเวอร์ชันนี้ (None = ยังไม่มีผลที่ประเมินแล้ว)"""
+    conn = db.get_db()
+    try:
+        return conn.execute("""
+            SELECT samples, sum_abs_pct_error, rolling_abs_pct_error FROM accuracy_stats
+            WHERE coin = ? AND timeframe = ? AND model_version = ? AND samples > 0
+        """, (coin, timeframe, version)).fetchone()
+    finally:
+        conn.close()
+
+
+def check_symbol(coin, symbol, timeframe, version, metadata):
+    """
+    ตรวจ drift ของหนึ่ง (symbol, timeframe) กับโมเดลที่ใช้อยู่ แล้วบันทึก histogram และผลตรวจลง drift_state
+
+    Returns:
+        Dict ผลตรวจ (PSI ต่อคอลัมน์, rolling error เทียบ baseline และ drift = True เมื่อควร Retrain)
+    """
+    state = db.get_drift_state(symbol, timeframe)
+    profile = metadata.get("drift_profile")
+
+    psi = {}
+    drifted = []
+    counts, weight, last_time = [], 0.0, state["last_time"] if state else 0
+    if profile:
+        edges = [np.asarray(col_edges) for col_edges in profile["edges"]]
+        counts, weight, last_time = _update_live_histogram(symbol, timeframe, version, edges, state)
+        if weight > 0:
+            values = population_stability(counts, profile["fractions"])
+            psi = {col: round(float(v), 4) for col, v in zip(FEATURE_COLUMNS, values)}
+            drifted = [col for col, v in psi.items() if v > PSI_THRESHOLD]
+        counts = np.asarray(counts).round(6).tolist()
+    feature_drift = weight >= MIN_LIVE_WEIGHT and len(drifted) >= MIN_DRIFTED_FEATURES
+
+    errors = _error_stats(coin, timeframe, version)
+    samples = errors["samples"] if errors else 0
+    rolling_error = errors["rolling_abs_pct_error"] if errors else None
+    baseline = metadata.get("val_mape") or (errors["sum_abs_pct_error"] / samples if errors else None)
+    error_drift = bool(
+        samples >= MIN_ERROR_SAMPLES and rolling_error is not None and baseline
+        and rolling_error > ERROR_RATIO * baseline
+    )
+
+    report = {
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "model_version": version,
+        "checked_at": clock.now_ms(),
+        "live_candles": round(float(weight), 1),
+        "psi": psi,
+        "drifted_features": drifted,
+        "feature_drift": bool(feature_drift),
+        "error_samples": samples,
+        "rolling_error_pct": rolling_error,
+        "baseline_error_pct": baseline,
+        "error_drift": error_drift,
+        "drift": bool(feature_drift or error_drift)
+    }
+    db.save_drift_state(symbol, timeframe, version, last_time, counts, float(weight), report)
+    return report
+
+
+def _reason(report):
+    """สรุปสาเหตุของ drift สำหรับ log และประวัติการ Retrain"""
+    reasons = []
+    if report["feature_drift"]:
+        reasons.append(f"{report['symbol']} features shifted: {', '.join(report['drifted_features'])}")
+    if report["error_drift"]:
+        reasons.append(
+            f"{report['symbol']} rolling error {report['rolling_error_pct']:.2f}% "
+            f"vs baseline {report['baseline_error_pct']:.2f}%"
+        )
+    return "; ".join(reasons)
+
+
+def check_drift(timeframes, coins, retrain=None):
+    """
+    ตรวจ drift ของทุกเหรียญในแต่ละ timeframe และเข้าคิว Retrain ของโมเดลที่ drift (ครั้งเดียวต่อโมเดล)
+
+    Args:
+        timeframes: timeframe ที่ต้องตรวจ
+        coins: {coin: symbol} เช่น scheduler.COINS
+        retrain: เข้าคิว Retrain เมื่อพบ drift (None = ตาม DRIFT_AUTO_RETRAIN)
+
+    Returns:
+        รายการผลตรวจของทุก (symbol, timeframe)
+    """
+    from ai_engine import resolve_model, get_model_version, load_model_metadata
+
+    retrain = AUTO_RETRAIN if retrain is None else retrain
+    reports = []
+    for timeframe in timeframes:
+        drifted = {}  # model key -> ผลตรวจที่ drift
+        for coin, symbol in coins.items():
+            key = resolve_model(symbol, timeframe)
+            if key is None:
+                continue
+            metadata = load_model_metadata(key) or {}
+            try:
+                report = check_symbol(coin, symbol, timeframe, get_model_version(timeframe, symbol), metadata)
+            except Exception as e:
+                logger.error(f"Drift check of {symbol}/{timeframe} failed: {e}")
+                continue
+            reports.append(report)
+            if report["drift"]:
+                drifted.setdefault(key, (metadata, []))[1].append(report)
+
+        for key, (metadata, found) in drifted.items():
+            reason = "; ".join(_reason(report) for report in found)
+            logger.warning(f"Drift detected for model {key}: {reason}")
+            if retrain:
+                symbol = found[0]["symbol"] if key != timeframe else None
+                queue_retrain(timeframe, symbol, reason, trained_at=metadata.get("trained_at", 0))
+    return reports
+
+
+# ============================================================================
+# คิว Retrain: เทรนทีละโมเดลใน thread เบื้องหลัง (subprocess เดียวกับ /retrain)
+# ============================================================================
+
+_retrain_queue = queue.Queue()
+_retrain_lock = threading.Lock()
+_pending = {}  # model key -> งานที่รอหรือกำลังเทรน
+_last_queued = {}  # model key -> เวลาที่เข้าคิวครั้งล่าสุด (วินาที)
+_history = deque(maxlen=20)
+_worker = None
+
+
+def queue_retrain(timeframe, symbol=None, reason="", trained_at=0):
+    """
+    เข้าคิว Retrain ของโมเดล (symbol = โมเดลเฉพาะเหรียญ) ถ้ายังไม่อยู่ในคิวและพ้น cooldown
+    นับจากการเทรนหรือการเข้าคิวครั้งล่าสุด
+
+    Returns:
+        True ถ้าเข้าคิว
+    """
+    global _worker
+    key = f"{symbol}_{timeframe}" if symbol else timeframe
+    now = clock.time()
+    with _retrain_lock:
+        if key in _pending:
+            return False
+        if now - max(trained_at, _last_queued.get(key, 0)) < RETRAIN_COOLDOWN_HOURS * 3600:
+            logger.info(f"Retrain of {key} skipped: trained within the last {RETRAIN_COOLDOWN_HOURS:g}h")
+            return False
+        _pending[key] = {"model": key, "timeframe": timeframe, "symbol": symbol, "reason": reason, "queued_at": now}
+        _last_queued[key] = now
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_retrain_worker, name="drift-retrain", daemon=True)
+            _worker.start()
+    _retrain_queue.put(key)
+    logger.warning(f"Retrain of {key} queued ({RETRAIN_MODE})")
+    return True
+
+
+def run_retrain(timeframe, symbol=None, mode=RETRAIN_MODE):
+    """เทรนโมเดลด้วย train_model.py ใน subprocess แล้ว reload เมื่อโมเดลใหม่ถูก promote"""
+    from ai_engine import load_specific_model
+
+    command = [sys.executable, TRAIN_SCRIPT, "--timeframe", timeframe]
+    if symbol:
+        command += ["--symbol", symbol, "--per-symbol"]
+    if mode == "incremental":
+        command.append("--incremental")
+    result = subprocess.run(command, capture_output=True, text=True, encoding="utf-8", check=True)
+
+    outcome = {"promoted": True}
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith("RESULT "):
+            outcome = json.loads(line[len("RESULT "):])
+            break
+    if outcome.get("promoted", True):
+        load_specific_model(timeframe, symbol)
+    return outcome
+
+
+def _retrain_worker():
+    while True:
+        key = _retrain_queue.get()
+        job = _pending[key]
+        try:
+            outcome = run_retrain(job["timeframe"], job["symbol"])
+            logger.info(f"Drift retrain of {key} finished: {outcome}")
+        except subprocess.CalledProcessError as e:
+            outcome = {"error": (e.stderr or "")[-500:]}
+            logger.error(f"Drift retrain of {key} failed: {outcome['error']}")
+        except Exception as e:
+            outcome = {"error": str(e)}
+            logger.error(f"Drift retrain of {key} failed: {e}")
+        with _retrain_lock:
+            _history.append({**job, "finished_at": clock.time(), "outcome": outcome})
+            _pending.pop(key, None)
+        _retrain_queue.task_done()
+
+
+def get_drift_status():
+    """ผลตรวจล่าสุดของทุก (symbol, timeframe) คิว Retrain และผลการ Retrain ล่าสุด"""
+    with _retrain_lock:
+        pending = list(_pending.values())
+        history = list(_history)
+    return {
+        "auto_retrain": AUTO_RETRAIN,
+        "reports": db.get_drift_reports(),
+        "pending_retrains": pending,
+        "recent_retrains": history
+    }
@@ -0,0 +1,213 @@
+"""
+Feature Store: เก็บ Features ที่คำนวณแล้วรายแท่งเทียน (symbol, interval, time) ลง SQLite
+อัปเดตแบบ incremental เฉพาะแท่งใหม่ โดยต่อ rolling indicators และ EMA จากแถวท้ายที่เก็บไว้
+ทำให้แต่ละ Feature ถูกคำนวณครั้งเดียวต่อแท่ง - การเทรนอ่านทีละมาก ๆ ส่วนการทำนายอ่านเฉพาะแถวล่าสุด
+
+เปิดใช้เป็นค่าเริ่มต้น ปิดด้วย environment variable FEATURE_STORE=0 (คำนวณจากแท่งเทียนดิบทุกครั้งเหมือนเดิม)
+"""
+
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import clock
+import db
+from data_service import (
+    fetch_klines, parse_klines, compute_features, get_training_data,
+    interval_to_ms, was_stale, FEATURE_COLUMNS, KERNEL_COLUMNS, RAW_COLUMNS, INDICATOR_WARMUP
+)
+
+logger = logging.getLogger("feature_store")
+
+FEATURE_STORE_ENABLED = os.environ.get("FEATURE_STORE", "1") == "1"
+
+# จำนวนแท่งที่ทิ้งตอนสร้างครั้งแรก เพื่อให้ EMA ลู่เข้าก่อนเก็บ (ผลต่างจากค่าเริ่มต้น < 1e-6)
+EMA_WARMUP = 200
+# จำนวนแถวที่บันทึกไว้ซึ่งใช้เป็นบริบทของ rolling indicators ตอนต่อแท่งใหม่ (window ยาวสุด = 20)
+CONTEXT_ROWS = 30
+DEFAULT_BACKFILL = 1000
+
+STATE_COLUMNS = ["ema_12", "ema_26"]
+
+_initialized_paths = set()
+# จำนวนแถวที่ backfill ไปแล้วในโปรเซสนี้ (กัน backfill ซ้ำเมื่อ exchange มีข้อมูลน้อยกว่าที่ขอ)
+_backfilled = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _get_conn():
+    """เชื่อมต่อฐานข้อมูลและสร้างตาราง features ครั้งแรกที่ใช้ (ต่อไฟล์ฐานข้อมูล)"""
+    conn = db.get_db()
+    if db.DB_PATH not in _initialized_paths:
+        columns = ",\n".join(f"            {col} REAL" for col in KERNEL_COLUMNS)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS features (
+                symbol TEXT NOT NULL,
+                interval TEXT NOT NULL,
+                time INTEGER NOT NULL,
+                closed INTEGER NOT NULL,
+                valid INTEGER NOT NULL,
+{columns},
+                PRIMARY KEY (symbol, interval, time)
+            ) WITHOUT ROWID
+        """)
+        conn.commit()
+        _initialized_paths.add(db.DB_PATH)
+    return conn
+
+
+def _key_lock(symbol, interval):
+    """lock ต่อ (symbol, interval) กันการอัปเดตซ้ำซ้อนเมื่อหลายคำขอมาพร้อมกัน"""
+    with _locks_guard:
+        return _locks.setdefault((symbol, interval), threading.Lock())
+
+
+def _save_rows(conn, symbol, interval, times, features, keep_existing=False):
+    """
+    บันทึกแถว Features ตามลำดับ KERNEL_COLUMNS (แทนที่แถวเดิมของแท่งเดียวกัน เช่นแท่งที่ยังไม่ปิด)
+    keep_existing = เติมเฉพาะแท่งที่ยังไม่มี ไม่แทนที่แถวเดิม
+    """
+    close_cutoff = clock.now_ms() - interval_to_ms(interval)
+    valid = ~np.isnan(features[:, :len(FEATURE_COLUMNS)]).any(axis=1)
+    # NaN -> NULL
+    values = features.astype(object)
+    values[np.isnan(features)] = None
+    rows = [
+        (symbol, interval, int(t), int(t <= close_cutoff), int(ok), *row)
+        for t, ok, row in zip(times.tolist(), valid.tolist(), values.tolist())
+    ]
+    placeholders = ", ".join("?" * (5 + len(KERNEL_COLUMNS)))
+    conflict = "IGNORE" if keep_existing else "REPLACE"
+    cursor = conn.executemany(
+        f"INSERT OR {conflict} INTO features (symbol, interval, time, closed, valid, {', '.join(KERNEL_COLUMNS)}) "
+        f"VALUES ({placeholders})",
+        rows
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def _backfill(conn, symbol, interval, rows):
+    """สร้าง Features ของ `rows` แท่งล่าสุดจากศูนย์ (ลบของเดิมของคู่นี้ทั้งหมด) คืนค่า (จำนวนแถว, stale)"""
+    data = fetch_klines(symbol, interval, limit=rows + EMA_WARMUP)
+    times, ohlcv = parse_klines(data)
+    features = compute_features(ohlcv)
+    # ตัดช่วงที่ indicator ยังไม่ครบ/EMA ยังไม่ลู่เข้า แต่ถ้าข้อมูลมีไม่พอให้ตัดเท่าที่จำเป็น
+    skip = min(EMA_WARMUP, max(INDICATOR_WARMUP, len(times) - rows))
+    if was_stale(data):
+        # ข้อมูลสำรองอาจสั้น/เก่ากว่าที่เก็บไว้: ไม่ลบของเดิม เติมเฉพาะแท่งที่ยังไม่มี
+        # และไม่นับว่า backfill แล้ว เพื่อสร้างใหม่เมื่อ Binance กลับมา
+        logger.warning(f"Upstream data for {symbol} {interval} is stale, skipping feature rebuild")
+        return _save_rows(conn, symbol, interval, times[skip:], features[skip:], keep_existing=True), True
+    conn.execute("DELETE FROM features WHERE symbol = ? AND interval = ?", (symbol, interval))
+    _backfilled[(db.DB_PATH, symbol, interval)] = rows
+    return _save_rows(conn, symbol, interval, times[skip:], features[skip:]), False
+
+
+def update_features(symbol, interval, min_rows=DEFAULT_BACKFILL):
+    """
+    อัปเดต Features ของ (symbol, interval) ให้ถึงแท่งล่าสุด
+
+    - ยังไม่มีข้อมูล หรือมีน้อยกว่า min_rows: backfill ใหม่ทั้งชุด
+    - มีข้อมูลแล้ว: ดึงเฉพาะแท่งหลังแท่งที่ปิดล่าสุด และคำนวณต่อจาก CONTEXT_ROWS แถวท้าย
+
+    Returns:
+        จำนวนแถวที่บันทึก
+    """
+    return _update(symbol, interval, min_rows)[0]
+
+
+def _update(symbol, interval, min_rows):
+    """update_features ที่คืนค่า (จำนวนแถวที่บันทึก, ข้อมูลที่ดึงมาเป็นข้อมูลสำรองหรือไม่)"""
+    with _key_lock(symbol, interval):
+        conn = _get_conn()
+        try:
+            count = conn.execute(
+                "SELECT COUNT(*) FROM features WHERE symbol = ? AND interval = ? AND valid = 1",
+                (symbol, interval)
+            ).fetchone()[0]
+            tail = conn.execute(
+                f"SELECT time, {', '.join(RAW_COLUMNS + STATE_COLUMNS)} FROM features "
+                "WHERE symbol = ? AND interval = ? AND closed = 1 ORDER BY time DESC LIMIT ?",
+                (symbol, interval, CONTEXT_ROWS)
+            ).fetchall()
+
+            backfilled = _backfilled.get((db.DB_PATH, symbol, interval), 0)
+            if (count < min_rows and backfilled < min_rows) or len(tail) < CONTEXT_ROWS:
+                return _backfill(conn, symbol, interval, max(min_rows, DEFAULT_BACKFILL))
+
+            context = np.array([tuple(r) for r in reversed(tail)], dtype=np.float64)
+            last_time = int(context[-1, 0])
+            step = interval_to_ms(interval)
+            missing = (clock.now_ms() - last_time) // step
+            data = fetch_klines(symbol, interval, limit=max(int(missing), 1), start_time=last_time + 1)
+            times, ohlcv = parse_klines(data)
+            keep = times > last_time
+            times, ohlcv = times[keep], ohlcv[keep]
+            if len(times) == 0:
+                return 0, was_stale(data)
+
+            if int(times[0]) != last_time + step:
+                # มีแท่งหายไประหว่างทาง - บริบทใช้ไม่ได้ เริ่มใหม่
+                logger.warning(f"Gap in stored features for {symbol} {interval}, rebuilding")
+                return _backfill(conn, symbol, interval, max(min_rows, DEFAULT_BACKFILL))
+
+            features = compute_features(
+                np.vstack([context[:, 1:1 + len(RAW_COLUMNS)], ohlcv]),
+                ema_seed=tuple(context[0, 1 + len(RAW_COLUMNS):])
+            )
+            return _save_rows(conn, symbol, interval, times, features[len(context):]), was_stale(data)
+        finally:
+            conn.close()
+
+
+def read_features(symbol, interval, rows=None):
+    """
+    อ่าน Features จาก store (เฉพาะแถวที่ครบทุก Feature) เรียงตามเวลา
+
+    Args:
+        rows: จำนวนแถวล่าสุดที่ต้องการ (None = ทั้งหมด สำหรับการเทรน)
+    """
+    conn = _get_conn()
+    try:
+        query = (
+            f"SELECT time, {', '.join(FEATURE_COLUMNS)} FROM features "
+            "WHERE symbol = ? AND interval = ? AND valid = 1 ORDER BY time DESC"
+        )
+        params = (symbol, interval)
+        if rows is not None:
+            query += " LIMIT ?"
+            params += (rows,)
+        result = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+    df = pd.DataFrame([tuple(r) for r in reversed(result)], columns=["time"] + FEATURE_COLUMNS)
+    return df.reset_index(drop=True)
+
+
+def get_features(symbol="BTCUSDT", interval="1h", limit=1000, closed_only=False):
+    """
+    ใช้แทน get_training_data: คืน (DataFrame, feature_columns) ที่มีจำนวนแถวเท่ากับ
+    การคำนวณจาก `limit` แท่งเทียนดิบ แต่ถ้าเปิด Feature Store จะอ่านจาก store แทนการคำนวณใหม่
+
+    closed_only = ตัดแท่งล่าสุดที่ยังไม่ปิดออก (สำหรับการเทรน: ไม่ใช้ราคาที่ยังเปลี่ยนได้เป็นเป้าหมาย)
+    was_stale(df) บอกว่าข้อมูลที่ดึงในคำขอนี้มาจากข้อมูลสำรองหรือไม่
+    """
+    if not FEATURE_STORE_ENABLED:
+        df, feature_columns = get_training_data(symbol, interval, limit)
+    else:
+        rows = max(1, limit - INDICATOR_WARMUP)
+        _, stale = _update(symbol, interval, min_rows=rows)
+        df, feature_columns = read_features(symbol, interval, rows), list(FEATURE_COLUMNS)
+        df.attrs["stale"] = stale
+
+    if closed_only:
+        stale = was_stale(df)
+        df = df[df["time"].values + interval_to_ms(interval) <= clock.now_ms()]
+        df.attrs["stale"] = stale
+    return df, feature_columns
@@ -0,0 +1,159 @@
+"""
+Leader Election สำหรับการรันหลาย worker (uvicorn --workers N)
+ทุก worker แข่งกันถือ lease ในตาราง leader_lease ของ SQLite - worker ที่ถือ lease อยู่เท่านั้นที่รัน Scheduler
+lease มีอายุ LEASE_SECONDS และถูกต่ออายุทุก RENEW_SECONDS ถ้า leader ตาย worker อื่นจะรับช่วงเมื่อ lease หมดอายุ
+
+เปิดใช้ด้วย environment variable MULTI_WORKER=1 (ค่าเริ่มต้นทุก process รัน Scheduler ของตัวเองเหมือนเดิม)
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import db
+
+logger = logging.getLogger("leader")
+
+MULTI_WORKER = os.environ.get("MULTI_WORKER", "0") == "1"
+
+LEASE_NAME = "scheduler"
+LEASE_SECONDS = 30
+RENEW_SECONDS = 10
+
+# ตัวระบุ worker (ไม่ซ้ำกันแม้หลายเครื่องใช้ฐานข้อมูลบน network share เดียวกัน)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def try_acquire(name=LEASE_NAME, holder=WORKER_ID, ttl=LEASE_SECONDS):
+    """
+    ขอหรือต่ออายุ lease (สำเร็จเมื่อยังไม่มีผู้ถือ, lease หมดอายุแล้ว หรือเราถืออยู่เอง)
+    คืนค่า True = ได้ lease, False = worker อื่นถืออยู่, None = ตรวจไม่ได้ (เช่น database is locked)
+
+    ใช้ BEGIN IMMEDIATE เพื่อให้การตรวจสอบและการเขียนเป็นธุรกรรมเดียว - มีผู้ชนะได้คนเดียว
+    เวลาเป็นเวลาจริงของเครื่อง (ไม่ใช่ clock กลาง) เพราะ lease เป็นเรื่องของ process ไม่ใช่ข้อมูลตลาด
+    """
+    now = time.time()
+    conn = db.get_db()
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT holder, expires_at FROM leader_lease WHERE name = ?", (name,)).fetchone()
+        if row is not None and row["holder"] != holder and row["expires_at"] > now:
+            conn.execute("COMMIT")
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO leader_lease (name, holder, expires_at) VALUES (?, ?, ?)",
+            (name, holder, now + ttl)
+        )
+        conn.execute("COMMIT")
+        return True
+    except sqlite3.OperationalError as e:
+        # ฐานข้อมูลถูก lock นานเกิน timeout - ไม่รู้ผล (ไม่ใช่เสีย lease) ลองใหม่รอบหน้า
+        logger.warning(f"Lease check failed: {e}")
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        return None
+    finally:
+        conn.close()
+
+
+def release(name=LEASE_NAME, holder=WORKER_ID):
+    """คืน lease ทันที (ตอนปิด worker) เพื่อให้ worker อื่นรับช่วงได้โดยไม่ต้องรอหมดอายุ"""
+    conn = db.get_db()
+    try:
+        conn.execute("DELETE FROM leader_lease WHERE name = ? AND holder = ?", (name, holder))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_leader(name=LEASE_NAME):
+    """ดึงผู้ถือ lease ปัจจุบัน (None ถ้าไม่มีหรือหมดอายุแล้ว)"""
+    conn = db.get_db()
+    try:
+        row = conn.execute("SELECT holder, expires_at FROM leader_lease WHERE name = ?", (name,)).fetchone()
+    finally:
+        conn.close()
+    if row is None or row["expires_at"] <= time.time():
+        return None
+    return {"holder": row["holder"], "expires_at": row["expires_at"]}
+
+
+class LeaderElector:
+    """
+    thread เบื้องหลังที่ขอ/ต่ออายุ lease เป็นระยะ และเรียก callback เมื่อสถานะเปลี่ยน
+
+    on_elected: ได้เป็น leader (เริ่ม Scheduler)
+    on_lost: เสียตำแหน่ง leader เช่นต่ออายุไม่ทันจน worker อื่นรับช่วงไปแล้ว (หยุด Scheduler)
+
+    ถ้าตรวจ lease ไม่ได้ชั่วคราว (ฐานข้อมูลถูก lock) leader ยังทำงานต่อจนกว่า lease ที่ต่อไว้ล่าสุดจะหมดอายุ
+    """
+
+    def __init__(self, on_elected, on_lost, name=LEASE_NAME, holder=WORKER_ID,
+                 ttl=LEASE_SECONDS, interval=RENEW_SECONDS):
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.interval = interval
+        self.is_leader = False
+        self.lease_expires_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="leader-elector", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """หยุดต่ออายุ และคืน lease ถ้าเป็น leader อยู่ (ไม่เรียก on_lost - ผู้เรียกหยุดงานของตัวเองตอนปิด)"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.is_leader:
+            self.is_leader = False
+            release(self.name, self.holder)
+
+    def poll(self):
+        """ขอ lease หนึ่งรอบและเรียก callback ถ้าสถานะเปลี่ยน"""
+        attempted_at = time.time()
+        acquired = try_acquire(self.name, self.holder, self.ttl)
+        if acquired is None:
+            # ไม่รู้ผล: ยังเป็น leader ได้จนถึงเวลาหมดอายุของ lease ที่ต่อไว้ (worker อื่นรับช่วงไม่ได้ก่อนนั้น)
+            if self.is_leader and time.time() >= self.lease_expires_at:
+                logger.warning(f"Worker {self.holder} could not renew its {self.name} lease before it expired")
+                self.is_leader = False
+                self.on_lost()
+            return self.is_leader
+        if acquired:
+            # เวลาหมดอายุนับจากก่อนเรียก try_acquire - ไม่เกินค่าที่บันทึกในตารางจริง
+            self.lease_expires_at = attempted_at + self.ttl
+        if acquired and not self.is_leader:
+            logger.info(f"Worker {self.holder} elected leader for {self.name}")
+            self.is_leader = True
+            self.on_elected()
+        elif not acquired and self.is_leader:
+            logger.warning(f"Worker {self.holder} lost leadership for {self.name}")
+            self.is_leader = False
+            self.on_lost()
+        return self.is_leader
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Leader election error: {e}")
+            self._stop.wait(self.interval)
+
+    def status(self):
+        return {
+            "worker_id": self.holder,
+            "is_leader": self.is_leader,
+            "leader": get_leader(self.name)
+        }
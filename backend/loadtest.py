@@ -0,0 +1,313 @@
+"""
+Load Test จำลอง Traffic ของหน้า Dashboard (frontend/script.js)
+สัดส่วนคำขอ:
+    - view:        /predict + /backtest แบบขนาน (เปลี่ยนเหรียญ/timeframe หรือกด PREDICTION)
+    - ohlcv:       /ohlcv สำหรับตารางประวัติ (ครั้งแรกโหลดเต็ม ครั้งต่อไปใช้ since cursor)
+    - performance: /performance
+    - retrain:     POST /retrain (ต้องเปิดด้วย --with-retrain เพราะจะเขียนทับไฟล์โมเดล)
+
+ค่าเริ่มต้นยิงตรงเข้า ASGI app ใน process เดียวกัน พร้อม Stub Exchange (แท่งเทียนสังเคราะห์ผ่านโหมด Replay)
+จึงไม่เรียก Binance จริง
+
+เรียกใช้:
+    python loadtest.py --concurrency 16 --duration 30
+    python loadtest.py --url http://127.0.0.1:8000 --pids 1234 1235 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+
+import clock
+import data_service
+from data_service import INTERVAL_MINUTES, interval_to_ms, replay_file_path
+
+COINS = ["BTC", "ETH"]
+TIMEFRAMES = list(INTERVAL_MINUTES.keys())
+STUB_SYMBOLS = {"BTCUSDT": 50000.0, "ETHUSDT": 3000.0}
+STUB_CANDLES = 1500
+
+# สัดส่วนของแต่ละ scenario (ปรับตามพฤติกรรมผู้ใช้จริงของ Dashboard)
+DEFAULT_MIX = {"view": 0.5, "ohlcv": 0.35, "performance": 0.15, "retrain": 0.0}
+RETRAIN_WEIGHT = 0.002
+
+
+# ============================================================================
+# Stub Exchange: สร้างไฟล์แท่งเทียนสังเคราะห์ให้ data_service อ่านแทน Binance
+# ============================================================================
+
+def create_stub_exchange(directory, candles=STUB_CANDLES, seed=42):
+    """เขียนแท่งเทียนสังเคราะห์ (random walk) ของทุกเหรียญ/timeframe จนถึงเวลาปัจจุบัน"""
+    rng = random.Random(seed)
+    now_ms = clock.now_ms()
+
+    for symbol, base in STUB_SYMBOLS.items():
+        for interval in TIMEFRAMES:
+            step = interval_to_ms(interval)
+            last_open = now_ms - (now_ms % step)
+            price = base
+            rows = []
+            for i in range(candles):
+                open_time = last_open - (candles - 1 - i) * step
+                close = price * (1 + rng.gauss(0, 0.004))
+                high = max(price, close) * (1 + abs(rng.gauss(0, 0.002)))
+                low = min(price, close) * (1 - abs(rng.gauss(0, 0.002)))
+                volume = 100 + abs(rng.gauss(0, 30))
+                rows.append([
+                    open_time, f"{price:.2f}", f"{high:.2f}", f"{low:.2f}", f"{close:.2f}", f"{volume:.4f}",
+                    open_time + step - 1, "0", 0, "0", "0", "0"
+                ])
+                price = close
+            with open(replay_file_path(directory, symbol, interval), "w", encoding="utf-8") as f:
+                json.dump(rows, f)
+
+
+# ============================================================================
+# การวัดผล
+# ============================================================================
+
+def _proc_usage(pid):
+    """อ่าน CPU time (วินาที) และ RSS (MB) ของ process จาก /proc (Linux)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return cpu_seconds, rss_kb / 1024
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None, None
+
+
+def _percentile(sorted_values, pct):
+    """Percentile แบบ nearest-rank จากรายการที่เรียงแล้ว"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def _latency_summary(samples):
+    latencies = sorted(s["latency_ms"] for s in samples)
+    errors = sum(1 for s in samples if s["error"])
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "p50_ms": round(_percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(_percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99), 2) if latencies else None
+    }
+
+
+# ============================================================================
+# Virtual User: ทำตัวเหมือนหน้า Dashboard หนึ่งหน้า
+# ============================================================================
+
+class VirtualUser:
+    """ผู้ใช้จำลองหนึ่งคน เก็บ ETag และ cursor ของตัวเองเหมือน Browser"""
+
+    def __init__(self, client, samples, rng, mix):
+        self.client = client
+        self.samples = samples
+        self.rng = rng
+        self.mix = mix
+        self.etags = {}
+        self.ohlcv_cursor = {}
+
+    async def _request(self, method, url):
+        headers = {}
+        if method == "GET" and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+
+        start = time.perf_counter()
+        error = False
+        status = None
+        try:
+            response = await self.client.request(method, url, headers=headers)
+            status = response.status_code
+            if status == 304:
+                body = None
+            elif status >= 400:
+                error = True
+                body = None
+            else:
+                body = response.json()
+                error = isinstance(body, dict) and (body.get("error") is not None or body.get("status") == "error")
+                if "etag" in response.headers:
+                    self.etags[url] = response.headers["etag"]
+        except Exception:
+            error = True
+            body = None
+
+        self.samples.append({
+            "endpoint": url.split("?")[0],
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "status": status,
+            "error": error
+        })
+        return body
+
+    async def view(self):
+        coin, tf = self.rng.choice(COINS), self.rng.choice(TIMEFRAMES)
+        await asyncio.gather(
+            self._request("GET", f"/predict?coin={coin}&timeframe={tf}"),
+            self._request("GET", f"/backtest?coin={coin}&timeframe={tf}")
+        )
+
+    async def ohlcv(self):
+        coin, tf = self.rng.choice(COINS), self.rng.choice(TIMEFRAMES)
+        url = f"/ohlcv?coin={coin}&timeframe={tf}&limit=50"
+        cursor = self.ohlcv_cursor.get((coin, tf))
+        body = await self._request("GET", url if cursor is None else f"{url}&since={cursor}")
+        if body and body.get("next_cursor") is not None:
+            self.ohlcv_cursor[(coin, tf)] = body["next_cursor"]
+
+    async def performance(self):
+        await self._request("GET", f"/performance?coin={self.rng.choice(COINS)}")
+
+    async def retrain(self):
+        await self._request("POST", f"/retrain?timeframe={self.rng.choice(TIMEFRAMES)}")
+
+    async def run(self, deadline, budget):
+        scenarios = list(self.mix.keys())
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline and budget["remaining"] > 0:
+            budget["remaining"] -= 1
+            await getattr(self, self.rng.choices(scenarios, weights)[0])()
+
+
+# ============================================================================
+# ตัวรันหลัก
+# ============================================================================
+
+async def _run(client, concurrency, duration, max_scenarios, mix, seed, pids):
+    samples = []
+    budget = {"remaining": max_scenarios if max_scenarios else float("inf")}
+    before = {pid: _proc_usage(pid) for pid in pids}
+
+    start = time.perf_counter()
+    deadline = start + duration
+    users = [VirtualUser(client, samples, random.Random(seed + i), mix) for i in range(concurrency)]
+    await asyncio.gather(*(user.run(deadline, budget) for user in users))
+    elapsed = time.perf_counter() - start
+
+    workers = []
+    for pid in pids:
+        cpu_before, _ = before[pid]
+        cpu_after, rss_mb = _proc_usage(pid)
+        cpu_pct = None
+        if cpu_before is not None and cpu_after is not None:
+            cpu_pct = round((cpu_after - cpu_before) / elapsed * 100, 1)
+        workers.append({"pid": pid, "cpu_percent": cpu_pct, "rss_mb": round(rss_mb, 1) if rss_mb else None})
+
+    endpoints = {}
+    for sample in samples:
+        endpoints.setdefault(sample["endpoint"], []).append(sample)
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        "overall": _latency_summary(samples),
+        "endpoints": {name: _latency_summary(group) for name, group in sorted(endpoints.items())},
+        "workers": workers
+    }
+
+
+def run_load_test(concurrency=8, duration=30.0, max_scenarios=None, url=None, pids=None,
+                  with_retrain=False, seed=0):
+    """
+    รัน Load Test และคืนรายงาน p50/p95/p99, throughput, error rate และ CPU/RSS ต่อ worker
+
+    Args:
+        url: None = ยิงตรงเข้า ASGI app พร้อม Stub Exchange, มิฉะนั้นยิงไปยัง server ที่รันอยู่
+        pids: process ของ server ที่ต้องการวัด CPU/RSS (ค่าเริ่มต้นโหมด ASGI = process นี้)
+        max_scenarios: จำกัดจำนวน scenario ทั้งหมด (None = รันจนครบ duration)
+    """
+    mix = dict(DEFAULT_MIX)
+    if with_retrain:
+        mix["retrain"] = RETRAIN_WEIGHT
+
+    if url is not None:
+        async def remote():
+            async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+                return await _run(client, concurrency, duration, max_scenarios, mix, seed, pids or [])
+        return asyncio.run(remote())
+
+    from main import app
+
+    stub_dir = tempfile.mkdtemp(prefix="stub_exchange_")
+    previous_source = os.environ.get("REPLAY_DATA_DIR")
+    try:
+        create_stub_exchange(stub_dir)
+        data_service.set_replay_source(stub_dir)
+        # ให้ subprocess ของ /retrain อ่าน Stub Exchange เดียวกัน
+        os.environ["REPLAY_DATA_DIR"] = stub_dir
+
+        async def local():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=600) as client:
+                return await _run(client, concurrency, duration, max_scenarios, mix, seed, pids or [os.getpid()])
+        return asyncio.run(local())
+    finally:
+        data_service.set_replay_source(previous_source)
+        if previous_source is None:
+            os.environ.pop("REPLAY_DATA_DIR", None)
+        else:
+            os.environ["REPLAY_DATA_DIR"] = previous_source
+        shutil.rmtree(stub_dir, ignore_errors=True)
+
+
+def print_report(report):
+    print("=" * 78)
+    print(f"  Load Test: concurrency={report['concurrency']}  duration={report['duration_s']}s  "
+          f"throughput={report['throughput_rps']} req/s")
+    print("=" * 78)
+    print(f"{'endpoint':<16}{'requests':>10}{'errors':>8}{'err%':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    rows = list(report["endpoints"].items()) + [("ALL", report["overall"])]
+    for name, s in rows:
+        print(f"{name:<16}{s['requests']:>10}{s['errors']:>8}{s['error_rate'] * 100:>7.2f}%"
+              f"{s['p50_ms'] or 0:>12.1f}{s['p95_ms'] or 0:>12.1f}{s['p99_ms'] or 0:>12.1f}")
+    if report["workers"]:
+        print("-" * 78)
+        for w in report["workers"]:
+            print(f"worker pid={w['pid']:<8} cpu={w['cpu_percent']}%  rss={w['rss_mb']} MB")
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description='Load test Crypto AI API with dashboard traffic')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of virtual dashboard users')
+    parser.add_argument('--duration', type=float, default=30.0, help='Test duration in seconds')
+    parser.add_argument('--max-scenarios', type=int, default=None, help='Stop after this many scenarios')
+    parser.add_argument('--url', type=str, default=None, help='Target a running server instead of the ASGI app')
+    parser.add_argument('--pids', type=int, nargs='*', default=None, help='Server worker PIDs to sample CPU/RSS')
+    parser.add_argument('--with-retrain', action='store_true', help='Include occasional /retrain (overwrites models)')
+    parser.add_argument('--json', type=str, default=None, help='Write the report to this JSON file')
+    args = parser.parse_args()
+
+    result = run_load_test(
+        concurrency=args.concurrency,
+        duration=args.duration,
+        max_scenarios=args.max_scenarios,
+        url=args.url,
+        pids=args.pids,
+        with_retrain=args.with_retrain
+    )
+    print_report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
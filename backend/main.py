@@ -1,54 +1,111 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from ai_engine import predict_price, predict_with_history, models, scalers, MODELS_DIR, load_specific_model
+from ai_engine import predict_with_history, predict_batch, models, scalers, MODELS_DIR, load_specific_model, get_model_version, get_inference_stats, get_model_cache_stats, MAX_HORIZON, WINDOW, resolve_model
 from backtest import backtest
-from data_service import get_klines, get_ohlcv_data
-from scheduler import start_scheduler, stop_scheduler, get_scheduler_status
-from db import init_db
+from accuracy import get_performance as realized_performance
+from strategy import run_strategy, summarize
+from data_service import get_klines, get_ohlcv_data, INTERVAL_MINUTES, interval_to_ms, was_stale, get_upstream_status
+from scheduler import start_scheduler, stop_scheduler, get_scheduler_status, COINS
+from drift import get_drift_status
+from db import init_db, enable_wal, get_latest_prediction, save_latest_prediction
+from leader import LeaderElector
+from bisect import bisect_left
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import asyncio
+import hashlib
+import json
 import subprocess
 import sys
 import os
+import clock
+import leader
 from contextlib import asynccontextmanager
 
+# โหมดหลาย worker: ตัวเลือกตั้ง leader ของ worker นี้ (None = โหมด process เดียว)
+_elector = None
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _elector
     # ทำงานเมื่อเริ่มต้น Server (Startup)
     init_db()
-    start_scheduler()
+    if leader.MULTI_WORKER:
+        # เฉพาะ worker ที่ถือ lease เท่านั้นที่รัน Scheduler (สลับเข้า event loop เพราะ callback มาจาก thread อื่น)
+        # start_scheduler คืนทันที: backfill/การทำนายครั้งแรกรันเป็นงานของ scheduler ใน thread pool
+        enable_wal()
+        loop = asyncio.get_running_loop()
+        _elector = LeaderElector(
+            on_elected=lambda: loop.call_soon_threadsafe(start_scheduler),
+            on_lost=lambda: loop.call_soon_threadsafe(stop_scheduler)
+        ).start()
+    else:
+        start_scheduler()
     yield
     # ทำงานเมื่อปิด Server (Shutdown)
-    stop_scheduler()
+    if _elector is not None:
+        _elector.stop()
+        _elector = None
+        if get_scheduler_status()["running"]:
+            stop_scheduler()
+    else:
+        stop_scheduler()
 
 app = FastAPI(title="CryptoAI API", version="1.0.0", lifespan=lifespan)
 
 # ... (Existing code) ...
 
 @app.post("/retrain")
-def retrain_model(timeframe: str = "1h"):
-    """สั่งเทรนโมเดลใหม่ตาม Timeframe ที่ระบุ"""
+def retrain_model(timeframe: str = "1h", mode: str = "full"):
+    """
+    สั่งเทรนโมเดลใหม่ตาม Timeframe ที่ระบุ
+    mode = "full" (เทรนใหม่ทั้งหมด) หรือ "incremental" (fine-tune ต่อจากโมเดลเดิมด้วยแท่งใหม่ แล้ว promote เมื่อผ่าน holdout)
+    """
     if timeframe not in ["5m", "1h", "4h"]:
         return {"status": "error", "message": "Invalid timeframe"}
+    if mode not in ["full", "incremental"]:
+        return {"status": "error", "message": "Invalid mode"}
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
     script_path = os.path.join(current_dir, "train_model.py")
+    command = [sys.executable, script_path, "--timeframe", timeframe]
+    if mode == "incremental":
+        command.append("--incremental")
     
     try:
         # รันสคริปต์เทรนแบบ Generic โดยส่ง Parameter ไป
         result = subprocess.run(
-            [sys.executable, script_path, "--timeframe", timeframe], 
+            command, 
             capture_output=True, 
             text=True,
             encoding='utf-8',  # บังคับอ่าน output เป็น utf-8
             check=True
         )
         
+        # ผลลัพธ์จากบรรทัด "RESULT {...}" ท้าย log
+        outcome = {"promoted": True}
+        for line in reversed(result.stdout.splitlines()):
+            if line.startswith("RESULT "):
+                outcome = json.loads(line[len("RESULT "):])
+                break
+        
+        if not outcome.get("promoted", True):
+            return {
+                "status": "success",
+                "message": f"Model {timeframe} kept: {outcome.get('reason', 'fine-tuned model did not beat holdout')}",
+                "training": outcome,
+                "logs": result.stdout[-200:]
+            }
+        
         # Reload โมเดลใหม่ทันที
         load_specific_model(timeframe)
         
         return {
             "status": "success", 
             "message": f"Model {timeframe} retrained and reloaded successfully",
+            "training": outcome,
             "logs": result.stdout[-200:] # ส่ง Log พารากราฟสุดท้ายกลับไปให้ดู
         }
     except subprocess.CalledProcessError as e:
@@ -66,23 +123,130 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-# เหรียญที่รองรับ
-SUPPORTED_COINS = {
-    "BTC": "BTCUSDT",
-    "ETH": "ETHUSDT"
-}
+# เหรียญที่รองรับ (mapping เดียวกับ scheduler และ CLI ของ strategy/sweep)
+SUPPORTED_COINS = COINS
+
+# ============================================================================
+# Conditional GET: ข้อมูลกราฟจะเหมือนเดิมจนกว่าแท่งเทียนปัจจุบันจะปิด
+# จึงใช้ (symbol, timeframe, เวลาแท่งล่าสุด, เวอร์ชันโมเดล) สร้าง ETag
+# ============================================================================
+
+def _candle_window(timeframe):
+    """คืนค่า (เวลาเปิดแท่งเทียนล่าสุด ms, จำนวนวินาทีที่เหลือจนแท่งปิด)"""
+    interval_ms = interval_to_ms(timeframe)
+    now_ms = clock.now_ms()
+    open_time = now_ms - (now_ms % interval_ms)
+    remaining = (open_time + interval_ms - now_ms + 999) // 1000
+    return open_time, max(1, remaining)
+
+
+def _cache_headers(endpoint, symbol, timeframe, *extra):
+    """สร้าง ETag / Last-Modified / Cache-Control ของ response (None ถ้า timeframe ไม่รู้จัก)"""
+    if timeframe not in INTERVAL_MINUTES:
+        return None
+    
+    open_time, max_age = _candle_window(timeframe)
+    parts = [endpoint, symbol, timeframe, open_time, get_model_version(timeframe, symbol), *extra]
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:20]
+    
+    return {
+        "ETag": f'"{digest}"',
+        "Last-Modified": formatdate(open_time / 1000, usegmt=True),
+        "Cache-Control": f"public, max-age={max_age}"
+    }
+
+
+def _is_not_modified(request: Request, headers):
+    """ตรวจสอบ If-None-Match / If-Modified-Since ว่า client มีข้อมูลล่าสุดแล้วหรือไม่"""
+    if headers is None:
+        return False
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        weak_tag = "W/" + headers["ETag"]
+        return "*" in tags or headers["ETag"] in tags or weak_tag in tags
+    
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            last_modified = parsedate_to_datetime(headers["Last-Modified"])
+            return last_modified <= since
+        except (TypeError, ValueError):
+            return False
+    
+    return False
+
+
+def _conditional(request: Request, response: Response, endpoint, symbol, timeframe, *extra):
+    """ตอบ 304 ทันทีถ้า client มีข้อมูลล่าสุดแล้ว มิฉะนั้นแนบ cache headers และคืนค่า None"""
+    headers = _cache_headers(endpoint, symbol, timeframe, *extra)
+    # response ที่เป็นข้อมูลสำรองไม่มี ETag ดังนั้น validator ของ client มาจากข้อมูลใหม่ของแท่งนี้เสมอ
+    if _is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+    if headers is not None:
+        response.headers.update(headers)
+    return None
+
+
+def _stale_no_store(response: Response, stale):
+    """ถ้าข้อมูลที่ดึงในคำขอนี้เป็นข้อมูลสำรอง ห้าม cache และไม่ให้ ETag (คืนค่า stale สำหรับ body)"""
+    if stale:
+        for name in ("ETag", "Last-Modified"):
+            if name in response.headers:
+                del response.headers[name]
+        response.headers["Cache-Control"] = "no-store"
+    return stale
+
+
+# ============================================================================
+# โหมดหลาย worker: ผลทำนายของแท่งปัจจุบันถูกคำนวณครั้งเดียวแล้วแชร์ผ่านตาราง latest_predictions
+# ============================================================================
+
+def _slice_since(result, since):
+    """ตัดผลทำนายแบบเต็มให้เหลือเฉพาะแท่งที่เปิดตั้งแต่ since (ตรงกับ predict_with_history(since=...))"""
+    if since is None:
+        return result
+    start = bisect_left(result["timestamps"], since)
+    return {
+        **result,
+        **{key: result[key][start:] for key in ("times", "timestamps", "actual_prices", "predicted_prices")}
+    }
+
+
+def _shared_prediction(symbol, timeframe, since, horizon):
+    """ใช้ผลทำนายที่ leader/worker อื่นเผยแพร่ไว้สำหรับแท่งปัจจุบัน ถ้ายังไม่มีจึงคำนวณเองแล้วเผยแพร่ต่อ"""
+    open_time, _ = _candle_window(timeframe)
+    version = get_model_version(timeframe, symbol)
+    
+    result = get_latest_prediction(symbol, timeframe, horizon, open_time, version)
+    if result is None:
+        result = predict_with_history(symbol, timeframe, horizon=horizon)
+        if result["next_cursor"] == open_time and not result["stale"]:
+            save_latest_prediction(symbol, timeframe, horizon, open_time, version, result)
+    
+    return _slice_since(result, since)
+
 
 @app.get("/")
 def home():
     return {
         "status": "CryptoAI API Running",
         "supported_coins": list(SUPPORTED_COINS.keys()),
-        "endpoints": ["/predict", "/backtest", "/coins", "/history", "/ohlcv", "/performance", "/debug/models"]
+        "endpoints": ["/predict", "/predict/batch", "/backtest", "/strategy", "/coins", "/history", "/ohlcv", "/performance", "/debug/models", "/debug/upstream", "/debug/drift"]
     }
 
 @app.get("/debug/models")
 def debug_models():
-    """ตรวจสอบสถานะการโหลดโมเดล AI"""
+    """ตรวจสอบสถานะการโหลดโมเดล AI (resolved = โมเดลที่แต่ละเหรียญ/Timeframe ใช้จริง, None = ไม่มีโมเดล)"""
+    # models เป็น LRU cache ที่โหลดเมื่อใช้ - จำนวนที่อยู่ใน cache จึงบอกสถานะไม่ได้ ต้องตรวจทีละคู่
+    resolved = {
+        f"{coin}:{tf}": resolve_model(symbol, tf)
+        for coin, symbol in SUPPORTED_COINS.items()
+        for tf in ["5m", "1h", "4h"]
+    }
+    
     return {
         "models_directory": MODELS_DIR,
         "directory_exists": os.path.exists(MODELS_DIR),
@@ -90,9 +254,23 @@ def debug_models():
         "loaded_scalers": list(scalers.keys()),
         "models_count": len(models),
         "scalers_count": len(scalers),
-        "status": "OK" if len(models) == 3 else "MODELS_NOT_LOADED"
+        "resolved": resolved,
+        "missing": [pair for pair, key in resolved.items() if key is None],
+        "inference": get_inference_stats(),
+        "cache": get_model_cache_stats(),
+        "status": "OK" if all(resolved.values()) else "MODELS_NOT_LOADED"
     }
 
+@app.get("/debug/upstream")
+def debug_upstream():
+    """ตรวจสอบสถานะการเชื่อมต่อ Binance (circuit breaker และชุดข้อมูลที่ใช้ข้อมูลเก่าอยู่)"""
+    return get_upstream_status()
+
+@app.get("/debug/drift")
+def debug_drift():
+    """ผลตรวจ Drift ล่าสุดของแต่ละ (symbol, timeframe) และคิว Retrain ที่เกิดจาก drift"""
+    return get_drift_status()
+
 @app.get("/coins")
 def get_coins():
     """ดึงรายชื่อเหรียญที่รองรับ"""
@@ -104,16 +282,21 @@ def get_timeframes():
     return {"timeframes": ["5m", "1h", "4h"]}
 
 @app.get("/history")
-def get_history(coin: str = "BTC", timeframe: str = "1h", limit: int = 50):
-    """ดึงข้อมูลราคาย้อนหลังสำหรับแสดงกราฟ"""
+def get_history(request: Request, response: Response, coin: str = "BTC", timeframe: str = "1h", limit: int = 50,
+                since: Optional[int] = None):
+    """ดึงข้อมูลราคาย้อนหลังสำหรับแสดงกราฟ (since = cursor จาก response ก่อนหน้า เพื่อดึงเฉพาะแท่งใหม่)"""
     if coin.upper() not in SUPPORTED_COINS:
         return {"error": f"Coin {coin} not supported"}
     
     symbol = SUPPORTED_COINS[coin.upper()]
-    df = get_klines(symbol=symbol, interval=timeframe, limit=limit)
+    not_modified = _conditional(request, response, "history", symbol, timeframe, limit, since)
+    if not_modified is not None:
+        return not_modified
+    
+    df = get_klines(symbol=symbol, interval=timeframe, limit=limit, start_time=since)
     
     prices = df["close"].tolist()
-    times = df["time"].tolist()
+    times = [int(t) for t in df["time"].tolist()]
     
     formatted_times = []
     for t in times:
@@ -125,61 +308,176 @@ def get_history(coin: str = "BTC", timeframe: str = "1h", limit: int = 50):
         "symbol": symbol,
         "timeframe": timeframe,
         "times": formatted_times,
-        "prices": prices
+        "timestamps": times,
+        "prices": prices,
+        "next_cursor": times[-1] if times else since,
+        "stale": _stale_no_store(response, was_stale(df))
     }
 
 @app.get("/ohlcv")
-def get_ohlcv(coin: str = "BTC", timeframe: str = "1h", limit: int = 50):
-    """ดึงข้อมูล OHLCV สำหรับตารางประวัติ"""
+def get_ohlcv(request: Request, response: Response, coin: str = "BTC", timeframe: str = "1h", limit: int = 50,
+              since: Optional[int] = None):
+    """ดึงข้อมูล OHLCV สำหรับตารางประวัติ (since = cursor จาก response ก่อนหน้า เพื่อดึงเฉพาะแท่งใหม่)"""
     if coin.upper() not in SUPPORTED_COINS:
         return {"error": f"Coin {coin} not supported"}
     
     symbol = SUPPORTED_COINS[coin.upper()]
-    data = get_ohlcv_data(symbol=symbol, interval=timeframe, limit=limit)
+    not_modified = _conditional(request, response, "ohlcv", symbol, timeframe, limit, since)
+    if not_modified is not None:
+        return not_modified
+    
+    data = get_ohlcv_data(symbol=symbol, interval=timeframe, limit=limit, start_time=since)
     
     return {
         "coin": coin.upper(),
         "symbol": symbol,
         "timeframe": timeframe,
-        "data": data
+        "data": data,
+        "next_cursor": data[0]["timestamp"] if data else since,
+        "stale": _stale_no_store(response, was_stale(data))
     }
 
 @app.get("/predict")
-def predict(coin: str = "BTC", timeframe: str = "1h"):
-    """ดึงผลการทำนายราคาพร้อมข้อมูลประวัติสำหรับกราฟ"""
+def predict(request: Request, response: Response, coin: str = "BTC", timeframe: str = "1h",
+            since: Optional[int] = None, horizon: int = 1, confidence: float = 0.0):
+    """
+    ดึงผลการทำนายราคาพร้อมข้อมูลประวัติสำหรับกราฟ (since = cursor จาก response ก่อนหน้า)
+    horizon = จำนวนแท่งที่ทำนายล่วงหน้า (forecast_prices)
+    confidence = ระดับความเชื่อมั่นของช่วงราคาที่ทำนาย เช่น 0.9 (MC Dropout, คืนใน "bands")
+    """
     if coin.upper() not in SUPPORTED_COINS:
         return {"error": f"Coin {coin} not supported"}
+    if not 1 <= horizon <= MAX_HORIZON:
+        return {"error": f"Horizon must be between 1 and {MAX_HORIZON}"}
+    if not 0 <= confidence < 1:
+        return {"error": "Confidence must be between 0 and 1"}
     
     symbol = SUPPORTED_COINS[coin.upper()]
-    result = predict_with_history(symbol, timeframe)
+    not_modified = _conditional(request, response, "predict", symbol, timeframe, since, horizon, confidence)
+    if not_modified is not None:
+        return not_modified
+    
+    # ผลที่เผยแพร่ร่วมกันไม่มีช่วงความเชื่อมั่น - คำขอที่ขอช่วงจึงคำนวณเอง
+    if leader.MULTI_WORKER and timeframe in INTERVAL_MINUTES and not confidence:
+        result = _shared_prediction(symbol, timeframe, since, horizon)
+    else:
+        result = predict_with_history(symbol, timeframe, since=since, horizon=horizon, confidence=confidence)
     
     return {
         "coin": coin.upper(),
         "symbol": symbol,
         "timeframe": timeframe,
-        **result
+        **result,
+        "stale": _stale_no_store(response, result.get("stale", False))
     }
 
+class BatchPair(BaseModel):
+    coin: str
+    timeframe: str = "1h"
+
+
+# จำนวนคู่สูงสุดต่อคำขอ /predict/batch (แต่ละคู่อาจต้องดึงข้อมูลจาก Binance)
+MAX_BATCH_PAIRS = 20
+
+
+class BatchPredictRequest(BaseModel):
+    pairs: List[BatchPair] = Field(..., max_length=MAX_BATCH_PAIRS)
+    horizon: int = 1
+
+
+@app.post("/predict/batch")
+def predict_batch_endpoint(body: BatchPredictRequest):
+    """ทำนายหลายเหรียญ/หลาย Timeframe ในคำขอเดียว (เช่น Watchlist)"""
+    if not 1 <= body.horizon <= MAX_HORIZON:
+        return {"error": f"Horizon must be between 1 and {MAX_HORIZON}"}
+    
+    pairs = [(pair.coin.upper(), pair.timeframe) for pair in body.pairs]
+    valid = [
+        (SUPPORTED_COINS[coin], tf) for coin, tf in pairs
+        if coin in SUPPORTED_COINS and tf in INTERVAL_MINUTES
+    ]
+    predictions = predict_batch(valid, horizon=body.horizon)
+    
+    # คืนผลตามลำดับคำขอเดิม
+    results = []
+    for coin, tf in pairs:
+        if coin not in SUPPORTED_COINS:
+            results.append({"coin": coin, "timeframe": tf, "error": f"Coin {coin} not supported"})
+        elif tf not in INTERVAL_MINUTES:
+            results.append({"coin": coin, "timeframe": tf, "error": "Invalid timeframe"})
+        else:
+            symbol = SUPPORTED_COINS[coin]
+            results.append({
+                "coin": coin,
+                "symbol": symbol,
+                "timeframe": tf,
+                "stale": False,
+                **predictions[(symbol, tf)]
+            })
+    
+    return {"results": results, "count": len(results)}
+
 @app.get("/backtest")
-def run_backtest(coin: str = "BTC", timeframe: str = "1h"):
+def run_backtest(request: Request, response: Response, coin: str = "BTC", timeframe: str = "1h"):
     """รัน Backtest สำหรับเหรียญที่เลือก"""
     if coin.upper() not in SUPPORTED_COINS:
         return {"error": f"Coin {coin} not supported"}
     
     symbol = SUPPORTED_COINS[coin.upper()]
-    mae, rmse = backtest(symbol, timeframe)
+    not_modified = _conditional(request, response, "backtest", symbol, timeframe)
+    if not_modified is not None:
+        return not_modified
+    
+    mae, rmse, stale = backtest(symbol, timeframe, with_stale=True)
     
     return {
         "coin": coin.upper(),
         "symbol": symbol,
         "timeframe": timeframe,
         "mae": mae,
-        "rmse": rmse
+        "rmse": rmse,
+        "stale": _stale_no_store(response, stale)
+    }
+
+# จำนวนแท่งสูงสุดที่ /strategy จำลองต่อคำขอ (ทั้งหมดถูกทำนายในคำขอเดียว)
+MAX_STRATEGY_CANDLES = 20000
+
+@app.get("/strategy")
+def run_strategy_endpoint(coin: str = "BTC", timeframe: str = "1h",
+                          limit: int = Query(5000, ge=WINDOW + 100, le=MAX_STRATEGY_CANDLES),
+                          threshold: float = Query(0.0, ge=0, le=1),
+                          fee: float = Query(0.001, ge=0, le=1),
+                          slippage: float = Query(0.0005, ge=0, le=1),
+                          position_size: float = Query(1.0, ge=0, le=1),
+                          allow_short: bool = False,
+                          signal_window: int = Query(1, ge=1, le=MAX_STRATEGY_CANDLES)):
+    """จำลองผลกำไร/ขาดทุนของสัญญาณ Uptrend/Downtrend จากโมเดลย้อนหลัง (พารามิเตอร์นอกช่วงได้ 422)"""
+    if coin.upper() not in SUPPORTED_COINS:
+        return {"error": f"Coin {coin} not supported"}
+    if timeframe not in INTERVAL_MINUTES:
+        return {"error": "Invalid timeframe"}
+    
+    symbol = SUPPORTED_COINS[coin.upper()]
+    times, result = run_strategy(
+        symbol, timeframe, limit,
+        threshold=threshold, fee=fee, slippage=slippage,
+        position_size=position_size, allow_short=allow_short, signal_window=signal_window
+    )
+    
+    return {
+        "coin": coin.upper(),
+        "symbol": symbol,
+        "timeframe": timeframe,
+        "bars": len(times),
+        **summarize(times, result)
     }
 
 @app.get("/performance")
 def get_performance(coin: str = "BTC"):
-    """ดึงประสิทธิภาพของโมเดลสำหรับทุก Timeframe"""
+    """
+    ดึงประสิทธิภาพจริงของโมเดลสำหรับทุก Timeframe (ผลทำนายที่บันทึกไว้เทียบกับราคาปิดจริงของแท่งเป้าหมาย)
+    อ่านจากผลรวมที่งาน accuracy_evaluation สะสมไว้ ไม่รันโมเดลหรือ backtest
+    """
     if coin.upper() not in SUPPORTED_COINS:
         return {"error": f"Coin {coin} not supported"}
     
@@ -188,19 +486,8 @@ def get_performance(coin: str = "BTC"):
     results = {}
     for tf in ["5m", "1h", "4h"]:
         try:
-            mae, rmse = backtest(symbol, tf)
-            # คำนวณความแม่นยำ (ส่วนกลับของ error)
-            current, predicted = predict_price(symbol, tf)
-            error_pct = abs(predicted - current) / current * 100
-            accuracy = max(0, 100 - error_pct)
-            
-            results[tf] = {
-                "mae": mae,
-                "rmse": rmse,
-                "accuracy": accuracy,
-                "current_price": current,
-                "predicted_price": predicted
-            }
+            performance = realized_performance(coin.upper(), tf, get_model_version(tf, symbol))
+            results[tf] = performance if performance is not None else {"error": "No evaluated predictions yet"}
         except Exception as e:
             results[tf] = {"error": str(e)}
     
@@ -212,5 +499,8 @@ def get_performance(coin: str = "BTC"):
 
 @app.get("/scheduler")
 def scheduler_status():
-    """ดึงสถานะ Scheduler และข้อมูลงาน"""
-    return get_scheduler_status()
+    """ดึงสถานะ Scheduler และข้อมูลงาน (โหมดหลาย worker จะบอกด้วยว่า worker ไหนเป็น leader)"""
+    status = get_scheduler_status()
+    if _elector is not None:
+        status["leader"] = _elector.status()
+    return status
@@ -0,0 +1,194 @@
+"""
+Model Cache: เก็บโมเดลที่โหลดแล้วไว้ในหน่วยความจำแบบจำกัดขนาด (จำนวนโมเดล และ/หรือ จำนวนไบต์)
+- โหลดเมื่อถูกเรียกใช้ครั้งแรก (lazy) และเอาโมเดลที่ไม่ได้ใช้นานที่สุดออกเมื่อเกินงบ (LRU)
+- คำขอที่ต้องการโมเดลเดียวกันพร้อมกันจะรอการโหลดครั้งเดียว ไม่โหลดไฟล์ซ้ำ
+- ใช้แทน dict ได้ (models[key], key in models, del models[key], models.keys() ...)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+def model_nbytes(model):
+    """ประมาณขนาดน้ำหนักของโมเดล (ไบต์) - รองรับทั้ง MappedModel (nbytes) และโมเดล Keras (weights)"""
+    nbytes = getattr(model, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    try:
+        return int(sum(int(w.numpy().nbytes) for w in model.weights))
+    except Exception:
+        return 0
+
+
+class ModelCache(MutableMapping):
+    """
+    LRU cache ของโมเดล
+
+    Args:
+        loader: ฟังก์ชัน loader(key) -> โมเดล หรือ None (ไม่มีไฟล์/โหลดไม่สำเร็จ)
+        probe: ฟังก์ชัน probe(key) -> ตัวระบุไฟล์ (เช่น path + mtime) หรือ None ถ้าไม่มีไฟล์
+               ใช้ตอบ `key in cache` โดยไม่ต้องโหลด และเพื่อไม่ลองโหลดไฟล์ที่เคยโหลดไม่สำเร็จซ้ำ
+        max_models, max_bytes: งบของ cache (0 = ไม่จำกัด)
+    """
+
+    def __init__(self, loader, probe, max_models=0, max_bytes=0, sizeof=model_nbytes):
+        self.loader = loader
+        self.probe = probe
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (model, nbytes) เรียงจากใช้ล่าสุดน้อยไปมาก
+        self._bytes = 0
+        self._failed = {}  # key -> ตัวระบุไฟล์ที่โหลดไม่สำเร็จ
+        self._loading = {}  # key -> Event ของการโหลดที่กำลังทำอยู่
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "load_failures": 0,
+                       "deduplicated": 0, "evictions": 0, "load_seconds": 0.0}
+
+    # ------------------------------------------------------------------
+    # dict interface
+    # ------------------------------------------------------------------
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+        model = self._load(key)
+        if model is None:
+            raise KeyError(key)
+        return model
+
+    def __contains__(self, key):
+        """มีโมเดลในหน่วยความจำ หรือมีไฟล์ที่โหลดได้ (ไม่โหลดจริง)"""
+        with self._lock:
+            if key in self._entries:
+                return True
+        identity = self.probe(key)
+        return identity is not None and self._failed.get(key) != identity
+
+    def __setitem__(self, key, model):
+        with self._lock:
+            self._put(key, model)
+
+    def __delitem__(self, key):
+        with self._lock:
+            _, nbytes = self._entries.pop(key)
+            self._bytes -= nbytes
+
+    def __iter__(self):
+        """วนเฉพาะโมเดลที่อยู่ในหน่วยความจำ"""
+        with self._lock:
+            return iter(list(self._entries))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def pop(self, key, *default):
+        """เอาโมเดลออกจากหน่วยความจำ (ไม่โหลดเพียงเพื่อจะเอาออก)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                if default:
+                    return default[0]
+                raise KeyError(key)
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def copy(self):
+        """สำเนาโมเดลที่อยู่ในหน่วยความจำเป็น dict (ใช้กับ unittest.mock.patch.dict)"""
+        with self._lock:
+            return {key: model for key, (model, _) in self._entries.items()}
+
+    # ------------------------------------------------------------------
+    # การโหลดและการเอาออก
+    # ------------------------------------------------------------------
+
+    def reload(self, key):
+        """โหลดไฟล์ของ key ใหม่ (เช่นหลัง Retrain) - คืนโมเดลใหม่ หรือ None และเอาของเดิมออก"""
+        with self._lock:
+            self._failed.pop(key, None)
+        model = self._load(key, force=True)
+        if model is None:
+            self.pop(key, None)
+        return model
+
+    def _load(self, key, force=False):
+        """โหลดโมเดล key โดยมีผู้โหลดจริงเพียง thread เดียว (thread อื่นรอผลเดียวกัน)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not force:
+                return entry[0]
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = self._loading[key] = threading.Event()
+            else:
+                self._stats["deduplicated"] += 1
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+        try:
+            identity = self.probe(key)
+            if identity is None or self._failed.get(key) == identity:
+                return None  # ไม่มีไฟล์ หรือเป็นไฟล์เดิมที่เคยโหลดไม่สำเร็จ
+            start = time.perf_counter()
+            model = self.loader(key)
+            with self._lock:
+                self._stats["load_seconds"] += time.perf_counter() - start
+                if model is None:
+                    self._stats["load_failures"] += 1
+                    self._failed[key] = identity
+                else:
+                    self._stats["loads"] += 1
+                    self._failed.pop(key, None)
+                    self._put(key, model)
+            return model
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def _put(self, key, model):
+        """ใส่โมเดล (เรียกขณะถือ lock) แล้วเอาโมเดลที่ใช้นานที่สุดออกจนอยู่ในงบ (ไม่เอาตัวที่เพิ่งใส่ออก)"""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        nbytes = self.sizeof(model)
+        self._entries[key] = (model, nbytes)
+        self._bytes += nbytes
+        while len(self._entries) > 1 and (
+            (self.max_models and len(self._entries) > self.max_models)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self._bytes -= evicted_bytes
+            self._stats["evictions"] += 1
+
+    def stats(self):
+        """สถิติ hit/miss, การโหลด และการใช้งบของ cache"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["resident"] = len(self._entries)
+            stats["resident_bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["load_seconds"] = round(stats["load_seconds"], 3)
+        stats["max_models"] = self.max_models
+        stats["max_bytes"] = self.max_bytes
+        return stats
@@ -0,0 +1,230 @@
+"""
+Rate Limit Governor: คุมงบ request weight ที่ Binance กำหนดต่อ IP (REQUEST_WEIGHT ต่อนาที)
+ทุกคำขอไปยัง upstream ต้องขอ weight จาก token bucket กลางก่อนเรียกจริง
+
+- ระดับความสำคัญ (priority) อ่านจาก contextvar: INTERACTIVE (คำขอจากผู้ใช้) > SCHEDULED (งานของ Scheduler)
+  > BULK (ดึงข้อมูลเทรน/backfill) ระดับที่ต่ำกว่าต้องเว้นงบส่วนหนึ่งไว้ให้ระดับที่สูงกว่า และต้องรอเมื่อมีระดับที่สูงกว่ารออยู่
+- ซิงก์กับ header X-MBX-USED-WEIGHT-1M ของทุก response: weight ที่ process อื่น (เช่น train_model.py) ใช้ไปจาก IP เดียวกัน
+  ทำให้งบของเราลดลงด้วย
+- เมื่อโดน 429/418 จะหยุดทุกระดับตาม Retry-After และลดงบลงครึ่งหนึ่ง แล้วค่อยๆ เพิ่มกลับเมื่อไม่โดนจำกัดอีก (AIMD)
+"""
+
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("rate_limit")
+
+# ระดับความสำคัญ (เลขน้อย = สำคัญกว่า)
+INTERACTIVE = 0
+SCHEDULED = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", SCHEDULED: "scheduled", BULK: "bulk"}
+
+# สัดส่วนของงบที่แต่ละระดับต้องเว้นไว้ให้ระดับที่สูงกว่า
+RESERVE = {INTERACTIVE: 0.0, SCHEDULED: 0.2, BULK: 0.5}
+# เวลารอสูงสุด (วินาที) ก่อนยอมแพ้ - คำขอของผู้ใช้ใช้ข้อมูลสำรองแทนการรอนาน (None = รอจนได้)
+MAX_WAIT = {INTERACTIVE: 2.0, SCHEDULED: 60.0, BULK: None}
+
+# งบ weight ต่อนาทีของ Binance และสัดส่วนที่ยอมใช้ (เผื่อไว้สำหรับความคลาดเคลื่อนของนาฬิกา)
+WEIGHT_LIMIT = int(os.environ.get("UPSTREAM_WEIGHT_LIMIT", "6000"))
+WEIGHT_SAFETY = float(os.environ.get("UPSTREAM_WEIGHT_SAFETY", "0.8"))
+
+# งบต่ำสุดหลังถูกลดจากการโดนจำกัด และอัตราการเพิ่มกลับต่อหนึ่งหน้าต่างเวลา
+MIN_FACTOR = 0.1
+RECOVERY_PER_WINDOW = 0.1
+
+_priority = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+_DEFAULT_WAIT = object()
+
+
+class ThrottledError(RuntimeError):
+    """ได้รับงบ weight ไม่ทันภายในเวลารอสูงสุดของระดับความสำคัญนั้น"""
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def priority(level):
+    """กำหนดระดับความสำคัญของคำขอ upstream ทั้งหมดภายในบล็อก with"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def with_priority(level):
+    """decorator: รันฟังก์ชันด้วยระดับความสำคัญที่กำหนด (เช่นงานของ Scheduler)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with priority(level):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def klines_weight(limit):
+    """weight ของ /api/v3/klines ตามจำนวนแท่งที่ขอ (ตามตารางของ Binance)"""
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def _header_number(headers, name):
+    """อ่าน header ที่เป็นตัวเลข (None ถ้าไม่มีหรืออ่านไม่ได้)"""
+    try:
+        value = headers.get(name)
+    except AttributeError:
+        return None
+    if not isinstance(value, (str, bytes, int, float)):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class WeightGovernor:
+    """
+    Token bucket ของ request weight
+
+    ความจุ = limit * safety * factor และเติมเต็มภายใน `window` วินาที
+    factor ลดลงครึ่งหนึ่งทุกครั้งที่โดน 429/418 และเพิ่มกลับทีละ RECOVERY_PER_WINDOW ต่อ window
+    """
+
+    def __init__(self, limit=WEIGHT_LIMIT, safety=WEIGHT_SAFETY, window=60.0, timer=time.monotonic):
+        self.limit = limit
+        self.safety = safety
+        self.window = window
+        self.timer = timer
+        self.factor = 1.0
+        self._tokens = self.capacity
+        self._updated = timer()
+        self._blocked_until = 0.0
+        self._last_used_weight = None
+        self._waiting = {level: 0 for level in PRIORITY_NAMES}
+        self._cond = threading.Condition()
+        self._stats = {
+            "granted": {name: 0 for name in PRIORITY_NAMES.values()},
+            "weight": {name: 0 for name in PRIORITY_NAMES.values()},
+            "rejected": {name: 0 for name in PRIORITY_NAMES.values()},
+            "waited_seconds": 0.0,
+            "throttled": 0
+        }
+
+    @property
+    def capacity(self):
+        return self.limit * self.safety * self.factor
+
+    def _refill(self, now):
+        """เติม token ตามเวลาที่ผ่านไป และเพิ่มงบกลับเมื่อพ้นช่วงที่ถูกจำกัด (เรียกขณะถือ lock)"""
+        elapsed = max(0.0, now - self._updated)
+        self._updated = now
+        if self.factor < 1.0 and now >= self._blocked_until:
+            self.factor = min(1.0, self.factor + RECOVERY_PER_WINDOW * elapsed / self.window)
+        self._tokens = min(self.capacity, self._tokens + self.capacity * elapsed / self.window)
+
+    def _required(self, level, weight):
+        """จำนวน token ที่ต้องมีก่อนให้สิทธิ์ (weight + ส่วนที่เว้นไว้ให้ระดับที่สูงกว่า ไม่เกินความจุ)"""
+        return min(self.capacity, self.capacity * RESERVE[level] + weight)
+
+    def _delay(self, level, weight, now):
+        """เวลาที่ต้องรอจนให้สิทธิ์ได้ (0 = ให้ได้ทันที)"""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if any(self._waiting[higher] for higher in PRIORITY_NAMES if higher < level):
+            return self.window  # รอให้ระดับที่สูงกว่าได้ก่อน (ถูกปลุกด้วย notify เมื่อสถานะเปลี่ยน)
+        missing = self._required(level, weight) - self._tokens
+        return max(0.0, missing * self.window / self.capacity)
+
+    def acquire(self, weight, level=None, max_wait=_DEFAULT_WAIT):
+        """
+        ขอ weight ก่อนเรียก upstream (block จนได้ หรือ raise ThrottledError เมื่อรอนานเกิน max_wait)
+
+        Returns:
+            เวลาที่รอ (วินาที)
+        """
+        level = current_priority() if level is None else level
+        max_wait = MAX_WAIT[level] if max_wait is _DEFAULT_WAIT else max_wait
+        name = PRIORITY_NAMES[level]
+        start = self.timer()
+        with self._cond:
+            self._waiting[level] += 1
+            try:
+                while True:
+                    now = self.timer()
+                    self._refill(now)
+                    delay = self._delay(level, weight, now)
+                    if delay <= 0:
+                        self._tokens -= weight
+                        waited = now - start
+                        self._stats["granted"][name] += 1
+                        self._stats["weight"][name] += weight
+                        self._stats["waited_seconds"] += waited
+                        return waited
+                    if max_wait is not None:
+                        remaining = max_wait - (now - start)
+                        if delay > remaining and not any(self._waiting[h] for h in PRIORITY_NAMES if h < level):
+                            # รอไปก็ไม่ทัน - แจ้งทันทีแทนการรอจนหมดเวลา
+                            self._stats["rejected"][name] += 1
+                            raise ThrottledError(f"Upstream weight budget exhausted for {name} requests")
+                        if remaining <= 0:
+                            self._stats["rejected"][name] += 1
+                            raise ThrottledError(f"Timed out waiting for upstream weight ({name})")
+                        delay = min(delay, remaining)
+                    self._cond.wait(delay)
+            finally:
+                self._waiting[level] -= 1
+                self._cond.notify_all()
+
+    def observe(self, headers, status_code=None):
+        """อัปเดตงบจาก response: weight ที่ใช้ไปแล้วของ IP และการโดนจำกัด (429 / 418 = ถูกแบน)"""
+        used = _header_number(headers, "X-MBX-USED-WEIGHT-1M")
+        if used is None:
+            used = _header_number(headers, "X-MBX-USED-WEIGHT")
+        with self._cond:
+            now = self.timer()
+            self._refill(now)
+            if used is not None:
+                self._last_used_weight = int(used)
+                self._tokens = min(self._tokens, self.capacity - used)
+            if status_code in (418, 429):
+                retry_after = _header_number(headers, "Retry-After")
+                self._blocked_until = max(self._blocked_until, now + (retry_after if retry_after is not None else self.window))
+                self.factor = max(MIN_FACTOR, self.factor / 2)
+                self._tokens = min(self._tokens, 0.0)
+                self._stats["throttled"] += 1
+                logger.warning(
+                    "Upstream throttled (HTTP %s): pausing %.1fs, budget reduced to %.0f%%",
+                    status_code, self._blocked_until - now, self.factor * 100
+                )
+            self._cond.notify_all()
+
+    def status(self):
+        """สถานะงบปัจจุบันและสถิติต่อระดับความสำคัญ"""
+        with self._cond:
+            now = self.timer()
+            self._refill(now)
+            return {
+                "limit": self.limit,
+                "capacity": round(self.capacity, 1),
+                "available": round(self._tokens, 1),
+                "factor": round(self.factor, 3),
+                "blocked_seconds": round(max(0.0, self._blocked_until - now), 1),
+                "last_used_weight": self._last_used_weight,
+                "waiting": {PRIORITY_NAMES[level]: n for level, n in self._waiting.items()},
+                **{key: dict(value) if isinstance(value, dict) else value for key, value in self._stats.items()},
+                "waited_seconds": round(self._stats["waited_seconds"], 3)
+            }
@@ -0,0 +1,191 @@
+"""
+โหมด Replay: รันระบบทั้งชุดแบบออฟไลน์ด้วยแท่งเทียนที่บันทึกไว้และนาฬิกาจำลอง
+ใช้สำหรับวัด Throughput และตรวจพฤติกรรมของ scheduler แบบ end-to-end โดยไม่ต้องรอเวลาจริง
+
+เรียกใช้:
+    python replay.py record --days 30 --out replay_data
+    python replay.py run --data replay_data --db crypto_ai_replay.db [--speed 0]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import clock
+import db
+import data_service
+import scheduler
+from data_service import INTERVAL_MINUTES, interval_to_ms, fetch_klines, replay_file_path
+
+# จำนวนแท่งเทียนที่ต้องมีก่อนเริ่ม Replay (ต้องพอสำหรับ WINDOW + indicators ใน predict_price)
+WARMUP_CANDLES = 120
+REPLAY_DB_PATH = "crypto_ai_replay.db"
+
+
+def record_klines(symbol, interval, start_ms, end_ms, directory):
+    """ดาวน์โหลดแท่งเทียนช่วง [start_ms, end_ms) จาก Binance แบบแบ่งหน้า แล้วบันทึกเป็นไฟล์ Replay"""
+    rows = []
+    cursor = start_ms
+    while cursor < end_ms:
+        batch = fetch_klines(symbol, interval, limit=1000, start_time=cursor)
+        if not batch:
+            break
+        rows.extend(r for r in batch if int(r[0]) < end_ms)
+        cursor = int(batch[-1][0]) + interval_to_ms(interval)
+
+    os.makedirs(directory, exist_ok=True)
+    path = replay_file_path(directory, symbol, interval)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rows, f)
+
+    print(f"  ✓ {symbol} {interval}: {len(rows)} candles -> {path}")
+    return path
+
+
+def record(days, directory, symbols=None, intervals=None):
+    """บันทึกแท่งเทียนย้อนหลัง `days` วัน (รวมช่วง warmup) ของทุกเหรียญ/timeframe"""
+    data_service.set_replay_source(None)
+    symbols = symbols or list(scheduler.COINS.values())
+    intervals = intervals or list(INTERVAL_MINUTES.keys())
+
+    end_ms = clock.now_ms()
+    for interval in intervals:
+        start_ms = end_ms - days * 86_400_000 - WARMUP_CANDLES * interval_to_ms(interval)
+        for symbol in symbols:
+            record_klines(symbol, interval, start_ms, end_ms, directory)
+
+
+def _replay_range(directory):
+    """หาช่วงเวลาที่ Replay ได้จากไฟล์: เริ่มหลัง warmup ของทุกไฟล์ และจบที่แท่งสุดท้ายที่มีครบทุกไฟล์"""
+    starts, ends = [], []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        interval = stem.rsplit("_", 1)[-1]
+        if ext != ".json" or interval not in INTERVAL_MINUTES:
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            rows = json.load(f)
+        if len(rows) <= WARMUP_CANDLES:
+            continue
+        starts.append(int(rows[WARMUP_CANDLES][0]))
+        ends.append(int(rows[-1][0]) + interval_to_ms(interval))
+
+    if not starts:
+        raise ValueError(f"No usable replay files in {directory}")
+    return max(starts), min(ends)
+
+
+def run_replay(directory, db_path=REPLAY_DB_PATH, start_ms=None, end_ms=None, speed=0.0):
+    """
+    เล่นงานของ scheduler ตามนาฬิกาจำลองตั้งแต่ start_ms ถึง end_ms
+
+    Args:
+        directory: โฟลเดอร์ไฟล์ Replay
+        db_path: ฐานข้อมูลแยกสำหรับผลทำนายจาก Replay
+        speed: ตัวคูณความเร็วเทียบกับเวลาจริง (0 = เร็วที่สุดเท่าที่ทำได้)
+
+    Returns:
+        Dict สรุปจำนวนงาน ผลทำนาย และ Throughput
+    """
+    data_service.set_replay_source(directory)
+    db.DB_PATH = db_path
+    db.init_db()
+
+    range_start, range_end = _replay_range(directory)
+    start_ms = start_ms or range_start
+    end_ms = end_ms or range_end
+
+    sim = clock.SimulatedClock(start_ms / 1000)
+    clock.use_clock(sim)
+    tz = ZoneInfo(scheduler.SCHEDULER_TIMEZONE)
+    start_dt = datetime.fromtimestamp(start_ms / 1000, tz)
+
+    conn = db.get_db()
+    rows_before = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+    conn.close()
+
+    print("=" * 50)
+    print("  Replay Mode")
+    print("=" * 50)
+    print(f"From: {start_dt}  To: {datetime.fromtimestamp(end_ms / 1000, tz)}")
+    print(f"Database: {db_path}")
+
+    wall_start = time.perf_counter()
+    jobs_run = 0
+
+    try:
+        # รันการทำนายครั้งแรกเหมือนตอน start_scheduler
+        scheduler.run_all_predictions()
+        jobs_run += 1
+
+        # ใช้ trigger ชุดเดียวกับ APScheduler แต่คำนวณเวลารันถัดไปจากนาฬิกาจำลอง
+        specs = scheduler.get_job_specs(start_date=start_dt)
+        next_runs = [spec["trigger"].get_next_fire_time(None, start_dt) for spec in specs]
+
+        while True:
+            pending = [(fire, i) for i, fire in enumerate(next_runs) if fire is not None]
+            if not pending:
+                break
+            fire, i = min(pending)
+            if fire.timestamp() * 1000 >= end_ms:
+                break
+
+            if speed > 0:
+                time.sleep(max(0.0, fire.timestamp() - sim.time()) / speed)
+            sim.set(fire.timestamp())
+
+            specs[i]["func"]()
+            jobs_run += 1
+            next_runs[i] = specs[i]["trigger"].get_next_fire_time(fire, fire)
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+
+    wall_seconds = time.perf_counter() - wall_start
+    conn = db.get_db()
+    predictions = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - rows_before
+    conn.close()
+
+    simulated_seconds = (end_ms - start_ms) / 1000
+    report = {
+        "simulated_hours": round(simulated_seconds / 3600, 2),
+        "wall_seconds": round(wall_seconds, 2),
+        "speedup": round(simulated_seconds / wall_seconds, 1) if wall_seconds > 0 else None,
+        "jobs_run": jobs_run,
+        "predictions": predictions,
+        "predictions_per_second": round(predictions / wall_seconds, 2) if wall_seconds > 0 else None
+    }
+
+    print("-" * 50)
+    for key, value in report.items():
+        print(f"{key:<24}{value}")
+    print("=" * 50)
+    return report
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description='Replay Crypto AI scheduler offline')
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Download klines to replay files")
+    rec.add_argument("--days", type=int, default=30)
+    rec.add_argument("--out", type=str, default="replay_data")
+    rec.add_argument("--symbols", nargs="*", default=None)
+    rec.add_argument("--intervals", nargs="*", default=None)
+
+    run = sub.add_parser("run", help="Replay scheduler jobs on a simulated clock")
+    run.add_argument("--data", type=str, default="replay_data")
+    run.add_argument("--db", type=str, default=REPLAY_DB_PATH)
+    run.add_argument("--speed", type=float, default=0.0, help="Multiple of real time (0 = as fast as possible)")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.days, args.out, args.symbols, args.intervals)
+    else:
+        run_replay(args.data, args.db, speed=args.speed)
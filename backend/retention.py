@@ -0,0 +1,191 @@
+"""
+Retention ของตาราง predictions: ให้ขนาดฐานข้อมูลและเวลา query คงที่แม้รันไปหลายเดือน
+- เก็บแถวดิบไว้ RAW_RETENTION_DAYS วัน แถวที่เก่ากว่านั้นถูกรวม (rollup) เป็นรายชั่วโมงในตาราง prediction_rollups แล้วลบ
+- rollup รายชั่วโมงที่เก่ากว่า HOURLY_RETENTION_DAYS วันถูกรวมต่อเป็นรายวัน
+- ก่อนลบแถวดิบ สามารถ archive เป็นไฟล์ columnar แบบบีบอัดแยกตามเดือน (Parquet ถ้ามี pyarrow ไม่งั้น .npz)
+- คืนพื้นที่ที่ว่างด้วย incremental vacuum ทีละส่วน (ไม่ล็อกฐานข้อมูลนานเหมือน VACUUM ทั้งไฟล์)
+
+เรียกใช้เอง:
+    python retention.py --raw-days 30 --hourly-days 365 --archive archive
+"""
+
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import clock
+import db
+
+logger = logging.getLogger("retention")
+
+RAW_RETENTION_DAYS = int(os.environ.get("RAW_RETENTION_DAYS", "30"))
+HOURLY_RETENTION_DAYS = int(os.environ.get("HOURLY_RETENTION_DAYS", "365"))
+# โฟลเดอร์ archive ของแถวดิบก่อนลบ (ว่าง = ไม่ archive)
+ARCHIVE_DIR = os.environ.get("PREDICTIONS_ARCHIVE_DIR", "")
+# จำนวนหน้าที่คืนให้ระบบไฟล์ต่อรอบ (หน้า SQLite ละ 4 KB โดยปริยาย)
+VACUUM_PAGES = 2000
+
+# ผลรวมของแต่ละกลุ่ม (เหมือนกันทั้งการ rollup จากแถวดิบและจากรายชั่วโมงเป็นรายวัน)
+ROLLUP_COLUMNS = ["predictions", "sum_current_price", "sum_predicted_price", "uptrends",
+                  "evaluated", "sum_abs_error", "sum_sq_error", "hits"]
+
+_ROLLUP_FROM_RAW = """
+    SELECT coin, timeframe, 'hour', strftime('%Y-%m-%d %H:00:00', created_at), COALESCE(model_version, 'unknown'),
+           COUNT(*),
+           SUM(current_price),
+           SUM(predicted_price),
+           SUM(trend = 'Uptrend'),
+           COUNT(actual_price),
+           COALESCE(SUM(ABS(predicted_price - actual_price)), 0),
+           COALESCE(SUM((predicted_price - actual_price) * (predicted_price - actual_price)), 0),
+           COALESCE(SUM((predicted_price - current_price) * (actual_price - current_price) > 0), 0)
+    FROM predictions
+    WHERE created_at < ?
+    GROUP BY 1, 2, 4, 5
+"""
+
+_ROLLUP_HOURLY_TO_DAILY = f"""
+    SELECT coin, timeframe, 'day', substr(bucket_start, 1, 10) || ' 00:00:00', model_version,
+           {', '.join(f'SUM({col})' for col in ROLLUP_COLUMNS)}
+    FROM prediction_rollups
+    WHERE period = 'hour' AND bucket_start < ?
+    GROUP BY 1, 2, 4, 5
+"""
+
+_UPSERT = f"""
+    INSERT INTO prediction_rollups (coin, timeframe, period, bucket_start, model_version, {', '.join(ROLLUP_COLUMNS)})
+    {{select}}
+    ON CONFLICT (coin, timeframe, period, bucket_start, model_version) DO UPDATE SET
+        {', '.join(f'{col} = {col} + excluded.{col}' for col in ROLLUP_COLUMNS)}
+"""
+
+
+def _cutoff(days):
+    """เวลาตัด (รูปแบบเดียวกับ created_at: UTC 'YYYY-MM-DD HH:MM:SS') ย้อนจากนาฬิกากลาง"""
+    return datetime.fromtimestamp(clock.time() - days * 86400, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def archive_predictions(conn, cutoff, directory):
+    """
+    เขียนแถวดิบที่เก่ากว่า cutoff เป็นไฟล์ columnar แบบบีบอัด แยกโฟลเดอร์ตามเดือน (month=YYYY-MM)
+    ชื่อไฟล์มีช่วง id จึงรันซ้ำได้โดยไม่ทับไฟล์เดิม
+
+    Returns:
+        รายการไฟล์ที่เขียน
+    """
+    df = pd.read_sql_query("SELECT * FROM predictions WHERE created_at < ? ORDER BY id", conn, params=(cutoff,))
+    if df.empty:
+        return []
+
+    try:
+        import pyarrow  # noqa: F401 - Parquet เป็น optional dependency
+        use_parquet = True
+    except ImportError:
+        use_parquet = False
+
+    paths = []
+    for month, part in df.groupby(df["created_at"].str.slice(0, 7)):
+        folder = os.path.join(directory, "predictions", f"month={month}")
+        os.makedirs(folder, exist_ok=True)
+        name = f"part-{part['id'].iloc[0]}-{part['id'].iloc[-1]}"
+        if use_parquet:
+            path = os.path.join(folder, name + ".parquet")
+            part.to_parquet(path, compression="zstd", index=False)
+        else:
+            path = os.path.join(folder, name + ".npz")
+            # คอลัมน์ข้อความเก็บเป็น unicode ความยาวคงที่ (อ่านกลับได้โดยไม่ต้องใช้ pickle)
+            np.savez_compressed(path, **{
+                col: part[col].fillna("").astype(str).to_numpy() if part[col].dtype == object else part[col].to_numpy()
+                for col in part.columns
+            })
+        paths.append(path)
+    return paths
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES):
+    """
+    คืนหน้าที่ว่างให้ระบบไฟล์ทีละไม่เกิน `pages` หน้า
+    ฐานข้อมูลเดิมที่สร้างก่อนเปิด auto_vacuum=INCREMENTAL ต้อง VACUUM ทั้งไฟล์หนึ่งครั้งเพื่อเปลี่ยนโหมด
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+
+
+def apply_retention(raw_days=RAW_RETENTION_DAYS, hourly_days=HOURLY_RETENTION_DAYS, archive_dir=ARCHIVE_DIR):
+    """
+    Rollup + ลบแถวเก่า + archive (ถ้าระบุโฟลเดอร์) + incremental vacuum
+
+    Returns:
+        Dict สรุปจำนวนแถวที่ rollup/ลบ และไฟล์ archive
+    """
+    raw_cutoff = _cutoff(raw_days)
+    hourly_cutoff = _cutoff(hourly_days)
+    conn = db.get_db()
+    try:
+        archived = archive_predictions(conn, raw_cutoff, archive_dir) if archive_dir else []
+
+        # rollup และลบในธุรกรรมเดียว - ถ้าล้มกลางทางจะไม่มีแถวที่ถูกนับซ้ำหรือหายไป
+        with conn:
+            conn.execute(_UPSERT.format(select=_ROLLUP_FROM_RAW), (raw_cutoff,))
+            raw_deleted = conn.execute("DELETE FROM predictions WHERE created_at < ?", (raw_cutoff,)).rowcount
+            conn.execute(_UPSERT.format(select=_ROLLUP_HOURLY_TO_DAILY), (hourly_cutoff,))
+            hourly_deleted = conn.execute(
+                "DELETE FROM prediction_rollups WHERE period = 'hour' AND bucket_start < ?", (hourly_cutoff,)
+            ).rowcount
+
+        incremental_vacuum(conn)
+    finally:
+        conn.close()
+
+    summary = {
+        "raw_cutoff": raw_cutoff,
+        "raw_rows_rolled_up": raw_deleted,
+        "hourly_rows_rolled_up": hourly_deleted,
+        "archived_files": archived
+    }
+    logger.info(f"Retention: {summary}")
+    return summary
+
+
+def get_rollups(coin, timeframe, period="day"):
+    """ดึง rollup ของ (coin, timeframe) ตามช่วงเวลา พร้อม MAE/hit rate ของแต่ละกลุ่ม"""
+    conn = db.get_db()
+    try:
+        rows = conn.execute("""
+            SELECT * FROM prediction_rollups
+            WHERE coin = ? AND timeframe = ? AND period = ?
+            ORDER BY bucket_start
+        """, (coin, timeframe, period)).fetchall()
+    finally:
+        conn.close()
+
+    return [
+        {
+            **dict(row),
+            "mae": row["sum_abs_error"] / row["evaluated"] if row["evaluated"] else None,
+            "hit_rate": row["hits"] / row["evaluated"] if row["evaluated"] else None
+        }
+        for row in rows
+    ]
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description='Roll up and prune old predictions')
+    parser.add_argument('--raw-days', type=int, default=RAW_RETENTION_DAYS)
+    parser.add_argument('--hourly-days', type=int, default=HOURLY_RETENTION_DAYS)
+    parser.add_argument('--archive', type=str, default=ARCHIVE_DIR, help='Archive raw rows before deleting')
+    args = parser.parse_args()
+
+    db.init_db()
+    for key, value in apply_retention(args.raw_days, args.hourly_days, args.archive).items():
+        print(f"{key:<24}{value}")
@@ -9,7 +9,11 @@ from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
 import logging
-from datetime import datetime
+import clock
+import leader
+import rate_limit
+from datetime import datetime, timezone
+from functools import partial
 from typing import Optional
 
 # ตั้งค่า logging
@@ -22,6 +26,8 @@ logger = logging.getLogger("scheduler")
 # ตัวแปร Scheduler (singleton) - เก็บ instance เดียวเท่านั้น
 _scheduler: Optional[AsyncIOScheduler] = None
 
+SCHEDULER_TIMEZONE = "Asia/Bangkok"
+
 # กำหนดเหรียญและ timeframes ที่รองรับ
 COINS = {
     "BTC": "BTCUSDT",
@@ -55,6 +61,7 @@ def job_listener(event):
         logger.info(f"Job {event.job_id} executed successfully")
 
 
+@rate_limit.with_priority(rate_limit.SCHEDULED)
 def run_prediction_for_timeframe(timeframe: str):
     """
     รันการทำนายสำหรับทุกเหรียญใน timeframe ที่กำหนด
@@ -64,19 +71,30 @@ def run_prediction_for_timeframe(timeframe: str):
         timeframe: กรอบเวลาที่ต้องการทำนาย (5m, 1h, 4h)
     """
     # import ที่นี่เพื่อหลีกเลี่ยง circular imports
-    from ai_engine import predict_price
-    from db import save_prediction
+    from ai_engine import predict_price, get_model_version
+    from data_service import interval_to_ms
+    from db import save_prediction, save_scheduler_state
     
     logger.info(f"▶ Starting prediction job for timeframe: {timeframe}")
     start_time = datetime.now()
     
+    # แท่งล่าสุด (ที่ยังไม่ปิด) ที่ใช้ทำนาย และแท่งถัดไปซึ่งเป็นเป้าหมายของการทำนาย
+    step = interval_to_ms(timeframe)
+    candle_time = clock.now_ms() // step * step
+    
     success_count = 0
     error_count = 0
     
     for coin, symbol in COINS.items():
         try:
             # ดึงผลทำนายจาก AI Engine
-            current_price, predicted_price = predict_price(symbol, timeframe)
+            current_price, predicted_price, stale = predict_price(symbol, timeframe, with_stale=True)
+            
+            # ไม่บันทึกผลที่คำนวณจากข้อมูลสำรอง (Binance มีปัญหา) เพื่อไม่ให้ซ้ำกับรอบก่อน
+            if stale:
+                logger.warning(f"  ⚠ Skipped {coin}/{timeframe}: upstream unavailable, data is stale")
+                error_count += 1
+                continue
             
             # กำหนดทิศทางแนวโน้ม
             if predicted_price > current_price:
@@ -87,7 +105,12 @@ def run_prediction_for_timeframe(timeframe: str):
                 change_pct = ((current_price - predicted_price) / current_price) * 100
             
             # บันทึกผลทำนายลงฐานข้อมูล
-            save_prediction(coin, timeframe, current_price, predicted_price, trend)
+            save_prediction(
+                coin, timeframe, current_price, predicted_price, trend,
+                candle_time=candle_time, target_time=candle_time + step,
+                model_version=get_model_version(timeframe, symbol)
+            )
+            save_scheduler_state(coin, timeframe, candle_time)
             
             logger.info(
                 f"  ✓ {coin}/{timeframe}: Current=${current_price:,.2f}, "
@@ -99,6 +122,13 @@ def run_prediction_for_timeframe(timeframe: str):
             logger.error(f"  ✗ Failed to process {coin}/{timeframe}: {e}")
             error_count += 1
     
+    # โหมดหลาย worker: เผยแพร่ผลทำนายสำหรับกราฟให้ทุก worker อ่านแทนการคำนวณซ้ำ
+    if leader.MULTI_WORKER:
+        try:
+            publish_latest_predictions(timeframe)
+        except Exception as e:
+            logger.error(f"  ✗ Failed to publish {timeframe} predictions: {e}")
+    
     elapsed = (datetime.now() - start_time).total_seconds()
     logger.info(
         f"◼ Completed {timeframe} predictions: "
@@ -106,6 +136,89 @@ def run_prediction_for_timeframe(timeframe: str):
     )
 
 
+# จำนวนแท่งย้อนหลังสูงสุดที่ backfill ต่อ (coin, timeframe) หลังระบบหยุดทำงานนาน
+MAX_BACKFILL_CANDLES = 1000
+
+
+@rate_limit.with_priority(rate_limit.BULK)
+def backfill_missed_predictions():
+    """
+    ทำนายย้อนหลังทุกแท่งที่พลาดไประหว่างระบบหยุดทำงาน (ตั้งแต่แท่งถัดจาก last_candle_time ในตาราง scheduler_state
+    จนถึงแท่งก่อนแท่งปัจจุบัน) ด้วยการดึงข้อมูลครั้งเดียวต่อเหรียญและ forward pass เดียวต่อโมเดลของแต่ละ timeframe
+    แท่งที่ backfill ปิดแล้ว จึงใช้ราคาปิดจริงของแท่งนั้นแทนราคาระหว่างแท่งที่งานปกติเห็น
+
+    Returns:
+        จำนวนผลทำนายที่ backfill
+    """
+    from ai_engine import predict_candles, get_model_version
+    from data_service import was_stale, interval_to_ms
+    from db import get_scheduler_state, save_predictions
+    
+    state = get_scheduler_state()
+    now_ms = clock.now_ms()
+    total = 0
+    
+    for timeframe in TIMEFRAMES:
+        step = interval_to_ms(timeframe)
+        current = now_ms // step * step
+        missed = {}
+        for coin, symbol in COINS.items():
+            last = state.get((coin, timeframe))
+            if last is None:
+                continue  # ยังไม่เคยทำนาย (ติดตั้งใหม่) - ไม่มีอะไรต้องตามเก็บ
+            first = max(last + step, current - MAX_BACKFILL_CANDLES * step)
+            if first < current:
+                missed[symbol] = list(range(first, current, step))
+        if not missed:
+            continue
+        
+        start = datetime.now()
+        try:
+            forecasts = predict_candles(timeframe, missed)
+        except Exception as e:
+            logger.error(f"  ✗ Backfill of {timeframe} failed: {e}")
+            continue
+        
+        rows = []
+        for coin, symbol in COINS.items():
+            if symbol not in forecasts or was_stale(forecasts[symbol]):
+                continue
+            version = get_model_version(timeframe, symbol)
+            for candle_time, current_price, predicted_price in forecasts[symbol]:
+                rows.append({
+                    "coin": coin, "timeframe": timeframe,
+                    "current_price": current_price, "predicted_price": predicted_price,
+                    "trend": "Uptrend" if predicted_price > current_price else "Downtrend",
+                    # เวลาบันทึกเท่ากับเวลาที่งานปกติจะรัน เพื่อให้ประวัติและ retention เรียงตามแท่งจริง
+                    "created_at": datetime.fromtimestamp(candle_time / 1000, timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                    "candle_time": candle_time, "target_time": candle_time + step, "model_version": version
+                })
+        if rows:
+            save_predictions(rows)
+        total += len(rows)
+        logger.info(
+            f"◼ Backfilled {len(rows)} missed {timeframe} predictions "
+            f"in {(datetime.now() - start).total_seconds():.2f}s"
+        )
+    
+    return total
+
+
+def publish_latest_predictions(timeframe: str, horizon: int = 1):
+    """
+    คำนวณผลทำนายพร้อมประวัติ (รูปแบบเดียวกับ /predict) ของทุกเหรียญใน timeframe
+    แล้วบันทึกลงตาราง latest_predictions ซึ่งทุก worker ใช้ร่วมกัน
+    """
+    from ai_engine import predict_batch, get_model_version
+    from db import save_latest_prediction
+    
+    pairs = [(symbol, timeframe) for symbol in COINS.values()]
+    for (symbol, tf), result in predict_batch(pairs, horizon=horizon).items():
+        if "error" in result or result["stale"]:
+            continue
+        save_latest_prediction(symbol, tf, horizon, result["next_cursor"], get_model_version(tf, symbol), result)
+
+
 def run_all_predictions():
     """
     รันการทำนายสำหรับทุกเหรียญและทุก timeframe
@@ -113,7 +226,7 @@ def run_all_predictions():
     """
     logger.info("=" * 60)
     logger.info("🚀 HOURLY PREDICTION JOB STARTED")
-    logger.info(f"   Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info(f"   Time: {clock.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=" * 60)
     
     for timeframe in TIMEFRAMES.keys():
@@ -124,11 +237,138 @@ def run_all_predictions():
     logger.info("=" * 60 + "\n")
 
 
+@rate_limit.with_priority(rate_limit.SCHEDULED)
+def run_accuracy_evaluation():
+    """ประเมินผลทำนายที่บันทึกไว้กับราคาปิดจริงของแท่งเป้าหมาย และอัปเดตผลรวมความแม่นยำ"""
+    from accuracy import evaluate_pending
+    
+    evaluated = evaluate_pending()
+    logger.info(f"◼ Accuracy evaluation: {evaluated} predictions evaluated")
+
+
+@rate_limit.with_priority(rate_limit.SCHEDULED)
+def run_drift_check():
+    """ตรวจ drift ของ Features และความคลาดเคลื่อนจริงเทียบกับช่วงเทรน แล้วเข้าคิว Retrain เฉพาะโมเดลที่ drift"""
+    from drift import check_drift
+    from data_service import replay_active
+    
+    # โหมด Replay รายงานอย่างเดียว (ไม่เทรนโมเดลจริงจากข้อมูลจำลอง)
+    reports = check_drift(TIMEFRAMES, COINS, retrain=False if replay_active() else None)
+    drifted = [f"{r['symbol']}/{r['timeframe']}" for r in reports if r["drift"]]
+    logger.info(f"◼ Drift check: {len(reports)} checked, drift in {drifted or 'none'}")
+
+
+def run_retention():
+    """rollup และลบผลทำนายที่เก่ากว่าช่วงเก็บแถวดิบ แล้วคืนพื้นที่ฐานข้อมูล"""
+    from retention import apply_retention
+    
+    summary = apply_retention()
+    logger.info(
+        f"◼ Retention: {summary['raw_rows_rolled_up']} raw rows and "
+        f"{summary['hourly_rows_rolled_up']} hourly rollups compacted"
+    )
+
+
 def get_scheduler() -> Optional[AsyncIOScheduler]:
     """ดึง instance ของ scheduler"""
     return _scheduler
 
 
+def get_job_specs(start_date=None):
+    """
+    นิยามงานทั้งหมดของ scheduler (ใช้ร่วมกันระหว่าง APScheduler จริงและโหมด Replay)
+    
+    Args:
+        start_date: เวลาเริ่มนับของ IntervalTrigger (None = เวลาจริงตอนสร้าง)
+    """
+    return [
+        # ==========================================================
+        # งานที่ 1: งานหลักประจำชั่วโมง - รันทุก 1 ชั่วโมง (ที่นาทีที่ 0)
+        # รันการทำนายสำหรับทุก timeframe
+        # ==========================================================
+        {
+            "func": run_all_predictions,
+            "trigger": CronTrigger(minute=0, timezone=SCHEDULER_TIMEZONE),  # รันที่จุดเริ่มต้นของทุกชั่วโมง
+            "id": "hourly_all_predictions",
+            "name": "Hourly All Predictions Job",
+            "description": "Hourly All Predictions (every hour at minute 0)"
+        },
+        # ==========================================================
+        # งานที่ 2: การทำนาย 5 นาที
+        # รันทุก 30 นาที สำหรับ timeframe 5m เท่านั้น
+        # ==========================================================
+        {
+            "func": partial(run_prediction_for_timeframe, "5m"),
+            "trigger": IntervalTrigger(minutes=30, start_date=start_date, timezone=SCHEDULER_TIMEZONE),
+            "id": "5m_predictions",
+            "name": "5-Minute Predictions Job",
+            "description": "5-Minute Predictions (every 30 minutes)"
+        },
+        # ==========================================================
+        # งานที่ 3: การทำนาย 4 ชั่วโมง
+        # รันทุก 4 ชั่วโมง สำหรับ timeframe 4h เท่านั้น
+        # ==========================================================
+        {
+            "func": partial(run_prediction_for_timeframe, "4h"),
+            "trigger": CronTrigger(hour="*/4", minute=1, timezone=SCHEDULER_TIMEZONE),  # ทุก 4 ชั่วโมงที่นาทีที่ 1
+            "id": "4h_predictions",
+            "name": "4-Hour Predictions Job",
+            "description": "4-Hour Predictions (every 4 hours)"
+        },
+        # ==========================================================
+        # งานที่ 4: ประเมินผลทำนายกับราคาจริง
+        # รันทุก 5 นาที ประเมินผลทำนายที่แท่งเป้าหมายปิดแล้ว (สำหรับ /performance)
+        # ==========================================================
+        {
+            "func": run_accuracy_evaluation,
+            "trigger": IntervalTrigger(minutes=5, start_date=start_date, timezone=SCHEDULER_TIMEZONE),
+            "id": "accuracy_evaluation",
+            "name": "Realized Accuracy Job",
+            "description": "Realized Accuracy Evaluation (every 5 minutes)"
+        },
+        # ==========================================================
+        # งานที่ 5: Retention ของตาราง predictions
+        # รันทุกวันเวลา 03:30 rollup แถวเก่า ลบ และคืนพื้นที่ฐานข้อมูล
+        # ==========================================================
+        {
+            "func": run_retention,
+            "trigger": CronTrigger(hour=3, minute=30, timezone=SCHEDULER_TIMEZONE),
+            "id": "predictions_retention",
+            "name": "Predictions Retention Job",
+            "description": "Predictions Retention (daily at 03:30)"
+        },
+        # ==========================================================
+        # งานที่ 6: Drift Monitor
+        # รันทุก 15 นาที เติม histogram ด้วยแท่งที่ปิดใหม่ และ Retrain เฉพาะ timeframe ที่ drift
+        # ==========================================================
+        {
+            "func": run_drift_check,
+            "trigger": IntervalTrigger(minutes=15, start_date=start_date, timezone=SCHEDULER_TIMEZONE),
+            "id": "drift_check",
+            "name": "Drift Monitor Job",
+            "description": "Drift Monitor (every 15 minutes)"
+        }
+    ]
+
+
+def run_startup_tasks():
+    """
+    ตามเก็บผลทำนายของแท่งที่พลาดไประหว่างระบบหยุดทำงาน แล้วรันการทำนายครั้งแรก
+    (ถูกตั้งเป็นงานครั้งเดียวใน start_scheduler)
+    """
+    # backfill ก่อนรอบแรก ซึ่งจะบันทึกแท่งปัจจุบัน
+    try:
+        backfill_missed_predictions()
+    except Exception as e:
+        logger.error(f"Backfill of missed predictions failed: {e}")
+    
+    logger.info("Running initial predictions on startup...")
+    try:
+        run_all_predictions()
+    except Exception as e:
+        logger.error(f"Initial prediction failed: {e}")
+
+
 def start_scheduler():
     """
     เริ่มการทำงาน background scheduler ร่วมกับ FastAPI
@@ -142,7 +382,7 @@ def start_scheduler():
     
     # สร้าง AsyncIO scheduler (เข้ากันได้กับ async loop ของ FastAPI)
     _scheduler = AsyncIOScheduler(
-        timezone="Asia/Bangkok",
+        timezone=SCHEDULER_TIMEZONE,
         job_defaults={
             "coalesce": True,  # รวมการทำงานที่พลาดไป
             "max_instances": 1,  # ให้ทำงานได้ครั้งละ 1 instance เท่านั้น
@@ -153,44 +393,15 @@ def start_scheduler():
     # เพิ่ม event listener สำหรับติดตามการทำงาน
     _scheduler.add_listener(job_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
     
-    # ==========================================================
-    # งานที่ 1: งานหลักประจำชั่วโมง - รันทุก 1 ชั่วโมง (ที่นาทีที่ 0)
-    # รันการทำนายสำหรับทุก timeframe
-    # ==========================================================
-    _scheduler.add_job(
-        run_all_predictions,
-        trigger=CronTrigger(minute=0),  # รันที่จุดเริ่มต้นของทุกชั่วโมง
-        id="hourly_all_predictions",
-        name="Hourly All Predictions Job",
-        replace_existing=True
-    )
-    logger.info("📅 Added job: Hourly All Predictions (every hour at minute 0)")
-    
-    # ==========================================================
-    # งานที่ 2: การทำนาย 5 นาที
-    # รันทุก 30 นาที สำหรับ timeframe 5m เท่านั้น
-    # ==========================================================
-    _scheduler.add_job(
-        lambda: run_prediction_for_timeframe("5m"),
-        trigger=IntervalTrigger(minutes=30),
-        id="5m_predictions",
-        name="5-Minute Predictions Job",
-        replace_existing=True
-    )
-    logger.info("📅 Added job: 5-Minute Predictions (every 30 minutes)")
-    
-    # ==========================================================
-    # งานที่ 3: การทำนาย 4 ชั่วโมง
-    # รันทุก 4 ชั่วโมง สำหรับ timeframe 4h เท่านั้น
-    # ==========================================================
-    _scheduler.add_job(
-        lambda: run_prediction_for_timeframe("4h"),
-        trigger=CronTrigger(hour="*/4", minute=1),  # ทุก 4 ชั่วโมงที่นาทีที่ 1
-        id="4h_predictions",
-        name="4-Hour Predictions Job",
-        replace_existing=True
-    )
-    logger.info("📅 Added job: 4-Hour Predictions (every 4 hours)")
+    for spec in get_job_specs():
+        _scheduler.add_job(
+            spec["func"],
+            trigger=spec["trigger"],
+            id=spec["id"],
+            name=spec["name"],
+            replace_existing=True
+        )
+        logger.info(f"📅 Added job: {spec['description']}")
     
     # เริ่มการทำงาน scheduler
     _scheduler.start()
@@ -202,12 +413,8 @@ def start_scheduler():
         logger.info(f"   • {job.name} (ID: {job.id})")
     logger.info("=" * 60)
     
-    # รันการทำนายครั้งแรกเมื่อเริ่มต้น
-    logger.info("Running initial predictions on startup...")
-    try:
-        run_all_predictions()
-    except Exception as e:
-        logger.error(f"Initial prediction failed: {e}")
+    # งานเริ่มต้นรันครั้งเดียวใน thread pool ของ scheduler - ไม่บล็อก event loop ของ FastAPI
+    _scheduler.add_job(run_startup_tasks, id="startup_tasks", name="Startup backfill & initial predictions")
     
     return _scheduler
 
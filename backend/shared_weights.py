@@ -0,0 +1,242 @@
+"""
+Shared Weights: เก็บน้ำหนักโมเดล LSTM เป็นไฟล์เดียว (weights_{key}.bin) ที่ map เข้าหน่วยความจำแบบอ่านอย่างเดียว
+ทุก worker ที่ map ไฟล์เดียวกันใช้หน้า (page) ใน page cache ชุดเดียวกันของระบบปฏิบัติการ - น้ำหนักจึงมีในหน่วยความจำชุดเดียว
+ไม่ว่าจะมีกี่ worker และการทำนายเป็น forward pass ด้วย NumPy ล้วน จึงไม่ต้องโหลด TensorFlow ใน worker เลย
+
+การ Reload: ผู้เขียน (train_model.py) เขียนไฟล์ใหม่แล้ว os.replace ทับ - worker ที่ตรวจพบ inode ใหม่จะ map ไฟล์ใหม่
+แล้วสลับ reference ทีเดียว คำขอที่กำลังรันอยู่ยังใช้ mapping เดิมจนจบ (ไฟล์เดิมยังอยู่จนกว่าจะ unmap ครบ)
+
+รูปแบบไฟล์: MAGIC (8 ไบต์) | ความยาว header (uint64) | header JSON | น้ำหนัก float32 ที่ align 64 ไบต์
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"CAIW\x00\x00\x00\x01"
+ALIGN = 64
+DTYPE = np.float32
+
+
+def weights_path(models_dir, key):
+    """path ของไฟล์น้ำหนักที่ map ได้ของโมเดล key"""
+    return os.path.join(models_dir, f"weights_{key}.bin")
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+# ============================================================================
+# Export (ใช้ใน process ที่มี TensorFlow อยู่แล้ว เช่น train_model.py)
+# ============================================================================
+
+def _describe_layers(model):
+    """แปลง layer ของโมเดล Keras เป็นรายการ (คำอธิบาย, arrays) - BatchNormalization ถูกรวมเป็น scale/shift"""
+    layers = []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        config = layer.get_config()
+        weights = [np.asarray(w, dtype=np.float64) for w in layer.get_weights()]
+
+        if kind == "InputLayer":
+            continue
+        if kind == "Dropout":
+            # ไม่มีน้ำหนัก - เก็บไว้สำหรับ MC Dropout (predict ปกติข้ามไป)
+            layers.append(({"type": "dropout", "rate": float(config["rate"])}, {}))
+            continue
+        if kind == "LSTM":
+            if config.get("activation") != "tanh" or config.get("recurrent_activation") != "sigmoid":
+                raise ValueError(f"Unsupported LSTM activations in {layer.name}")
+            kernel, recurrent = weights[0], weights[1]
+            bias = weights[2] if config.get("use_bias", True) else np.zeros(kernel.shape[1])
+            layers.append((
+                {"type": "lstm", "units": config["units"], "return_sequences": config["return_sequences"]},
+                {"kernel": kernel, "recurrent_kernel": recurrent, "bias": bias}
+            ))
+        elif kind == "BatchNormalization":
+            params = iter(weights)
+            gamma = next(params) if config.get("scale", True) else None
+            beta = next(params) if config.get("center", True) else None
+            mean, var = next(params), next(params)
+            scale = (1.0 if gamma is None else gamma) / np.sqrt(var + config["epsilon"])
+            shift = (0.0 if beta is None else beta) - mean * scale
+            layers.append(({"type": "affine"}, {"scale": scale, "shift": shift}))
+        elif kind == "Dense":
+            if config["activation"] not in ("linear", "relu"):
+                raise ValueError(f"Unsupported Dense activation {config['activation']} in {layer.name}")
+            bias = weights[1] if config.get("use_bias", True) else np.zeros(weights[0].shape[1])
+            layers.append(({"type": "dense", "activation": config["activation"]}, {"kernel": weights[0], "bias": bias}))
+        else:
+            raise ValueError(f"Unsupported layer type {kind} ({layer.name})")
+    return layers
+
+
+def export_weights(model, path):
+    """เขียนน้ำหนักของโมเดล Keras เป็นไฟล์ที่ map ได้ แบบ atomic (เขียน .tmp แล้ว os.replace)"""
+    layers = _describe_layers(model)
+
+    # วาง array ต่อกันโดยแต่ละตัวเริ่มที่ขอบ ALIGN (นับจากต้นส่วนข้อมูล)
+    offset = 0
+    header_layers = []
+    blobs = []
+    for desc, arrays in layers:
+        entry = dict(desc, arrays={})
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=DTYPE)
+            entry["arrays"][name] = {"offset": offset, "shape": list(array.shape)}
+            blobs.append((offset, array))
+            offset = _aligned(offset + array.nbytes)
+        header_layers.append(entry)
+
+    header = json.dumps({"dtype": "float32", "layers": header_layers}).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for pos, array in blobs:
+            f.seek(data_start + pos)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return path
+
+
+# ============================================================================
+# โมเดลที่ map จากไฟล์ (ใช้ใน worker - ไม่ต้องมี TensorFlow)
+# ============================================================================
+
+def _sigmoid(x):
+    # เท่ากับ 1 / (1 + exp(-x)) แต่ไม่ overflow เมื่อ x ติดลบมาก
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+class MappedModel:
+    """
+    โมเดลที่อ่านน้ำหนักจากไฟล์ผ่าน np.memmap (read-only) และทำนายด้วย NumPy
+    มีเมธอด predict(X, batch_size=None, verbose=0) แบบเดียวกับ Keras จึงใช้แทนกันได้ใน models
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a weights file: {path}")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            # ตัวตนของไฟล์ที่ map อยู่ (ใช้ตรวจว่ามีไฟล์ใหม่มาแทนที่หรือยัง)
+            stat = os.fstat(f.fileno())
+        self.path = path
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.version = str(stat.st_mtime_ns // 1_000_000_000)
+
+        data_start = _aligned(len(MAGIC) + 8 + header_len)
+        self._buffer = np.memmap(path, dtype=np.uint8, mode="r", offset=data_start)
+        self.layers = []
+        for entry in header["layers"]:
+            arrays = {}
+            for name, spec in entry["arrays"].items():
+                count = int(np.prod(spec["shape"]))
+                arrays[name] = np.frombuffer(
+                    self._buffer, dtype=DTYPE, count=count, offset=spec["offset"]
+                ).reshape(spec["shape"])
+            self.layers.append((entry, arrays))
+
+    @property
+    def nbytes(self):
+        return len(self._buffer)
+
+    @staticmethod
+    def _lstm(x, layer, arrays):
+        kernel, recurrent, bias = arrays["kernel"], arrays["recurrent_kernel"], arrays["bias"]
+        units = layer["units"]
+        n, steps, _ = x.shape
+        # input projection ของทุก timestep ในการคูณครั้งเดียว
+        projected = (x.reshape(n * steps, -1) @ kernel).reshape(n, steps, 4 * units)
+        projected += bias
+        h = np.zeros((n, units), dtype=DTYPE)
+        c = np.zeros((n, units), dtype=DTYPE)
+        outputs = np.empty((n, steps, units), dtype=DTYPE) if layer["return_sequences"] else None
+        for t in range(steps):
+            z = projected[:, t] + h @ recurrent
+            # ลำดับ gate ของ Keras: input, forget, cell, output
+            i = _sigmoid(z[:, :units])
+            f = _sigmoid(z[:, units:2 * units])
+            g = np.tanh(z[:, 2 * units:3 * units])
+            o = _sigmoid(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+            if outputs is not None:
+                outputs[:, t] = h
+        return outputs if outputs is not None else h
+
+    @property
+    def dropout_layers(self):
+        """จำนวน Dropout layer ในไฟล์ (ไฟล์ที่ export ก่อนรองรับ MC Dropout จะเป็น 0)"""
+        return sum(layer["type"] == "dropout" for layer, _ in self.layers)
+
+    def _forward(self, x, rng=None, layers=None):
+        for layer, arrays in self.layers if layers is None else layers:
+            if layer["type"] == "dropout":
+                if rng is not None:
+                    # inverted dropout แบบเดียวกับ Keras ตอนเทรน
+                    keep = 1.0 - layer["rate"]
+                    x = x * (rng.random(x.shape, dtype=DTYPE) < keep) / DTYPE(keep)
+            elif layer["type"] == "lstm":
+                x = self._lstm(x, layer, arrays)
+            elif layer["type"] == "affine":
+                x = x * arrays["scale"] + arrays["shift"]
+            else:
+                x = x @ arrays["kernel"] + arrays["bias"]
+                if layer["activation"] == "relu":
+                    np.maximum(x, 0, out=x)
+        return x
+
+    def predict(self, X, batch_size=None, verbose=0):
+        """ทำนาย windows (n, WINDOW, features) คืนค่า shape (n, 1) แบบเดียวกับ Keras"""
+        X = np.asarray(X, dtype=DTYPE)
+        if not batch_size or len(X) <= batch_size:
+            return self._forward(X)
+        return np.concatenate([self._forward(X[i:i + batch_size]) for i in range(0, len(X), batch_size)])
+
+    def predict_samples(self, X, samples, rng):
+        """
+        MC Dropout: ทำนาย windows (n, WINDOW, features) ซ้ำ `samples` ครั้งโดยเปิด Dropout คืนค่า shape (samples * n, 1)
+        layer ก่อน Dropout ตัวแรกให้ผลเหมือนกันทุกรอบ จึงคำนวณครั้งเดียวแล้วค่อยขยายเป็น samples × n
+        """
+        first = next(i for i, (layer, _) in enumerate(self.layers) if layer["type"] == "dropout")
+        x = self._forward(np.asarray(X, dtype=DTYPE), layers=self.layers[:first])
+        x = np.tile(x, (samples,) + (1,) * (x.ndim - 1))
+        return self._forward(x, rng, layers=self.layers[first:])
+
+    def is_current(self):
+        """ไฟล์บนดิสก์ยังเป็นไฟล์เดียวกับที่ map อยู่หรือไม่ (False = มีการ Reload)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == self.identity
+
+
+if __name__ == "__main__":
+    # แปลงโมเดล .h5 ที่มีอยู่ทั้งหมดเป็นไฟล์น้ำหนักที่ map ได้ (รันครั้งเดียวก่อนเปิดโหมด SHARED_WEIGHTS)
+    import re
+    import sys
+    from tensorflow.keras.models import load_model
+
+    sys.stdout.reconfigure(encoding='utf-8')
+    models_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+    for name in sorted(os.listdir(models_dir)):
+        match = re.fullmatch(r"lstm_(.+)\.h5", name)
+        if not match:
+            continue
+        try:
+            path = export_weights(load_model(os.path.join(models_dir, name), compile=False),
+                                  weights_path(models_dir, match.group(1)))
+            print(f"  ✓ {name} -> {os.path.basename(path)}")
+        except Exception as e:
+            print(f"  ✗ {name}: {type(e).__name__}: {e}")
@@ -0,0 +1,166 @@
+"""
+Strategy Simulator แบบ Vectorized (NumPy)
+แปลงราคาทำนายของโมเดลเป็นสถานะการถือครอง (Long / Short / Flat) แล้วคำนวณผลตอบแทนหลังหักค่าธรรมเนียม
+ทุกขั้นตอนเป็นการคำนวณทั้ง array พร้อมกัน (ไม่มี loop รายแท่งใน Python) รองรับหลายเหรียญพร้อมกันเป็น array 2 มิติ
+
+เรียกใช้:
+    python strategy.py --coin BTC --timeframe 1h --limit 20000 --threshold 0.002
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from data_service import INTERVAL_MINUTES
+
+
+def periods_per_year(timeframe):
+    """จำนวนแท่งเทียนต่อปีของ timeframe (ใช้ปรับ Sharpe เป็นรายปี)"""
+    return 365 * 24 * 60 / INTERVAL_MINUTES[timeframe]
+
+
+def _rolling_mean(values, window):
+    """ค่าเฉลี่ยเคลื่อนที่ตามแกนสุดท้ายด้วย cumulative sum (NaN ในช่วง warmup)"""
+    if window <= 1:
+        return values
+    if window > values.shape[-1]:
+        return np.full_like(values, np.nan)
+    csum = np.cumsum(np.nan_to_num(values), axis=-1)
+    out = np.full_like(values, np.nan)
+    out[..., window - 1] = csum[..., window - 1]
+    out[..., window:] = csum[..., window:] - csum[..., :-window]
+    out[..., window - 1:] /= window
+    # ถ้ามี NaN ใน window ให้ผลเป็น NaN (เหมือน pandas rolling)
+    nan_count = np.cumsum(np.isnan(values), axis=-1)
+    nan_in_window = np.zeros_like(values, dtype=bool)
+    nan_in_window[..., window - 1] = nan_count[..., window - 1] > 0
+    nan_in_window[..., window:] = (nan_count[..., window:] - nan_count[..., :-window]) > 0
+    out[nan_in_window] = np.nan
+    return out
+
+
+def simulate_strategy(close, forecast, threshold=0.0, fee=0.001, slippage=0.0005,
+                      position_size=1.0, allow_short=False, signal_window=1, periods=365 * 24):
+    """
+    จำลองกลยุทธ์จากราคาทำนาย
+
+    Args:
+        close: ราคาปิด shape (bars,) หรือ (symbols, bars)
+        forecast: ราคาที่ทำนายไว้สำหรับแท่งถัดไป ณ แต่ละแท่ง (shape เดียวกับ close, NaN = ไม่มีสัญญาณ)
+        threshold: ผลตอบแทนคาดการณ์ขั้นต่ำ (สัดส่วน) ก่อนเปิดสถานะ
+        fee: ค่าธรรมเนียมต่อการซื้อขาย (สัดส่วนของมูลค่าที่เปลี่ยนสถานะ)
+        slippage: ค่า slippage ต่อการซื้อขาย (สัดส่วน)
+        position_size: สัดส่วนของทุนที่ใช้ต่อสถานะ (0-1)
+        allow_short: อนุญาตให้ Short เมื่อคาดว่าราคาลง (Downtrend)
+        signal_window: จำนวนแท่งที่ใช้เฉลี่ยผลตอบแทนคาดการณ์ก่อนเทียบกับ threshold
+        periods: จำนวนแท่งต่อปี สำหรับ Sharpe รายปี
+
+    Returns:
+        Dict ของ metrics (float หรือ array ตามจำนวนเหรียญ) พร้อม equity และ drawdown curves
+    """
+    close = np.asarray(close, dtype=np.float64)
+    forecast = np.asarray(forecast, dtype=np.float64)
+    single = close.ndim == 1
+    close = np.atleast_2d(close)
+    forecast = np.atleast_2d(forecast)
+
+    # สัญญาณ ณ แท่ง t ใช้ถือครองระหว่างแท่ง t -> t+1
+    expected = _rolling_mean(forecast[:, :-1] / close[:, :-1] - 1, signal_window)
+    realized = close[:, 1:] / close[:, :-1] - 1
+
+    with np.errstate(invalid="ignore"):
+        position = np.where(expected > threshold, 1.0, 0.0)
+        if allow_short:
+            position = np.where(expected < -threshold, -1.0, position)
+    position *= position_size
+
+    # ค่าธรรมเนียม + slippage คิดตามขนาดการเปลี่ยนสถานะ
+    turnover = np.abs(np.diff(position, axis=-1, prepend=0.0))
+    returns = position * realized - turnover * (fee + slippage)
+
+    equity = np.cumprod(1 + returns, axis=-1)
+    drawdown = equity / np.maximum.accumulate(equity, axis=-1) - 1
+
+    mean = returns.mean(axis=-1)
+    std = returns.std(axis=-1)
+    sharpe = np.divide(mean, std, out=np.zeros_like(mean), where=std > 0) * np.sqrt(periods)
+
+    in_market = position != 0
+    bars_in_market = in_market.sum(axis=-1)
+    wins = (in_market & (position * realized > 0)).sum(axis=-1)
+    hit_rate = np.divide(wins, bars_in_market, out=np.zeros_like(mean), where=bars_in_market > 0)
+    trades = ((position != 0) & (np.diff(position, axis=-1, prepend=0.0) != 0)).sum(axis=-1)
+
+    result = {
+        "total_return": equity[:, -1] - 1,
+        "buy_and_hold_return": close[:, -1] / close[:, 0] - 1,
+        "max_drawdown": drawdown.min(axis=-1),
+        "sharpe": sharpe,
+        "hit_rate": hit_rate,
+        "trades": trades,
+        "exposure": bars_in_market / position.shape[-1],
+        "equity": equity,
+        "drawdown": drawdown
+    }
+
+    if single:
+        result = {
+            key: (value[0] if key in ("equity", "drawdown") else value[0].item())
+            for key, value in result.items()
+        }
+    return result
+
+
+def run_strategy(symbol, timeframe, limit=5000, **params):
+    """ทำนายย้อนหลังด้วยโมเดลแล้วจำลองกลยุทธ์ คืนค่า (times, ผลลัพธ์)"""
+    # import ที่นี่เพื่อให้ใช้ simulate_strategy ได้โดยไม่ต้องโหลด TensorFlow
+    from ai_engine import predict_series
+
+    times, close, forecast = predict_series(symbol, timeframe, limit)
+    params.setdefault("periods", periods_per_year(timeframe))
+    return times[1:], simulate_strategy(close, forecast, **params)
+
+
+def summarize(times, result, points=500):
+    """สรุปผลสำหรับ API: metrics + equity curve ที่ลดจำนวนจุดเหลือไม่เกิน `points`"""
+    step = max(1, len(times) // points)
+    summary = {k: v for k, v in result.items() if k not in ("equity", "drawdown")}
+    summary["equity_times"] = [int(t) for t in times[::step]]
+    summary["equity"] = [float(v) for v in result["equity"][::step]]
+    return summary
+
+
+if __name__ == "__main__":
+    from scheduler import COINS  # mapping เหรียญ -> symbol เดียวกับที่ API ใช้
+
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description='Simulate a trading strategy from model predictions')
+    parser.add_argument('--coin', type=str.upper, default="BTC", choices=sorted(COINS))
+    parser.add_argument('--timeframe', type=str, default="1h")
+    parser.add_argument('--limit', type=int, default=5000, help='Number of candles to simulate')
+    parser.add_argument('--threshold', type=float, default=0.0)
+    parser.add_argument('--fee', type=float, default=0.001)
+    parser.add_argument('--slippage', type=float, default=0.0005)
+    parser.add_argument('--position-size', type=float, default=1.0)
+    parser.add_argument('--signal-window', type=int, default=1)
+    parser.add_argument('--allow-short', action='store_true')
+    args = parser.parse_args()
+
+    times, res = run_strategy(
+        COINS[args.coin], args.timeframe, args.limit,
+        threshold=args.threshold, fee=args.fee, slippage=args.slippage,
+        position_size=args.position_size, allow_short=args.allow_short, signal_window=args.signal_window
+    )
+
+    print("=" * 50)
+    print(f"  Strategy: {args.coin} {args.timeframe} ({len(times)} bars)")
+    print("=" * 50)
+    print(f"Total return:     {res['total_return'] * 100:.2f}%")
+    print(f"Buy & hold:       {res['buy_and_hold_return'] * 100:.2f}%")
+    print(f"Max drawdown:     {res['max_drawdown'] * 100:.2f}%")
+    print(f"Sharpe (annual):  {res['sharpe']:.2f}")
+    print(f"Hit rate:         {res['hit_rate'] * 100:.2f}%")
+    print(f"Trades:           {res['trades']}")
+    print(f"Exposure:         {res['exposure'] * 100:.2f}%")
@@ -0,0 +1,215 @@
+"""
+Parameter Sweep แบบขนานสำหรับ Backtest ของกลยุทธ์
+กระจายชุดพารามิเตอร์ (threshold, signal window, fee, ...) ไปยัง Process Pool
+โดยทุก worker อ่านราคาและค่าทำนายชุดเดียวกันผ่าน Shared Memory (ไม่ต้อง pickle array ไปทุกงาน)
+ผลลัพธ์ถูกบันทึกลงตาราง sweep_results ทันทีที่แต่ละชุดเสร็จ และรันต่อจากที่ค้างไว้ได้ด้วย sweep_id เดิม
+
+เรียกใช้:
+    python sweep.py --coin BTC --timeframe 1h --limit 20000 \\
+        --thresholds 0 0.001 0.002 --signal-windows 1 3 5 --fees 0.0005 0.001 --workers 8
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+import db
+from strategy import simulate_strategy, periods_per_year
+
+SWEEP_CACHE_DIR = "sweeps"
+CHUNK_SIZE = 32
+
+# array ที่ worker แต่ละตัว map จาก shared memory (ตั้งค่าใน _attach_shared)
+_shared = {}
+
+
+def build_grid(thresholds=(0.0,), signal_windows=(1,), fees=(0.001,), slippages=(0.0005,),
+               position_sizes=(1.0,), allow_short=(False,)):
+    """สร้างรายการชุดพารามิเตอร์ทั้งหมด (Cartesian product)"""
+    keys = ["threshold", "signal_window", "fee", "slippage", "position_size", "allow_short"]
+    values = [thresholds, signal_windows, fees, slippages, position_sizes, allow_short]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def param_key(params):
+    """คีย์คงที่ของชุดพารามิเตอร์ (ใช้ตรวจว่ารันไปแล้วหรือยัง)"""
+    return json.dumps(params, sort_keys=True)
+
+
+def load_sweep_data(sweep_id, symbol, timeframe, limit):
+    """
+    โหลดราคาและค่าทำนายของ sweep จาก cache (ถ้ามี) เพื่อให้การรันต่อใช้ข้อมูลชุดเดิม
+    ถ้ายังไม่มีจะทำนายย้อนหลังด้วยโมเดลแล้วบันทึกเป็น .npz
+    """
+    path = os.path.join(SWEEP_CACHE_DIR, f"{sweep_id}.npz")
+    if os.path.exists(path):
+        cached = np.load(path)
+        return cached["close"], cached["forecast"]
+
+    from ai_engine import predict_series
+
+    _, close, forecast = predict_series(symbol, timeframe, limit)
+    os.makedirs(SWEEP_CACHE_DIR, exist_ok=True)
+    np.savez(path, close=close, forecast=forecast)
+    return close, forecast
+
+
+# ============================================================================
+# Worker
+# ============================================================================
+
+def _attach_shared(name, shape, periods):
+    """initializer ของ worker: map shared memory เป็น array (อ่านอย่างเดียว) ครั้งเดียวต่อ process"""
+    shm = shared_memory.SharedMemory(name=name)
+    prices = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    prices.flags.writeable = False
+    _shared["shm"] = shm
+    _shared["close"] = prices[0]
+    _shared["forecast"] = prices[1]
+    _shared["periods"] = periods
+
+
+def _run_chunk(chunk):
+    """รันชุดพารามิเตอร์หลายชุดบนข้อมูลใน shared memory"""
+    results = []
+    for params in chunk:
+        res = simulate_strategy(_shared["close"], _shared["forecast"], periods=_shared["periods"], **params)
+        results.append((params, {
+            "total_return": res["total_return"],
+            "max_drawdown": res["max_drawdown"],
+            "sharpe": res["sharpe"],
+            "hit_rate": res["hit_rate"],
+            "trades": int(res["trades"])
+        }))
+    return results
+
+
+# ============================================================================
+# ตัวรันหลัก
+# ============================================================================
+
+def run_sweep(symbol, timeframe, grid, sweep_id=None, limit=5000, workers=None, close=None, forecast=None):
+    """
+    รัน Parameter Sweep แบบขนาน
+
+    Args:
+        grid: รายการ dict ของพารามิเตอร์ (ดู build_grid)
+        sweep_id: ชื่อ sweep (ใช้ชื่อเดิมเพื่อรันต่อจากที่ค้างไว้) - None = สร้างจาก symbol/timeframe/limit
+        close, forecast: ระบุข้อมูลเองได้ (ไม่ต้องโหลดจากโมเดล)
+
+    Returns:
+        Dict สรุป sweep_id, จำนวนชุดที่รัน/ข้าม และเวลาที่ใช้
+    """
+    if sweep_id is None:
+        sweep_id = hashlib.sha1(f"{symbol}|{timeframe}|{limit}".encode()).hexdigest()[:12]
+    if close is None or forecast is None:
+        close, forecast = load_sweep_data(sweep_id, symbol, timeframe, limit)
+
+    db.init_db()
+    done = db.get_completed_sweep_keys(sweep_id)
+    pending = [p for p in grid if param_key(p) not in done]
+    print(f"Sweep {sweep_id}: {len(grid)} combinations, {len(grid) - len(pending)} already done, {len(pending)} to run")
+
+    start = time.perf_counter()
+    completed = 0
+    if pending:
+        # คัดลอกข้อมูลลง shared memory ครั้งเดียว
+        prices = np.vstack([np.asarray(close, dtype=np.float64), np.asarray(forecast, dtype=np.float64)])
+        shm = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+        try:
+            np.ndarray(prices.shape, dtype=np.float64, buffer=shm.buf)[:] = prices
+            chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+
+            with ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count(),
+                mp_context=get_context("spawn"),
+                initializer=_attach_shared,
+                initargs=(shm.name, prices.shape, periods_per_year(timeframe))
+            ) as pool:
+                futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    rows = [
+                        {
+                            "sweep_id": sweep_id,
+                            "param_key": param_key(params),
+                            "symbol": symbol,
+                            "timeframe": timeframe,
+                            "params": param_key(params),
+                            **metrics
+                        }
+                        for params, metrics in future.result()
+                    ]
+                    db.save_sweep_results(rows)
+                    completed += len(rows)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    elapsed = time.perf_counter() - start
+    print(f"Sweep {sweep_id}: finished {completed} combinations in {elapsed:.2f}s")
+    return {
+        "sweep_id": sweep_id,
+        "total": len(grid),
+        "skipped": len(grid) - len(pending),
+        "completed": completed,
+        "seconds": round(elapsed, 2)
+    }
+
+
+def top_results(sweep_id, order_by="sharpe", limit=10):
+    """ดึงผลที่ดีที่สุดของ sweep ตาม metric ที่กำหนด"""
+    if order_by not in ("sharpe", "total_return", "hit_rate", "max_drawdown"):
+        raise ValueError(f"Cannot order by {order_by}")
+    conn = db.get_db()
+    try:
+        rows = conn.execute(
+            f"SELECT * FROM sweep_results WHERE sweep_id = ? ORDER BY {order_by} DESC LIMIT ?",
+            (sweep_id, limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from scheduler import COINS  # mapping เหรียญ -> symbol เดียวกับที่ API ใช้
+
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description='Run a parallel parameter sweep of the trading strategy')
+    parser.add_argument('--coin', type=str.upper, default="BTC", choices=sorted(COINS))
+    parser.add_argument('--timeframe', type=str, default="1h")
+    parser.add_argument('--limit', type=int, default=5000)
+    parser.add_argument('--sweep-id', type=str, default=None, help='Reuse to resume a partial sweep')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.0, 0.001, 0.002, 0.005])
+    parser.add_argument('--signal-windows', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--fees', type=float, nargs='+', default=[0.001])
+    parser.add_argument('--slippages', type=float, nargs='+', default=[0.0005])
+    parser.add_argument('--position-sizes', type=float, nargs='+', default=[1.0])
+    parser.add_argument('--allow-short', action='store_true', help='Also sweep long/short variants')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    param_grid = build_grid(
+        args.thresholds, args.signal_windows, args.fees, args.slippages, args.position_sizes,
+        (False, True) if args.allow_short else (False,)
+    )
+    summary = run_sweep(
+        COINS[args.coin], args.timeframe, param_grid,
+        sweep_id=args.sweep_id, limit=args.limit, workers=args.workers
+    )
+
+    print("=" * 50)
+    print(f"  Top results ({summary['sweep_id']})")
+    print("=" * 50)
+    for row in top_results(summary["sweep_id"]):
+        print(f"sharpe={row['sharpe']:.2f} return={row['total_return'] * 100:.2f}% "
+              f"dd={row['max_drawdown'] * 100:.2f}% hit={row['hit_rate'] * 100:.1f}% {row['params']}")
@@ -8,9 +8,14 @@ from unittest.mock import MagicMock, patch
 
 # เพิ่ม path ให้ import backend modules ได้
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# ข้อมูลจำลองแต่ละ test ใช้เวลาแท่งซ้ำกัน - ปิด Feature Store (ทดสอบแยกด้วย monkeypatch) ไม่ให้แถวค้างข้าม test
+os.environ.setdefault("FEATURE_STORE", "0")
 
-from data_service import get_training_data
-from ai_engine import predict_price, FEATURE_COLUMNS, WINDOW
+from data_service import get_training_data, get_klines
+import data_service
+import clock
+import json
+from ai_engine import predict_price, predict_with_history, predict_batch, FEATURE_COLUMNS, WINDOW
 import db
 
 # ============================================================================
@@ -55,6 +60,60 @@ def test_data_loader_and_features(mock_get):
     assert not np.isnan(df.iloc[-1]["rsi"])
     assert not np.isnan(df.iloc[-1]["macd"])
 
+def pandas_reference_features(data):
+    """Feature Engineering แบบ pandas เดิม (ใช้เป็นค่าอ้างอิงของ kernel แบบ NumPy)"""
+    df = pd.DataFrame(data, columns=[
+        "time", "open", "high", "low", "close", "volume",
+        "close_time", "quote_volume", "trades", "taker_buy_base", "taker_buy_quote", "ignore"
+    ])
+    for col in ["open", "high", "low", "close", "volume"]:
+        df[col] = df[col].astype(float)
+    
+    df["price_change"] = df["close"].pct_change() * 100
+    df["volatility"] = (df["high"] - df["low"]) / df["close"] * 100
+    df["ma_5"] = df["close"].rolling(window=5).mean()
+    df["ma_10"] = df["close"].rolling(window=10).mean()
+    df["ma_20"] = df["close"].rolling(window=20).mean()
+    df["ema_12"] = df["close"].ewm(span=12, adjust=False).mean()
+    df["ema_26"] = df["close"].ewm(span=26, adjust=False).mean()
+    df["macd"] = df["ema_12"] - df["ema_26"]
+    delta = df["close"].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    df["rsi"] = 100 - (100 / (1 + gain / loss))
+    df["bb_middle"] = df["close"].rolling(window=20).mean()
+    bb_std = df["close"].rolling(window=20).std()
+    df["bb_upper"] = df["bb_middle"] + (bb_std * 2)
+    df["bb_lower"] = df["bb_middle"] - (bb_std * 2)
+    df["bb_position"] = (df["close"] - df["bb_lower"]) / (df["bb_upper"] - df["bb_lower"])
+    df["volume_change"] = df["volume"].pct_change() * 100
+    df["price_position"] = (df["close"] - df["low"]) / (df["high"] - df["low"])
+    return df.dropna()[["time"] + FEATURE_COLUMNS]
+
+@patch('data_service.requests.get')
+def test_numpy_feature_kernel_matches_pandas(mock_get):
+    """
+    ทดสอบ Feature kernel แบบ NumPy: ต้องให้ผลเท่ากับการคำนวณด้วย pandas แบบเดิม
+    รวมถึงช่วงราคานิ่ง (RSI/Bollinger เป็น NaN) และแท่งที่ราคาขึ้นล้วน (RSI = 100)
+    """
+    rng = np.random.default_rng(1)
+    closes = 30000 + np.cumsum(rng.normal(0, 50, 600))
+    closes[200:240] = closes[199]                       # ราคานิ่ง
+    closes[300:330] = closes[299] + np.arange(1, 31)    # ขึ้นทุกแท่ง
+    mock_data = [
+        [1609459200000 + i * 3600000, f"{c - 5:.2f}", f"{c + 20:.2f}", f"{c - 20:.2f}", f"{c:.2f}",
+         f"{rng.uniform(1, 100):.4f}", 0, "0", 0, "0", "0", "0"]
+        for i, c in enumerate(closes)
+    ]
+    mock_get.return_value.json.return_value = mock_data
+    
+    df, features = get_training_data(symbol="BTCUSDT", interval="1h", limit=600)
+    expected = pandas_reference_features(mock_data)
+    
+    assert features == FEATURE_COLUMNS
+    assert df["time"].tolist() == expected["time"].tolist()
+    np.testing.assert_allclose(df[FEATURE_COLUMNS].values, expected[FEATURE_COLUMNS].values, rtol=1e-7, atol=1e-8)
+
 # ============================================================================
 # 2. Test AI Model Prediction (Logic only)
 # ============================================================================
@@ -89,6 +148,749 @@ def test_prediction_fallback_logic(mock_get):
     expected_price = price + 50
     assert current == expected_price
 
+@patch('ai_engine.models', {})
+@patch('data_service.requests.get')
+def test_predict_with_history_since_cursor(mock_get):
+    """
+    ทดสอบ since cursor: ต้องคืนเฉพาะแท่งที่เปิดตั้งแต่ cursor พร้อม next_cursor ของแท่งล่าสุด
+    """
+    mock_data = []
+    price = 50000.0
+    for i in range(200):
+        price += 10 if i % 2 == 0 else -5
+        mock_data.append([
+            1609459200000 + (i * 3600000),
+            str(price), str(price+100), str(price-100), str(price+50),
+            "100"
+        ] + ["0"]*6)
+        
+    mock_get.return_value.json.return_value = mock_data
+
+    full = predict_with_history("BTCUSDT", "1h")
+    cursor = full["next_cursor"]
+    assert cursor == mock_data[-1][0]
+    
+    delta = predict_with_history("BTCUSDT", "1h", since=mock_data[-2][0])
+    assert delta["timestamps"] == [mock_data[-2][0], mock_data[-1][0]]
+    assert delta["actual_prices"] == full["actual_prices"][-2:]
+    assert delta["next_cursor"] == cursor
+
+class FakeModel:
+    """โมเดลจำลอง: นับจำนวนครั้งที่เรียก predict และคืนค่า close ของแท่งสุดท้ายใน window"""
+    def __init__(self):
+        self.calls = 0
+    
+    def predict(self, X, verbose=0, batch_size=None):
+        self.calls += 1
+        return X[:, -1, :1]
+
+
+@patch('data_service.requests.get')
+def test_predict_batch_groups_by_timeframe(mock_get):
+    """
+    ทดสอบ Batch Prediction: ดึงข้อมูลครั้งเดียวต่อคู่ (symbol, timeframe) และ forward pass เดียวต่อ timeframe
+    """
+    mock_data = []
+    price = 50000.0
+    for i in range(200):
+        price += 10 if i % 2 == 0 else -5
+        mock_data.append([
+            1609459200000 + (i * 3600000),
+            str(price), str(price+100), str(price-100), str(price+50),
+            "100"
+        ] + ["0"]*6)
+    mock_get.return_value.json.return_value = mock_data
+    
+    model_1h, model_5m = FakeModel(), FakeModel()
+    with patch.dict('ai_engine.models', {"1h": model_1h, "5m": model_5m}, clear=True):
+        single = predict_with_history("BTCUSDT", "1h")
+        model_1h.calls = 0
+        mock_get.reset_mock()
+        
+        pairs = [("BTCUSDT", "1h"), ("ETHUSDT", "1h"), ("BTCUSDT", "5m"), ("BTCUSDT", "1h")]
+        results = predict_batch(pairs)
+    
+    assert mock_get.call_count == 3
+    assert model_1h.calls == 1
+    assert model_5m.calls == 1
+    assert results[("BTCUSDT", "1h")] == single
+    assert results[("ETHUSDT", "1h")]["predicted"] == pytest.approx(single["predicted"])
+    
+    # forward pass ของ timeframe หนึ่งล้มเหลว: คู่อื่นยังได้ผลใน response เดียวกัน
+    broken = MagicMock()
+    broken.predict.side_effect = RuntimeError("model failed")
+    with patch.dict('ai_engine.models', {"1h": FakeModel(), "5m": broken}, clear=True):
+        results = predict_batch([("BTCUSDT", "1h"), ("BTCUSDT", "5m"), ("ETHUSDT", "5m")])
+    assert results[("BTCUSDT", "1h")]["predicted"] == pytest.approx(single["predicted"])
+    assert results[("BTCUSDT", "5m")] == {"error": "model failed"}
+    assert results[("ETHUSDT", "5m")] == {"error": "model failed"}
+
+@patch('data_service.requests.get')
+def test_float32_inference_matches_float64_scaler(mock_get):
+    """
+    ทดสอบเส้นทางทำนายแบบ float32: input ของโมเดลเป็น float32 ใน buffer เดิมทุกครั้ง
+    และราคาที่ได้ตรงกับการใช้ MinMaxScaler + inverse_transform แบบ float64 เดิม
+    """
+    from sklearn.preprocessing import MinMaxScaler
+    
+    rng = np.random.default_rng(2)
+    closes = 40000 + np.cumsum(rng.normal(0, 30, 200))
+    mock_data = [
+        [1609459200000 + i * 3600000, str(c - 5), str(c + 25), str(c - 25), str(c), str(50 + i % 9)] + ["0"] * 6
+        for i, c in enumerate(closes)
+    ]
+    mock_get.return_value.json.return_value = mock_data
+    
+    class MeanModel:
+        """คืนค่าเฉลี่ยของ close (scaled) ใน window และเก็บ input ที่ได้รับ"""
+        def __init__(self):
+            self.inputs = []
+        
+        def predict(self, X, verbose=0, batch_size=None):
+            self.inputs.append(X)
+            return X[:, :, :1].mean(axis=1)
+    
+    model = MeanModel()
+    with patch.dict('ai_engine.models', {"1h": model}, clear=True):
+        current, predicted = predict_price("BTCUSDT", "1h")
+        predict_price("BTCUSDT", "1h")
+    
+    assert all(X.dtype == np.float32 for X in model.inputs)
+    assert np.shares_memory(model.inputs[0], model.inputs[1])
+    
+    df, _ = get_training_data(symbol="BTCUSDT", interval="1h", limit=WINDOW + 100)
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaled = scaler.fit_transform(df[FEATURE_COLUMNS].values)
+    dummy = np.zeros((1, len(FEATURE_COLUMNS)))
+    dummy[0, 0] = scaled[-WINDOW:, 0].mean()
+    expected = scaler.inverse_transform(dummy)[0, 0]
+    
+    assert current == df["close"].iloc[-1]
+    assert predicted == pytest.approx(expected, rel=1e-6)
+
+def test_scratch_buffer_not_retained_above_cap():
+    """
+    ทดสอบว่า buffer ขนาดเกิน SCRATCH_MAX_ELEMENTS (เช่น predict_series ช่วงยาว) ไม่ถูกเก็บไว้ใน thread
+    ส่วน buffer ขนาดเล็กยังใช้ซ้ำได้
+    """
+    import ai_engine
+    
+    small = ai_engine._scratch_buffer("test_small", (1, WINDOW, len(FEATURE_COLUMNS)))
+    assert np.shares_memory(small, ai_engine._scratch_buffer("test_small", (1, WINDOW, len(FEATURE_COLUMNS))))
+    
+    rows = ai_engine.SCRATCH_MAX_ELEMENTS // (WINDOW * len(FEATURE_COLUMNS)) + 1
+    large = ai_engine._scratch_buffer("test_large", (rows, WINDOW, len(FEATURE_COLUMNS)))
+    assert large.shape == (rows, WINDOW, len(FEATURE_COLUMNS))
+    assert large.dtype == ai_engine.INFERENCE_DTYPE
+    assert "test_large" not in ai_engine._scratch.buffers
+
+@patch('data_service.requests.get')
+def test_multi_step_horizon_rollout(mock_get):
+    """
+    ทดสอบการทำนายล่วงหน้าหลายแท่ง: ดึงข้อมูลครั้งเดียว, forward pass เพิ่มรอบละหนึ่งครั้ง
+    (รวมทุกเหรียญใน timeframe เดียวกัน) และ EMA ที่กู้จาก macd ให้ Features เดิมของแท่งจริง
+    """
+    import ai_engine
+    
+    rng = np.random.default_rng(3)
+    closes = 20000 + np.cumsum(rng.normal(0, 20, 200))
+    mock_data = [
+        [1609459200000 + i * 3600000, str(c - 3), str(c + 15), str(c - 15), str(c), str(20 + i % 5)] + ["0"] * 6
+        for i, c in enumerate(closes)
+    ]
+    mock_get.return_value.json.return_value = mock_data
+    
+    model = FakeModel()
+    with patch.dict('ai_engine.models', {"1h": model}, clear=True):
+        result = predict_with_history("BTCUSDT", "1h", horizon=5)
+        assert mock_get.call_count == 1
+        assert model.calls == 5
+        
+        model.calls = 0
+        batch = predict_batch([("BTCUSDT", "1h"), ("ETHUSDT", "1h")], horizon=3)
+        assert model.calls == 3
+    
+    assert len(result["forecast_prices"]) == 5
+    assert result["forecast_prices"][0] == result["predicted"]
+    assert np.diff(result["forecast_timestamps"]).tolist() == [3600000] * 4
+    assert result["forecast_timestamps"][0] == result["timestamps"][-1]
+    assert batch[("BTCUSDT", "1h")]["forecast_prices"] == pytest.approx(result["forecast_prices"][:3])
+    
+    # EMA ที่กู้คืนต้องคำนวณ macd ของแท่งจริงได้เหมือนเดิม
+    df, _ = get_training_data(symbol="BTCUSDT", interval="1h", limit=200)
+    ctx = ai_engine._history_context(df, None)
+    state = ai_engine._rollout_state(df, ctx, "1h")
+    recomputed = data_service.compute_features(state["ohlcv"], ema_seed=state["ema_seed"])
+    macd = FEATURE_COLUMNS.index("macd")
+    np.testing.assert_allclose(recomputed[:, macd], df[FEATURE_COLUMNS].values[-ai_engine.ROLLOUT_CONTEXT:, macd], rtol=1e-6)
+
+@patch('data_service.requests.get')
+def test_symbol_models_and_training_dataset_cache(mock_get, tmp_path, monkeypatch):
+    """
+    ทดสอบโมเดลเฉพาะเหรียญ: ใช้โมเดลของเหรียญถ้ามี ไม่งั้นใช้โมเดลรวมของ timeframe
+    และ dataset ของ Training Orchestrator ถูกดึงครั้งเดียวแล้วใช้ซ้ำจาก cache
+    """
+    import ai_engine
+    import train_all
+    
+    mock_data = [
+        [1609459200000 + i * 3600000, str(100 + i), str(102 + i), str(99 + i), str(101 + i + (i % 3)), "10"] + ["0"] * 6
+        for i in range(200)
+    ]
+    mock_get.return_value.json.return_value = mock_data
+    
+    generic, eth = FakeModel(), FakeModel()
+    with patch.dict('ai_engine.models', {"1h": generic, "ETHUSDT_1h": eth}, clear=True):
+        assert ai_engine.resolve_model("ETHUSDT", "1h") == "ETHUSDT_1h"
+        assert ai_engine.resolve_model("BTCUSDT", "1h") == "1h"
+        assert ai_engine.resolve_model("BTCUSDT", "4h") is None
+        predict_batch([("BTCUSDT", "1h"), ("ETHUSDT", "1h")])
+    assert generic.calls == 1
+    assert eth.calls == 1
+    
+    monkeypatch.setattr(train_all, "DATASET_CACHE_DIR", str(tmp_path))
+    path = train_all.prepare_dataset("BTCUSDT", "1h", 200)
+    mock_get.reset_mock()
+    assert train_all.prepare_dataset("BTCUSDT", "1h", 200) == path
+    mock_get.assert_not_called()
+    
+    df, columns = train_all.load_dataset(path)
+    expected, _ = get_training_data(symbol="BTCUSDT", interval="1h", limit=200)
+    assert columns == FEATURE_COLUMNS
+    np.testing.assert_array_equal(df[["time"] + FEATURE_COLUMNS].values, expected.values)
+
+def test_shared_weights_match_keras_and_remap(tmp_path, monkeypatch):
+    """
+    ทดสอบ Shared Weights: forward pass ด้วย NumPy จากไฟล์ที่ map ต้องตรงกับ Keras
+    และเมื่อไฟล์ถูกแทนที่ (Retrain) worker ต้อง map ไฟล์ใหม่เอง
+    """
+    import ai_engine
+    import shared_weights
+    import train_model
+    
+    rng = np.random.default_rng(0)
+    X = rng.random((40, WINDOW, len(FEATURE_COLUMNS))).astype(np.float32)
+    model = train_model.build_model(len(FEATURE_COLUMNS))
+    model.fit(X, X[:, -1, :1], epochs=1, verbose=0)  # ให้ BatchNormalization มีสถิติที่ไม่ใช่ค่าเริ่มต้น
+    
+    path = shared_weights.export_weights(model, shared_weights.weights_path(str(tmp_path), "1h"))
+    mapped = shared_weights.MappedModel(path)
+    np.testing.assert_allclose(
+        mapped.predict(X, batch_size=16), model.predict(X, verbose=0), rtol=1e-4, atol=1e-5
+    )
+    
+    monkeypatch.setattr(ai_engine, "MODELS_DIR", str(tmp_path))
+    monkeypatch.setattr(ai_engine, "SHARED_WEIGHTS", True)
+    monkeypatch.setattr(ai_engine, "models", ai_engine.ModelCache(ai_engine._load_model_file, ai_engine._probe_model_file))
+    monkeypatch.setattr(ai_engine, "scalers", {})
+    monkeypatch.setattr(ai_engine, "model_versions", {})
+    assert isinstance(ai_engine.models["1h"], shared_weights.MappedModel)
+    before = ai_engine.models["1h"].predict(X)
+    
+    # Retrain จาก process อื่น: เขียนไฟล์ใหม่แทนที่แบบ atomic
+    retrained = train_model.build_model(len(FEATURE_COLUMNS))
+    shared_weights.export_weights(retrained, path)
+    assert not ai_engine.models["1h"].is_current()
+    ai_engine.refresh_mapped_models(force=True)
+    
+    after = ai_engine.models["1h"]
+    assert after.is_current()
+    np.testing.assert_allclose(after.predict(X), retrained.predict(X, verbose=0), rtol=1e-4, atol=1e-5)
+    assert not np.allclose(after.predict(X), before)
+
+def test_model_cache_lru_and_concurrent_load_dedup():
+    """
+    ทดสอบ Model Cache: โหลดครั้งเดียวแม้ถูกเรียกพร้อมกัน, เอาโมเดลที่ไม่ได้ใช้นานที่สุดออกเมื่อเกินงบ
+    และไม่ลองโหลดไฟล์ที่เคยโหลดไม่สำเร็จซ้ำ
+    """
+    import threading
+    import time
+    from model_cache import ModelCache
+    
+    files = {"1h": 1, "4h": 1, "5m": 1, "BTCUSDT_1h": 1, "broken": 1}
+    loads = []
+    def loader(key):
+        loads.append(key)
+        time.sleep(0.05)
+        return None if key == "broken" else f"model-{key}"
+    
+    cache = ModelCache(loader, lambda key: files.get(key), max_models=2)
+    assert "1h" in cache and "ETHUSDT_1h" not in cache
+    assert len(cache) == 0  # ยังไม่โหลดจนกว่าจะใช้
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache["1h"])) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["model-1h"] * 8
+    assert loads == ["1h"]
+    
+    cache["4h"]
+    cache["1h"]  # 1h ถูกใช้ล่าสุด -> 4h เป็นตัวที่ถูกเอาออก
+    cache["5m"]
+    assert set(cache.keys()) == {"1h", "5m"}
+    
+    with pytest.raises(KeyError):
+        cache["broken"]
+    assert "broken" not in cache and cache.get("broken") is None
+    files["broken"] = 2  # ไฟล์ใหม่ -> ลองโหลดได้อีกครั้ง
+    assert "broken" in cache
+    
+    stats = cache.stats()
+    assert stats["loads"] == 3 and stats["evictions"] == 1 and stats["load_failures"] == 1
+    assert stats["deduplicated"] >= 1 and stats["resident"] == 2
+    assert 0 < stats["hit_rate"] < 1
+
+def test_replay_source_follows_simulated_clock(tmp_path):
+    """
+    ทดสอบโหมด Replay: ต้องเห็นเฉพาะแท่งเทียนที่เปิดแล้ว ณ เวลาของนาฬิกาจำลอง
+    """
+    start = 1609459200000
+    rows = [
+        [start + i * 3600000, "1", "1", "1", str(100.0 + i), "1", 0, "0", 0, "0", "0", "0"]
+        for i in range(10)
+    ]
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+        json.dump(rows, f)
+    
+    sim = clock.SimulatedClock((start + 4 * 3600000 + 60000) / 1000)
+    data_service.set_replay_source(str(tmp_path))
+    clock.use_clock(sim)
+    try:
+        df = get_klines("BTCUSDT", "1h", limit=3)
+        assert df["time"].tolist() == [start + 2 * 3600000, start + 3 * 3600000, start + 4 * 3600000]
+        
+        sim.advance(3 * 3600)
+        df = get_klines("BTCUSDT", "1h", limit=3)
+        assert df["close"].iloc[-2] == 106.0
+        # แท่งที่ยังไม่ปิดต้องไม่เปิดเผยราคาปิด/high/low ในอนาคต (เหลือเพียงราคาเปิด)
+        assert df["close"].iloc[-1] == 1.0
+        last = data_service.fetch_klines("BTCUSDT", "1h", limit=1)[-1]
+        assert last[2] == last[3] == last[4] == last[1]
+        assert last[5] == "0"
+        
+        df = get_klines("BTCUSDT", "1h", limit=100, start_time=start + 6 * 3600000)
+        assert len(df) == 2
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+
+def test_realized_accuracy_is_materialized_incrementally(tmp_path, monkeypatch):
+    """
+    ทดสอบ Realized Accuracy: ผลทำนายถูกประเมินกับราคาปิดจริงเมื่อแท่งเป้าหมายปิดแล้วเท่านั้น
+    และแต่ละรายการถูกนับเข้าผลรวมครั้งเดียว
+    """
+    import accuracy
+    hour = 3600000
+    start = 1609459200000
+    rows = [
+        [start + i * hour, "1", "1", "1", str(100.0 + i), "1", 0, "0", 0, "0", "0", "0"]
+        for i in range(10)
+    ]
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+        json.dump(rows, f)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "accuracy.db"))
+    db.init_db()
+    
+    # (แท่งที่ใช้ทำนาย, ราคาปัจจุบัน, ราคาที่ทำนาย) - ราคาปิดจริงของแท่งเป้าหมาย = 100 + index
+    for candle, current, predicted in [(2, 102.0, 104.0), (3, 103.0, 102.5), (5, 105.0, 105.5)]:
+        db.save_prediction("BTC", "1h", current, predicted, "Uptrend",
+                           candle_time=start + candle * hour, target_time=start + (candle + 1) * hour,
+                           model_version="v1")
+    
+    sim = clock.SimulatedClock((start + 5 * hour + 60000) / 1000)
+    data_service.set_replay_source(str(tmp_path))
+    clock.use_clock(sim)
+    try:
+        assert accuracy.evaluate_pending() == 2  # แท่งเป้าหมายของรายการที่สามยังไม่ปิด
+        perf = accuracy.get_performance("BTC", "1h", "v1")
+        assert perf["samples"] == 2
+        assert perf["mae"] == pytest.approx(1.25)
+        assert perf["hit_rate"] == pytest.approx(0.5)
+        
+        assert accuracy.evaluate_pending() == 0  # ไม่นับซ้ำ
+        
+        sim.advance(2 * 3600)
+        assert accuracy.evaluate_pending() == 1
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+    
+    perf = accuracy.get_performance("BTC", "1h", "v2")  # เวอร์ชันที่ยังไม่มีผล -> ใช้เวอร์ชันล่าสุดที่มี
+    assert perf["model_version"] == "v1"
+    assert perf["samples"] == 3
+    assert perf["mae"] == pytest.approx(1.0)
+    assert perf["rmse"] == pytest.approx(np.sqrt((1 + 2.25 + 0.25) / 3))
+    assert perf["hit_rate"] == pytest.approx(2 / 3)
+    assert perf["accuracy"] == pytest.approx(100 - (1 / 103 + 1.5 / 104 + 0.5 / 106) * 100 / 3)
+    assert sum(bucket["samples"] for bucket in perf["calibration"]) == 3
+    assert perf["predicted_price"] == 105.5
+    assert accuracy.get_performance("ETH", "1h") is None
+
+def test_unresolvable_predictions_do_not_block_evaluation(tmp_path, monkeypatch):
+    """
+    ทดสอบ Realized Accuracy: รายการที่หาราคาจริงไม่ได้ (แท่งหาย/เหรียญไม่รองรับ) ถูกเลิกประเมินหลังครบจำนวนรอบ
+    จึงไม่ขวางรายการที่ใหม่กว่าในหน้าต่างของแต่ละรอบ
+    """
+    import accuracy
+    hour = 3600000
+    start = 1609459200000
+    rows = [
+        [start + i * hour, "1", "1", "1", str(100.0 + i), "1", 0, "0", 0, "0", "0", "0"]
+        for i in range(10) if i != 2  # แท่ง 2 หายไปจากข้อมูล
+    ]
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+        json.dump(rows, f)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "accuracy.db"))
+    db.init_db()
+    
+    db.save_prediction("BTC", "1h", 101.0, 102.0, "Uptrend",
+                       candle_time=start + hour, target_time=start + 2 * hour, model_version="v1")
+    db.save_prediction("DOGE", "1h", 1.0, 1.1, "Uptrend",
+                       candle_time=start + 2 * hour, target_time=start + 3 * hour, model_version="v1")
+    db.save_prediction("BTC", "1h", 103.0, 104.5, "Uptrend",
+                       candle_time=start + 3 * hour, target_time=start + 4 * hour, model_version="v1")
+    
+    sim = clock.SimulatedClock((start + 8 * hour) / 1000)
+    data_service.set_replay_source(str(tmp_path))
+    clock.use_clock(sim)
+    try:
+        for _ in range(accuracy.MAX_EVALUATION_ATTEMPTS):
+            assert accuracy.evaluate_pending(limit=2) == 0
+        assert accuracy.evaluate_pending(limit=2) == 1
+        assert accuracy.evaluate_pending(limit=2) == 0
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+    
+    conn = db.get_db()
+    try:
+        attempts = [r[0] for r in conn.execute("SELECT evaluation_attempts FROM predictions ORDER BY id")]
+    finally:
+        conn.close()
+    assert attempts == [accuracy.MAX_EVALUATION_ATTEMPTS, accuracy.MAX_EVALUATION_ATTEMPTS, 0]
+    assert accuracy.get_performance("BTC", "1h", "v1")["samples"] == 1
+
+def test_start_scheduler_does_not_block_event_loop():
+    """
+    ทดสอบ start_scheduler: backfill และการทำนายครั้งแรกรันเป็นงานของ scheduler ใน thread pool
+    start_scheduler ต้องคืนทันทีโดยไม่บล็อก event loop
+    """
+    import asyncio
+    import threading
+    import scheduler
+    
+    release = threading.Event()
+    ran = threading.Event()
+    def slow_backfill():
+        release.wait(5)
+    
+    async def scenario():
+        with patch.object(scheduler, "backfill_missed_predictions", side_effect=slow_backfill), \
+             patch.object(scheduler, "run_all_predictions", side_effect=ran.set):
+            scheduler.start_scheduler()
+            try:
+                await asyncio.sleep(0.2)  # event loop ยังทำงานได้ระหว่าง backfill
+                assert not ran.is_set()
+                release.set()
+                for _ in range(50):
+                    if ran.is_set():
+                        break
+                    await asyncio.sleep(0.05)
+                assert ran.is_set()
+            finally:
+                release.set()
+                scheduler.stop_scheduler()
+    
+    asyncio.run(scenario())
+
+def test_missed_predictions_backfilled_in_one_batch(tmp_path, monkeypatch):
+    """
+    ทดสอบ Backfill หลังระบบหยุดทำงาน: ทุกแท่งที่พลาดไปหลัง last_candle_time ถูกทำนายด้วย forward pass เดียวต่อโมเดล
+    บันทึกพร้อม candle/target time และเลื่อนสถานะของ Scheduler จนรันซ้ำแล้วไม่มีอะไรต้อง backfill
+    """
+    import scheduler
+    from loadtest import create_stub_exchange
+    
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "backfill.db"))
+    monkeypatch.setattr(scheduler, "TIMEFRAMES", {"1h": scheduler.TIMEFRAMES["1h"], "4h": scheduler.TIMEFRAMES["4h"]})
+    db.init_db()
+    clock.use_clock(clock.SimulatedClock(1_700_000_000 + 1234))
+    create_stub_exchange(str(tmp_path))
+    data_service.set_replay_source(str(tmp_path))
+    
+    hour = 3600000
+    current = clock.now_ms() // hour * hour
+    db.save_scheduler_state("BTC", "1h", current - 10 * hour)
+    db.save_scheduler_state("ETH", "1h", current - 3 * hour)
+    db.save_scheduler_state("ETH", "1h", current - 5 * hour)  # สถานะไม่ถอยหลัง
+    
+    model = FakeModel()
+    try:
+        with patch.dict('ai_engine.models', {"1h": model}, clear=True):
+            assert scheduler.backfill_missed_predictions() == 9 + 2  # 4h ไม่เคยรัน -> ไม่ backfill
+            assert model.calls == 1
+            assert scheduler.backfill_missed_predictions() == 0
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+    
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h")) as f:
+        closes = {row[0]: float(row[4]) for row in json.load(f)}
+    conn = db.get_db()
+    rows = conn.execute("""
+        SELECT coin, current_price, predicted_price, candle_time, target_time FROM predictions ORDER BY coin, candle_time
+    """).fetchall()
+    conn.close()
+    btc = [row for row in rows if row["coin"] == "BTC"]
+    assert [row["candle_time"] for row in btc] == [current - h * hour for h in range(9, 0, -1)]
+    assert all(row["target_time"] == row["candle_time"] + hour for row in rows)
+    # FakeModel คืน close ของแท่งสุดท้ายใน window -> ราคาที่ทำนายเท่ากับราคาปิดของแท่งนั้น
+    assert all(row["current_price"] == closes[row["candle_time"]] for row in btc)
+    assert all(row["predicted_price"] == pytest.approx(row["current_price"]) for row in rows)
+    assert db.get_scheduler_state() == {("BTC", "1h"): current - hour, ("ETH", "1h"): current - hour}
+
+def test_predictions_retention_rolls_up_and_archives(tmp_path, monkeypatch):
+    """
+    ทดสอบ Retention: แถวดิบที่เก่ากว่าช่วงเก็บถูก archive และรวมเป็น rollup โดยจำนวนรวมต้องไม่หายหรือซ้ำ
+    และรันซ้ำต้องไม่เปลี่ยนผล
+    """
+    import glob
+    import retention
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "retention.db"))
+    db.init_db()
+    
+    # ผลทำนายทุก 6 ชั่วโมงเป็นเวลา 50 วัน (ครึ่งหนึ่งประเมินแล้ว ทายถูกทิศทุกรายการ)
+    sim = clock.SimulatedClock(1609459200)
+    clock.use_clock(sim)
+    try:
+        for i in range(200):
+            db.save_prediction("BTC", "1h", 100.0, 101.0, "Uptrend", model_version="v1")
+            sim.advance(6 * 3600)
+        conn = db.get_db()
+        conn.execute("UPDATE predictions SET actual_price = 102.0 WHERE id % 2 = 0")
+        conn.commit()
+        conn.close()
+        
+        summary = retention.apply_retention(raw_days=10, hourly_days=30, archive_dir=str(tmp_path / "archive"))
+        again = retention.apply_retention(raw_days=10, hourly_days=30)
+    finally:
+        clock.use_clock(None)
+    
+    conn = db.get_db()
+    remaining = conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2  # INCREMENTAL
+    conn.close()
+    
+    assert remaining == 40  # 10 วันล่าสุด
+    assert summary["raw_rows_rolled_up"] == 160
+    assert again["raw_rows_rolled_up"] == 0 and again["hourly_rows_rolled_up"] == 0
+    
+    hourly = retention.get_rollups("BTC", "1h", "hour")
+    daily = retention.get_rollups("BTC", "1h", "day")
+    assert len(hourly) == 80 and len(daily) == 20
+    assert all(row["predictions"] == 4 for row in daily)
+    assert sum(row["predictions"] for row in hourly + daily) + remaining == 200
+    assert sum(row["evaluated"] for row in hourly + daily) == 80
+    assert daily[0]["mae"] == pytest.approx(1.0) and daily[0]["hit_rate"] == 1.0
+    
+    files = summary["archived_files"]
+    assert files and all(os.path.exists(path) for path in files)
+    if all(path.endswith(".npz") for path in files):
+        assert sum(len(np.load(path)["id"]) for path in files) == 160
+    assert glob.glob(str(tmp_path / "archive" / "predictions" / "month=2021-01" / "*"))
+
+def test_feature_store_incremental_matches_full_recompute(tmp_path, monkeypatch):
+    """
+    ทดสอบ Feature Store: แถวที่ต่อแบบ incremental ต้องเท่ากับการคำนวณใหม่จากแท่งเทียนดิบทั้งชุด
+    และรอบอัปเดตต้องดึงเฉพาะแท่งใหม่
+    """
+    import feature_store
+    
+    start = 1609459200000
+    hour = 3600000
+    rng = np.random.default_rng(0)
+    closes = 100 + np.cumsum(rng.normal(0, 1, 1400))
+    rows = [
+        [start + i * hour, str(c - 0.5), str(c + 1), str(c - 1), str(c), str(10 + i % 7), 0, "0", 0, "0", "0", "0"]
+        for i, c in enumerate(closes)
+    ]
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+        json.dump(rows, f)
+    
+    fetch_limits = []
+    original_fetch = feature_store.fetch_klines
+    def recording_fetch(*args, **kwargs):
+        fetch_limits.append(kwargs.get("limit"))
+        return original_fetch(*args, **kwargs)
+    
+    monkeypatch.setattr(feature_store, "fetch_klines", recording_fetch)
+    monkeypatch.setattr(feature_store, "FEATURE_STORE_ENABLED", True)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "features.db"))
+    sim = clock.SimulatedClock((start + 1299 * hour + 60000) / 1000)
+    data_service.set_replay_source(str(tmp_path))
+    clock.use_clock(sim)
+    try:
+        df, columns = feature_store.get_features("BTCUSDT", "1h", limit=WINDOW + 100)
+        assert columns == FEATURE_COLUMNS
+        assert len(df) == WINDOW + 100 - data_service.INDICATOR_WARMUP
+        # แท่ง 1299 ยังไม่ปิด: เหลือเพียงราคาเปิด (high == low) จึงยังไม่มี Feature ที่ครบ
+        assert df["time"].iloc[-1] == start + 1298 * hour
+        
+        sim.advance(10 * 3600)
+        fetch_limits.clear()
+        df, _ = feature_store.get_features("BTCUSDT", "1h", limit=WINDOW + 100)
+        assert df["time"].iloc[-1] == start + 1308 * hour
+        assert fetch_limits == [11]
+        
+        stored = feature_store.read_features("BTCUSDT", "1h")
+        times, ohlcv = data_service.parse_klines(rows[100:1309])
+        expected = data_service.compute_features(ohlcv)[feature_store.EMA_WARMUP:, :len(FEATURE_COLUMNS)]
+        assert stored["time"].tolist() == times[feature_store.EMA_WARMUP:].tolist()
+        np.testing.assert_allclose(stored[FEATURE_COLUMNS].values, expected, rtol=1e-9)
+        
+        # ข้อมูลสำรอง (stale) ที่สั้นกว่าต้องไม่ลบ/เขียนทับ Features ที่เก็บไว้
+        monkeypatch.setattr(feature_store, "fetch_klines", lambda *args, **kwargs: data_service.CandleList(
+            original_fetch(*args, **kwargs)[-50:], stale=True
+        ))
+        assert feature_store.update_features("BTCUSDT", "1h", min_rows=10 ** 6) == 0
+        after = feature_store.read_features("BTCUSDT", "1h")
+        assert after["time"].tolist() == stored["time"].tolist()
+        np.testing.assert_allclose(after[FEATURE_COLUMNS].values, expected, rtol=1e-9)
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+
+def test_predict_price_reads_latest_rows_from_feature_store(tmp_path, monkeypatch):
+    """
+    ทดสอบการทำนายเมื่อเปิด Feature Store: แท่งใหม่คำนวณ Features เพียงแถวบริบท + แท่งใหม่
+    และอ่านจาก store เฉพาะแถวล่าสุดที่ใช้ Dynamic Scaling ส่งเข้าโมเดลเพียง WINDOW แถว
+    """
+    import ai_engine
+    import feature_store
+    
+    start = 1609459200000
+    hour = 3600000
+    closes = 100 + np.cumsum(np.random.default_rng(5).normal(0, 1, 600))
+    rows = [
+        [start + i * hour, str(c - 0.5), str(c + 1), str(c - 1), str(c), str(10 + i % 7), 0, "0", 0, "0", "0", "0"]
+        for i, c in enumerate(closes)
+    ]
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+        json.dump(rows, f)
+    
+    read_rows, computed_rows = [], []
+    original_read, original_compute = feature_store.read_features, feature_store.compute_features
+    def recording_read(symbol, interval, rows=None):
+        read_rows.append(rows)
+        return original_read(symbol, interval, rows)
+    def recording_compute(ohlcv, *args, **kwargs):
+        computed_rows.append(len(ohlcv))
+        return original_compute(ohlcv, *args, **kwargs)
+    
+    monkeypatch.setattr(feature_store, "read_features", recording_read)
+    monkeypatch.setattr(feature_store, "compute_features", recording_compute)
+    monkeypatch.setattr(feature_store, "FEATURE_STORE_ENABLED", True)
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "features.db"))
+    sim = clock.SimulatedClock((start + 500 * hour + 60000) / 1000)
+    data_service.set_replay_source(str(tmp_path))
+    clock.use_clock(sim)
+    model = FakeModel()
+    seen = []
+    def recording_predict(X, verbose=0, batch_size=None):
+        seen.append(X.shape)
+        return X[:, -1, :1]
+    model.predict = recording_predict
+    try:
+        with patch.dict('ai_engine.models', {"1h": model}, clear=True):
+            predict_price("BTCUSDT", "1h")  # ครั้งแรก: backfill store
+            sim.advance(3600)
+            read_rows.clear()
+            computed_rows.clear()
+            seen.clear()
+            current, _ = predict_price("BTCUSDT", "1h")
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+    
+    # บริบท + แท่ง 500 (ปิดแล้ว) + แท่ง 501 (ยังไม่ปิด)
+    assert computed_rows == [feature_store.CONTEXT_ROWS + 2]
+    assert read_rows == [ai_engine.SCALING_ROWS]
+    assert seen == [(1, WINDOW, len(FEATURE_COLUMNS))]
+    # แท่ง 501 ใน Replay เหลือเพียงราคาเปิด (Feature ไม่ครบ) จึงใช้แท่งล่าสุดที่ครบ
+    assert current == pytest.approx(closes[500])
+
+def test_incremental_training_uses_only_new_candles(tmp_path, monkeypatch):
+    """
+    ทดสอบ Warm-start Fine-tuning: ใช้เฉพาะแท่งที่ปิดหลังการเทรนครั้งก่อน
+    ตรวจ holdout ก่อน promote และอัปเดต metadata เมื่อ promote เท่านั้น
+    """
+    import train_model
+    
+    start = 1609459200000
+    hour = 3600000
+    rng = np.random.default_rng(4)
+    closes = 1000 + np.cumsum(rng.normal(0, 2, 300))
+    rows = [
+        [start + i * hour, str(c - 1), str(c + 3), str(c - 3), str(c), str(5 + i % 4), 0, "0", 0, "0", "0", "0"]
+        for i, c in enumerate(closes)
+    ]
+    with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+        json.dump(rows, f)
+    
+    monkeypatch.setattr(train_model, "MODELS_DIR", str(tmp_path / "models"))
+    sim = clock.SimulatedClock((start + 300 * hour) / 1000)
+    data_service.set_replay_source(str(tmp_path))
+    clock.use_clock(sim)
+    try:
+        # ยังไม่มี metadata -> ไม่มีอะไรให้ fine-tune ต่อ จึงเทรนเต็ม (ลดรอบเพื่อความเร็ว)
+        monkeypatch.setattr(train_model, "EPOCHS", 1)
+        monkeypatch.setattr(train_model, "TRAINING_CANDLES", 200)
+        result = train_model.train_incremental("1h", epochs=1)
+        assert result["mode"] == "full"
+        metadata = train_model.load_metadata("1h")
+        assert metadata["last_candle_time"] == start + 299 * hour
+        assert len(metadata["feature_stats"]["mean"]) == len(FEATURE_COLUMNS)
+        assert len(metadata["drift_profile"]["fractions"]) == len(FEATURE_COLUMNS)
+        assert metadata["val_mape"] > 0
+        
+        # แท่งใหม่ยังน้อยเกินไป
+        sim.advance(5 * 3600)
+        assert train_model.train_incremental("1h", epochs=1)["promoted"] is False
+        
+        # จำลองแท่งใหม่ 40 แท่ง (ข้อมูลใน replay ถึงแท่ง 299)
+        more = closes[-1] + np.cumsum(rng.normal(0, 2, 40))
+        rows += [
+            [start + (300 + i) * hour, str(c - 1), str(c + 3), str(c - 3), str(c), str(5 + i % 4), 0, "0", 0, "0", "0", "0"]
+            for i, c in enumerate(more)
+        ]
+        with open(data_service.replay_file_path(str(tmp_path), "BTCUSDT", "1h"), "w") as f:
+            json.dump(rows, f)
+        data_service.set_replay_source(str(tmp_path))
+        
+        # เกิน MIN_NEW_SAMPLES แล้วแต่ยังไม่พอสำหรับ holdout ขั้นต่ำ -> ไม่ fine-tune
+        sim.set((start + 325 * hour) / 1000)
+        result = train_model.train_incremental("1h", epochs=1)
+        assert result["promoted"] is False
+        assert result["reason"] == "not enough new candles"
+        assert train_model.MIN_NEW_SAMPLES <= result["samples"] < train_model.MIN_NEW_SAMPLES + train_model.MIN_HOLDOUT_SAMPLES
+        
+        # มีแท่งใหม่พอ: fine-tune เฉพาะแท่งใหม่
+        sim.set((start + 340 * hour) / 1000)
+        
+        result = train_model.train_incremental("1h", epochs=1)
+        assert result["mode"] == "incremental"
+        assert result["samples"] == 40
+        assert result["holdout_samples"] == train_model.MIN_HOLDOUT_SAMPLES
+        assert result["promoted"] == (result["holdout_loss"] <= result["baseline_loss"])
+        expected_last = start + 339 * hour if result["promoted"] else start + 299 * hour
+        assert train_model.load_metadata("1h")["last_candle_time"] == expected_last
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+
 # ============================================================================
 # 3. Test Database Operations
 # ============================================================================
@@ -150,3 +952,484 @@ class TestDatabase:
         assert row["current_price"] == 50000.0
         assert row["predicted_price"] == 51000.0
         assert row["trend"] == "Uptrend"
+
+# ============================================================================
+# 4. Test Strategy Simulator
+# ============================================================================
+def test_strategy_simulator_vectorized():
+    """
+    ทดสอบ Strategy Simulator: ทำนายถูกทุกแท่งต้องได้ hit rate 100% และผลแบบหลายเหรียญต้องตรงกับรันทีละเหรียญ
+    """
+    from strategy import simulate_strategy
+    
+    close = np.array([100.0, 102.0, 101.0, 103.0, 104.0, 102.0])
+    perfect = np.append(close[1:], np.nan)  # รู้ราคาแท่งถัดไปล่วงหน้า
+    
+    res = simulate_strategy(close, perfect, fee=0.0, slippage=0.0, allow_short=True)
+    assert res["hit_rate"] == 1.0
+    expected_equity = np.prod(1 + np.abs(np.diff(close) / close[:-1]))
+    assert res["total_return"] == pytest.approx(expected_equity - 1)
+    assert res["max_drawdown"] == 0.0
+    
+    # Long-only + ค่าธรรมเนียม: กำไรต้องลดลงตามจำนวนครั้งที่เปลี่ยนสถานะ
+    res_fee = simulate_strategy(close, perfect, fee=0.001, slippage=0.0)
+    assert res_fee["trades"] == 2
+    assert res_fee["total_return"] < simulate_strategy(close, perfect, fee=0.0, slippage=0.0)["total_return"]
+    
+    # หลายเหรียญพร้อมกัน (2 มิติ)
+    close2 = np.vstack([close, close[::-1]])
+    forecast2 = np.vstack([perfect, np.full(6, 101.5)])
+    batch = simulate_strategy(close2, forecast2, threshold=0.001)
+    second = simulate_strategy(close2[1], forecast2[1], threshold=0.001)
+    assert batch["total_return"][1] == pytest.approx(second["total_return"])
+    assert batch["equity"].shape == (2, 5)
+
+def test_parameter_sweep_resumes(tmp_path, monkeypatch):
+    """
+    ทดสอบ Parameter Sweep: ผลต้องถูกบันทึกครบ และรันซ้ำด้วย sweep_id เดิมต้องข้ามชุดที่เสร็จแล้ว
+    """
+    import sweep
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "sweep.db"))
+    
+    rng = np.random.default_rng(0)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.01, 500))
+    forecast = np.append(close[1:], np.nan)
+    grid = sweep.build_grid(thresholds=[0.0, 0.001], signal_windows=[1, 3], fees=[0.0, 0.001])
+    
+    first = sweep.run_sweep("BTCUSDT", "1h", grid[:5], sweep_id="test", close=close, forecast=forecast, workers=2)
+    assert first["completed"] == 5
+    
+    second = sweep.run_sweep("BTCUSDT", "1h", grid, sweep_id="test", close=close, forecast=forecast, workers=2)
+    assert second["skipped"] == 5
+    assert second["completed"] == len(grid) - 5
+    
+    best = sweep.top_results("test", order_by="total_return", limit=1)[0]
+    expected = max(
+        sweep.simulate_strategy(close, forecast, **params)["total_return"] for params in grid
+    )
+    assert best["total_return"] == pytest.approx(expected)
+
+def test_leader_lease_single_holder_and_failover(tmp_path, monkeypatch):
+    """
+    ทดสอบ Leader Election: มี worker ถือ lease ได้ทีละตัว และเมื่อ leader หยุดต่ออายุ worker อื่นต้องรับช่วงต่อ
+    """
+    import leader
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "lease.db"))
+    db.init_db()
+    
+    events = []
+    def make(holder, ttl):
+        return leader.LeaderElector(
+            on_elected=lambda: events.append((holder, "elected")),
+            on_lost=lambda: events.append((holder, "lost")),
+            holder=holder, ttl=ttl
+        )
+    
+    first, second = make("worker-1", 0.3), make("worker-2", 30)
+    assert first.poll() is True
+    assert second.poll() is False
+    assert first.poll() is True  # ต่ออายุ lease ของตัวเองได้
+    assert leader.get_leader()["holder"] == "worker-1"
+    
+    # worker-1 ค้าง (ไม่ต่ออายุ) จน lease หมดอายุ -> worker-2 ได้เป็น leader และ worker-1 รู้ตัวว่าเสียตำแหน่ง
+    import time
+    time.sleep(0.4)
+    assert second.poll() is True
+    assert first.poll() is False
+    assert events == [("worker-1", "elected"), ("worker-2", "elected"), ("worker-1", "lost")]
+    
+    # ปิด leader แล้ว lease ต้องถูกคืนทันที
+    second.stop()
+    assert leader.get_leader() is None
+    assert first.poll() is True
+
+def test_leader_keeps_lease_while_database_is_locked(tmp_path, monkeypatch):
+    """
+    ทดสอบ Leader Election: ฐานข้อมูลถูก lock ชั่วคราวระหว่างต่ออายุ ต้องไม่ทำให้ leader สละตำแหน่ง
+    จนกว่า lease ที่ต่อไว้ล่าสุดจะหมดอายุจริง
+    """
+    import time
+    import leader
+    path = str(tmp_path / "lease.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.init_db()
+    
+    def quick_timeout_db():
+        conn = sqlite3.connect(path, timeout=0.05)
+        conn.row_factory = sqlite3.Row
+        return conn
+    monkeypatch.setattr(db, "get_db", quick_timeout_db)
+    
+    events = []
+    elector = leader.LeaderElector(
+        on_elected=lambda: events.append("elected"), on_lost=lambda: events.append("lost"),
+        holder="worker-1", ttl=0.5
+    )
+    assert elector.poll() is True
+    
+    blocker = sqlite3.connect(path)
+    blocker.isolation_level = None
+    blocker.execute("BEGIN EXCLUSIVE")
+    try:
+        assert leader.try_acquire(holder="worker-1", ttl=0.5) is None
+        assert elector.poll() is True  # lease ยังไม่หมดอายุ - ยังเป็น leader
+        assert events == ["elected"]
+        
+        time.sleep(0.5)
+        assert elector.poll() is False  # lease หมดอายุแล้วและต่ออายุไม่ได้ - สละตำแหน่ง
+        assert events == ["elected", "lost"]
+    finally:
+        blocker.execute("ROLLBACK")
+        blocker.close()
+    
+    assert elector.poll() is True
+    assert events == ["elected", "lost", "elected"]
+
+def test_inference_batcher_merges_concurrent_requests():
+    """
+    ทดสอบ Micro-batching: คำขอที่เข้ามาพร้อมกันต้องถูกรวมเป็น forward pass น้อยครั้งกว่าจำนวนคำขอ
+    และแต่ละผู้เรียกต้องได้ผลของ window ตัวเอง
+    """
+    import threading
+    from ai_engine import InferenceBatcher
+    
+    class SlowModel:
+        def __init__(self):
+            self.batch_sizes = []
+        
+        def predict(self, X, verbose=0, batch_size=None):
+            self.batch_sizes.append(len(X))
+            return X[:, -1, :1] * 2
+    
+    model = SlowModel()
+    batcher = InferenceBatcher(max_batch=64, max_wait_ms=100)
+    results = {}
+    
+    def call(i):
+        X = np.full((1, WINDOW, len(FEATURE_COLUMNS)), float(i))
+        results[i] = batcher.predict("1h", X)
+    
+    with patch.dict('ai_engine.models', {"1h": model}, clear=True):
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    
+    assert sum(model.batch_sizes) == 16
+    assert len(model.batch_sizes) < 16
+    assert all(results[i][0, 0] == 2.0 * i for i in range(16))
+    assert batcher.stats["requests"] == 16
+
+# ============================================================================
+# 5. Test Upstream Resilience
+# ============================================================================
+@patch('data_service.requests.get')
+def test_stale_data_and_circuit_breaker(mock_get, monkeypatch):
+    """
+    ทดสอบเมื่อ Binance ล้มเหลว: ต้องคืนข้อมูลล่าสุดที่ดึงได้ (stale) และเมื่อวงจรเปิดต้องไม่เรียก Binance อีก
+    """
+    import requests
+    monkeypatch.setattr(data_service, "_breaker", data_service.CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    monkeypatch.setattr(data_service, "_last_good", {})
+    monkeypatch.setattr(data_service, "_stale_keys", set())
+    
+    rows = [[1609459200000 + i * 3600000, "1", "1", "1", str(100.0 + i), "1"] + ["0"] * 6 for i in range(5)]
+    mock_get.return_value.json.return_value = rows
+    fresh = get_klines("BTCUSDT", "1h", limit=5)
+    assert fresh["close"].iloc[-1] == 104.0
+    assert not data_service.was_stale(fresh)
+    assert mock_get.call_args.kwargs["timeout"] == data_service.UPSTREAM_TIMEOUT
+    
+    # Binance timeout -> ได้ข้อมูลเดิมกลับมาพร้อมสถานะ stale
+    mock_get.side_effect = requests.Timeout("read timed out")
+    df = get_klines("BTCUSDT", "1h", limit=3)
+    assert df["close"].tolist() == [102.0, 103.0, 104.0]
+    assert data_service.was_stale(df)
+    # สถานะอยู่กับผลของแต่ละคำขอ: ผลที่ได้ก่อนหน้ายังเป็นข้อมูลใหม่ ส่วน /debug/upstream แสดงสถานะล่าสุด
+    assert not data_service.was_stale(fresh)
+    assert data_service.get_upstream_status()["stale"] == ["BTCUSDT:1h"]
+    
+    # ล้มเหลวครบ threshold -> วงจรเปิด ไม่เรียก Binance อีก
+    get_klines("BTCUSDT", "1h", limit=3)
+    assert data_service.get_upstream_status()["circuit"] == "open"
+    calls = mock_get.call_count
+    get_klines("BTCUSDT", "1h", limit=3)
+    assert mock_get.call_count == calls
+    
+    # ไม่มีข้อมูลสำรองของชุดอื่น -> แจ้ง error ทันที
+    with pytest.raises(data_service.UpstreamUnavailableError):
+        get_klines("ETHUSDT", "1h", limit=3)
+
+def test_rate_limit_governor_priorities_and_backoff(monkeypatch):
+    """
+    ทดสอบ Rate Limit Governor: งาน bulk ต้องเว้นงบไว้ให้คำขอของผู้ใช้ คำขอของผู้ใช้ได้ก่อนเมื่อรอพร้อมกัน
+    ซิงก์งบกับ header X-MBX-USED-WEIGHT-1M และหยุดตาม Retry-After พร้อมลดงบเมื่อโดน 429
+    """
+    import threading
+    import time
+    import rate_limit
+    from rate_limit import WeightGovernor, INTERACTIVE, SCHEDULED, BULK
+
+    assert [rate_limit.klines_weight(n) for n in (99, 100, 499, 500, 1000, 1001)] == [1, 2, 2, 5, 5, 10]
+
+    # ความจุ 10 เติมเต็มใน 1 วินาที - bulk ใช้ได้แค่ครึ่งเดียว ที่เหลือเป็นของคำขอที่สำคัญกว่า
+    governor = WeightGovernor(limit=10, safety=1.0, window=1.0)
+    assert governor.acquire(5, BULK) < 0.05
+    assert governor.acquire(5, INTERACTIVE) < 0.05
+
+    # bucket ว่าง: bulk เข้าคิวก่อน แต่คำขอของผู้ใช้ที่มาทีหลังต้องได้ก่อน
+    order = []
+    def worker(level):
+        governor.acquire(1, level)
+        order.append(level)
+    threads = [threading.Thread(target=worker, args=(BULK,))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=worker, args=(INTERACTIVE,)))
+    threads[1].start()
+    for t in threads:
+        t.join(5)
+    assert order == [INTERACTIVE, BULK]
+
+    # งบที่ process อื่นใช้ไปจาก IP เดียวกัน (header) ทำให้งบของเราลดลง
+    time.sleep(1.0)
+    governor.observe({"X-MBX-USED-WEIGHT-1M": "9"}, 200)
+    assert governor.status()["available"] <= 1.0
+    assert governor.status()["last_used_weight"] == 9
+
+    # รอไม่ทันภายในเวลารอสูงสุด -> แจ้งทันที
+    with pytest.raises(rate_limit.ThrottledError):
+        governor.acquire(8, SCHEDULED, max_wait=0.05)
+
+    # 429: หยุดทุกระดับตาม Retry-After และลดงบลงครึ่งหนึ่ง
+    governor.observe({"Retry-After": "0.3"}, 429)
+    assert governor.status()["factor"] == 0.5
+    start = time.monotonic()
+    governor.acquire(1, INTERACTIVE)
+    assert time.monotonic() - start >= 0.25
+    assert governor.status()["throttled"] == 1
+
+    # data_service: คำขอที่ได้งบไม่ทันใช้ข้อมูลสำรองโดยไม่นับเป็นความล้มเหลวของ upstream
+    monkeypatch.setattr(data_service, "_governor", WeightGovernor(limit=10, safety=1.0, window=600.0))
+    monkeypatch.setattr(data_service, "_breaker", data_service.CircuitBreaker(failure_threshold=1))
+    monkeypatch.setattr(data_service, "_last_good", {})
+    monkeypatch.setattr(data_service, "_stale_keys", set())
+    rows = [[1609459200000 + i * 3600000, "1", "1", "1", str(100.0 + i), "1"] + ["0"] * 6 for i in range(5)]
+    with patch("data_service.requests.get") as mock_get:
+        mock_get.return_value.json.return_value = rows
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {"X-MBX-USED-WEIGHT-1M": "10"}
+        assert len(data_service.fetch_klines("BTCUSDT", "1h", limit=5)) == 5
+        with rate_limit.priority(SCHEDULED):
+            deferred = data_service.fetch_klines("BTCUSDT", "1h", limit=5)
+            assert len(deferred) == 5
+        assert mock_get.call_count == 1
+    assert data_service.was_stale(deferred)
+    status = data_service.get_upstream_status()
+    assert status["circuit"] == "closed"
+    assert status["rate_limit"]["rejected"] == {"interactive": 0, "scheduled": 1, "bulk": 0}
+
+def test_higher_timeframes_resampled_from_base_series(monkeypatch):
+    """
+    ทดสอบ Resample: 15m/1h/4h สร้างจากแท่งฐาน 5m ชุดเดียว (รวมแท่งปัจจุบันที่ยังไม่ปิด) ได้ OHLCV ตรงกับการรวมด้วย pandas
+    และดึงจาก Binance เฉพาะแท่งฐานใหม่ ส่วนคำขอที่ย้อนหลังเกินแท่งฐานที่เก็บไว้ดึง Timeframe นั้นโดยตรง
+    """
+    sim = clock.SimulatedClock(1_700_000_000 + 4321)
+    step = 300_000
+    now_ms = int(sim.time() * 1000)
+    last_open = now_ms // step * step
+    rng = np.random.default_rng(3)
+    closes = 30000 + np.cumsum(rng.normal(0, 20, 3000))
+    base = [
+        [last_open - (2999 - i) * step, f"{c - 3:.2f}", f"{c + 9:.2f}", f"{c - 9:.2f}", f"{c:.2f}", f"{rng.uniform(1, 50):.4f}",
+         last_open - (2999 - i) * step + step - 1, f"{rng.uniform(1e4, 1e5):.2f}", int(rng.integers(10, 99)), "1.5", "2.5", "0"]
+        for i, c in enumerate(closes)
+    ]
+    calls = []
+
+    def fake_get(url, params, timeout):
+        calls.append(params)
+        rows = base if params["interval"] == "5m" else []
+        if "startTime" in params:
+            rows = [r for r in rows if r[0] >= params["startTime"]][:params["limit"]]
+        else:
+            rows = rows[-params["limit"]:]
+        response = MagicMock()
+        response.json.return_value = rows
+        response.headers = {}
+        return response
+
+    monkeypatch.setattr(data_service, "RESAMPLE_BASE_INTERVAL", "5m")
+    monkeypatch.setattr(data_service, "_base_series", {})
+    monkeypatch.setattr(data_service, "_base_refreshed", {})
+    monkeypatch.setattr(data_service, "_base_stale", {})
+    monkeypatch.setattr(data_service, "_last_good", {})
+    monkeypatch.setattr(data_service, "_stale_keys", set())
+    monkeypatch.setattr(data_service, "_breaker", data_service.CircuitBreaker())
+    monkeypatch.setattr(data_service.requests, "get", fake_get)
+    clock.use_clock(sim)
+    try:
+        four_hour = data_service.fetch_klines("BTCUSDT", "4h", limit=10)
+        results = {tf: data_service.fetch_klines("BTCUSDT", tf, limit=limit)
+                   for tf, limit in (("15m", 40), ("1h", 24), ("5m", 12))}
+        results["4h"] = four_hour
+        # ทุก Timeframe มาจากการดึงแท่งฐานครั้งเดียว
+        assert len(calls) == 1 and calls[0]["interval"] == "5m"
+
+        frame = pd.DataFrame([r[:6] for r in base], columns=["time", "open", "high", "low", "close", "volume"]).astype(float)
+        for tf, rows in results.items():
+            tf_ms = data_service.interval_to_ms(tf)
+            expected = frame.groupby(frame["time"] // tf_ms * tf_ms).agg(
+                {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"}
+            ).tail(len(rows))
+            assert rows[-1][0] == now_ms // tf_ms * tf_ms  # แท่งสุดท้ายคือแท่งปัจจุบันที่ยังไม่ปิด
+            assert [r[0] for r in rows] == expected.index.astype(np.int64).tolist()
+            np.testing.assert_allclose(np.array([r[1:6] for r in rows], dtype=float), expected.values, rtol=1e-12)
+        assert results["1h"][-1][4] == float(base[-1][4])
+
+        # start_time: แท่งแรกคือแท่งที่เปิดตั้งแต่เวลานั้น
+        hour = 3_600_000
+        rows = data_service.fetch_klines("BTCUSDT", "1h", limit=3, start_time=now_ms // hour * hour - 5 * hour + 1)
+        assert [r[0] for r in rows] == [now_ms // hour * hour - h * hour for h in (4, 3, 2)]
+
+        # พ้นช่วง refresh: ดึงเฉพาะแท่งฐานตั้งแต่แท่งล่าสุดที่เก็บไว้
+        sim.advance(2)
+        data_service.fetch_klines("BTCUSDT", "1h", limit=24)
+        assert calls[-1]["startTime"] == last_open and calls[-1]["limit"] == 1
+
+        # ย้อนหลังเกินแท่งฐานที่เก็บไว้ -> ดึง Timeframe นั้นจาก Binance โดยตรง
+        data_service.fetch_klines("BTCUSDT", "1d", limit=1000)
+        assert calls[-1]["interval"] == "1d"
+    finally:
+        clock.use_clock(None)
+
+def test_drift_monitor_queues_retrain_only_on_shift(tmp_path, monkeypatch):
+    """
+    ทดสอบ Drift Monitor: ข้อมูลจริงจากตลาดแบบเดียวกับช่วงเทรนไม่ถือว่า drift รอบถัดไปดึงเฉพาะแท่งที่ปิดใหม่
+    และเมื่อ Features หรือ rolling error เปลี่ยนไปมาก จะเข้าคิว Retrain ครั้งเดียวต่อโมเดล (มี cooldown)
+    """
+    import drift
+    import ai_engine
+    from feature_store import get_features
+    from loadtest import create_stub_exchange
+    
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "drift.db"))
+    monkeypatch.setattr(ai_engine, "MODELS_DIR", str(tmp_path))
+    monkeypatch.setattr(drift, "_last_queued", {})
+    db.init_db()
+    hour = 3600000
+    # ไฟล์ Replay มีแท่งล่วงหน้า 10 ชั่วโมง (นาฬิกาจำลองจะเห็นเฉพาะแท่งที่เปิดแล้ว)
+    sim = clock.SimulatedClock(1_700_000_000 + 1234 + 10 * 3600)
+    clock.use_clock(sim)
+    create_stub_exchange(str(tmp_path))
+    data_service.set_replay_source(str(tmp_path))
+    sim.set(1_700_000_000 + 1234)
+    coins = {"BTC": "BTCUSDT", "ETH": "ETHUSDT"}
+    try:
+        df, _ = get_features("BTCUSDT", "1h", 1000, closed_only=True)
+        train = df.iloc[:-400]
+        metadata = {"drift_profile": drift.drift_profile(train), "val_mape": 0.5}
+        
+        report = drift.check_symbol("BTC", "BTCUSDT", "1h", "v1", metadata)
+        assert report["live_candles"] >= drift.MIN_LIVE_WEIGHT
+        assert not report["feature_drift"] and not report["drift"]
+        
+        # รอบถัดไปดึงเฉพาะแท่งที่ปิดใหม่ (+ บริบทของ indicator)
+        sim.advance(3 * 3600)
+        with patch("drift.get_features", wraps=get_features) as spy:
+            drift.check_symbol("BTC", "BTCUSDT", "1h", "v1", metadata)
+        assert spy.call_args[0][2] == 3 + data_service.INDICATOR_WARMUP + drift.VIEW_CONTEXT
+        assert db.get_drift_state("BTCUSDT", "1h")["last_time"] == clock.now_ms() // hour * hour - hour
+        
+        # rolling error สูงกว่า MAPE ตอน validation เกิน ERROR_RATIO เท่า -> drift แม้ Features ไม่เปลี่ยน
+        conn = db.get_db()
+        conn.execute("""
+            INSERT INTO accuracy_stats (coin, timeframe, model_version, samples, sum_abs_error, sum_sq_error,
+                                        sum_abs_pct_error, hits, rolling_abs_pct_error)
+            VALUES ('BTC', '1h', 'v1', 40, 0, 0, 20, 20, 1.2)
+        """)
+        conn.commit()
+        conn.close()
+        report = drift.check_symbol("BTC", "BTCUSDT", "1h", "v1", metadata)
+        assert report["error_drift"] and not report["feature_drift"] and report["drift"]
+        
+        # โมเดลใหม่ที่เทรนกับตลาดอีกแบบ: หลาย Features drift พร้อมกัน -> เข้าคิว Retrain ของ 1h ครั้งเดียว
+        shifted = train.copy()
+        shifted["volatility"] *= 3
+        shifted["rsi"] = shifted["rsi"] * 0.5 + 40
+        shifted["bb_position"] += 0.5
+        with open(tmp_path / "lstm_1h.json", "w") as f:
+            json.dump({"drift_profile": drift.drift_profile(shifted), "trained_at": 0}, f)
+        with patch.dict('ai_engine.models', {"1h": FakeModel()}, clear=True), \
+                patch("drift.queue_retrain") as queue_retrain:
+            reports = drift.check_drift(["1h"], coins, retrain=True)
+        assert [r["symbol"] for r in reports] == ["BTCUSDT", "ETHUSDT"]
+        assert all(r["feature_drift"] and {"volatility", "rsi", "bb_position"} <= set(r["drifted_features"])
+                   for r in reports)
+        queue_retrain.assert_called_once()
+        assert queue_retrain.call_args[0][:2] == ("1h", None)
+        
+        # คิว Retrain: เทรนใน thread เบื้องหลัง เข้าคิวซ้ำไม่ได้ภายใน cooldown
+        with patch("drift.run_retrain", return_value={"promoted": True}) as run_retrain:
+            assert drift.queue_retrain("1h", reason="test")
+            assert not drift.queue_retrain("1h", reason="again")
+            assert not drift.queue_retrain("4h", trained_at=clock.time())  # เพิ่งเทรน
+            drift._retrain_queue.join()
+        run_retrain.assert_called_once_with("1h", None)
+        status = drift.get_drift_status()
+        assert status["pending_retrains"] == []
+        assert status["recent_retrains"][-1]["outcome"] == {"promoted": True}
+        assert len(status["reports"]) == 2
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+
+def test_mc_dropout_bands_in_one_batched_pass(tmp_path):
+    """
+    ทดสอบ MC Dropout: predict_with_history(confidence=...) คืนช่วงราคาของทุก window จาก forward pass เดียว
+    ขนาด K × windows โดย Keras และไฟล์น้ำหนักที่ map ให้ผลเท่ากัน และคำขอซ้ำของแท่งเดียวกันได้ช่วงเดิม
+    """
+    import ai_engine
+    import shared_weights
+    import train_model
+    from loadtest import create_stub_exchange
+    
+    rng = np.random.default_rng(1)
+    X = rng.random((40, WINDOW, len(FEATURE_COLUMNS))).astype(np.float32)
+    model = train_model.build_model(len(FEATURE_COLUMNS))
+    model.fit(X, X[:, -1, :1], epochs=1, verbose=0)
+    mapped = shared_weights.MappedModel(
+        shared_weights.export_weights(model, shared_weights.weights_path(str(tmp_path), "1h"))
+    )
+    assert mapped.dropout_layers == 4
+    
+    # ผลของ Dropout ที่สุ่มด้วย seed เดียวกันต้องเท่ากันทั้งสองเส้นทาง และต่างจากการทำนายปกติ
+    samples = ai_engine._dropout_samples(mapped, X, 8, seed=3)
+    assert samples.shape == (8, len(X))
+    np.testing.assert_allclose(samples, ai_engine._dropout_samples(model, X, 8, seed=3), rtol=1e-4, atol=1e-5)
+    assert samples.std(axis=0).min() > 0
+    assert ai_engine._dropout_samples(FakeModel(), X, 8) is None  # โมเดลไม่มี Dropout
+    
+    clock.use_clock(clock.SimulatedClock(1_700_000_000 + 1234))
+    create_stub_exchange(str(tmp_path))
+    data_service.set_replay_source(str(tmp_path))
+    try:
+        with patch.dict('ai_engine.models', {"1h": mapped}, clear=True):
+            before = ai_engine.get_inference_stats()["sampled_windows"]
+            result = predict_with_history("BTCUSDT", "1h", confidence=0.9)
+            sampled = ai_engine.get_inference_stats()["sampled_windows"] - before
+            again = predict_with_history("BTCUSDT", "1h", confidence=0.9)
+            plain = predict_with_history("BTCUSDT", "1h")
+    finally:
+        clock.use_clock(None)
+        data_service.set_replay_source(None)
+    
+    bands = result["bands"]
+    n = len(result["predicted_prices"])
+    assert sampled == ai_engine.MC_DROPOUT_SAMPLES * n
+    assert bands["confidence"] == 0.9 and bands["samples"] == ai_engine.MC_DROPOUT_SAMPLES
+    assert len(bands["lower"]) == len(bands["median"]) == len(bands["upper"]) == n
+    assert all(lo < mid < up for lo, mid, up in zip(bands["lower"], bands["median"], bands["upper"]))
+    assert again["bands"] == bands
+    assert "bands" not in plain and plain["predicted_prices"] == result["predicted_prices"]
@@ -6,6 +6,8 @@ from unittest.mock import patch
 
 # Add backend directory to sys.path so we can import 'main'
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# ข้อมูลจำลองแต่ละ test ใช้เวลาแท่งซ้ำกัน - ปิด Feature Store (ทดสอบแยกด้วย monkeypatch) ไม่ให้แถวค้างข้าม test
+os.environ.setdefault("FEATURE_STORE", "0")
 
 from main import app
 
@@ -69,11 +71,43 @@ def test_predict_endpoint(mock_predict):
     assert data["predicted"] == 50500.0
     assert "times" in data
 
+@patch("main.predict_with_history")
+def test_predict_confidence_bands(mock_predict):
+    """ทดสอบ /predict?confidence=...: ส่งระดับความเชื่อมั่นให้ MC Dropout และปฏิเสธค่าที่อยู่นอกช่วง"""
+    mock_predict.return_value = {
+        "current": 50000.0, "predicted": 50500.0, "predicted_prices": [50500.0],
+        "bands": {"confidence": 0.9, "samples": 30, "lower": [50100.0], "median": [50500.0], "upper": [50900.0]}
+    }
+    
+    response = client.get("/predict?coin=BTC&timeframe=1h&confidence=0.9")
+    assert response.status_code == 200
+    assert response.json()["bands"]["upper"] == [50900.0]
+    assert mock_predict.call_args.kwargs["confidence"] == 0.9
+    
+    assert "error" in client.get("/predict?coin=BTC&timeframe=1h&confidence=1.5").json()
+
+def test_debug_models_reports_each_pair():
+    """ทดสอบ /debug/models: สถานะมาจากการ resolve โมเดลของทุกเหรียญ/Timeframe ไม่ใช่จำนวนโมเดลใน cache"""
+    model = object()
+    with patch.dict("ai_engine.models", {"1h": model, "5m": model, "BTCUSDT_1h": model}, clear=True):
+        data = client.get("/debug/models").json()
+    assert data["status"] == "MODELS_NOT_LOADED"
+    assert data["resolved"]["BTC:1h"] == "BTCUSDT_1h"
+    assert data["resolved"]["ETH:1h"] == "1h"
+    assert sorted(data["missing"]) == ["BTC:4h", "ETH:4h"]
+    
+    # มีโมเดลครบทุกคู่ (แม้จำนวนใน cache ไม่ใช่ 3) -> OK
+    models = {"1h": model, "5m": model, "4h": model, "BTCUSDT_1h": model, "ETHUSDT_4h": model}
+    with patch.dict("ai_engine.models", models, clear=True):
+        data = client.get("/debug/models").json()
+    assert data["status"] == "OK"
+    assert data["missing"] == []
+
 @patch("main.backtest")
 def test_backtest_endpoint(mock_backtest):
     """ทดสอบ API Backtest (/backtest)"""
     # จำลองผลลัพธ์ (MAE, RMSE)
-    mock_backtest.return_value = (100.5, 150.2)
+    mock_backtest.return_value = (100.5, 150.2, False)
     
     response = client.get("/backtest?coin=BTC&timeframe=1h")
     assert response.status_code == 200
@@ -82,23 +116,39 @@ def test_backtest_endpoint(mock_backtest):
     assert data["mae"] == 100.5
     assert data["rmse"] == 150.2
 
-@patch("main.backtest")
-@patch("main.predict_price")
-def test_performance_endpoint(mock_predict, mock_backtest):
-    """ทดสอบ API Performance สำหรับ Dashboard"""
-    # จำลองผลลัพธ์
-    mock_backtest.return_value = (50.0, 70.0)
-    mock_predict.return_value = (1000.0, 1010.0) # current, predicted
+@patch("main.run_strategy")
+def test_strategy_parameter_bounds(mock_strategy):
+    """ทดสอบ /strategy: limit และสัดส่วน fee/slippage/position_size ต้องอยู่ในช่วงที่กำหนด"""
+    import numpy as np
+    mock_strategy.return_value = (np.array([1, 2]), {"equity": np.array([1.0, 1.01]), "drawdown": np.array([0.0, 0.0])})
+    
+    assert client.get("/strategy?coin=BTC&timeframe=1h&limit=500&fee=0.002").status_code == 200
+    for query in ["limit=10000000", "limit=1", "fee=-0.1", "slippage=2", "position_size=1.5", "signal_window=0"]:
+        assert client.get(f"/strategy?coin=BTC&timeframe=1h&{query}").status_code == 422
+    assert mock_strategy.call_count == 1
+
+@patch("main.realized_performance")
+def test_performance_endpoint(mock_performance):
+    """ทดสอบ API Performance สำหรับ Dashboard (อ่านผลรวมความแม่นยำจริงที่สะสมไว้)"""
+    # จำลองผลลัพธ์: 5m ยังไม่มีผลทำนายที่ประเมินแล้ว
+    def performance(coin, timeframe, model_version):
+        if timeframe == "5m":
+            return None
+        return {"mae": 50.0, "rmse": 70.0, "accuracy": 99.5, "hit_rate": 0.6, "samples": 10,
+                "current_price": 1000.0, "predicted_price": 1010.0}
+    mock_performance.side_effect = performance
     
     response = client.get("/performance?coin=BTC")
     assert response.status_code == 200
     data = response.json()
     
     assert "performance" in data
-    assert "5m" in data["performance"]
+    assert "error" in data["performance"]["5m"]
     assert "1h" in data["performance"]
     # ตรวจสอบว่ามีค่า Key Metrics ครบ
     assert "accuracy" in data["performance"]["1h"]
+    assert data["performance"]["4h"]["hit_rate"] == 0.6
+    assert mock_performance.call_args_list[0][0][:2] == ("BTC", "5m")
 
 @patch("main.subprocess.run")
 @patch("main.load_specific_model")
@@ -115,3 +165,155 @@ def test_retrain_endpoint(mock_load, mock_subprocess):
     assert "retrained" in data["message"]
     # ตรวจสอบว่ามีการเรียกโหลดโมเดลใหม่จริง
     mock_load.assert_called_with("1h")
+
+@patch("main.subprocess.run")
+@patch("main.load_specific_model")
+def test_retrain_incremental_keeps_model_when_holdout_fails(mock_load, mock_subprocess):
+    """ทดสอบ Retrain แบบ incremental: ถ้าโมเดลที่ fine-tune ไม่ผ่าน holdout ต้องไม่ reload"""
+    mock_subprocess.return_value.stdout = (
+        "Fine-tuning...\n"
+        'RESULT {"mode": "incremental", "promoted": false, "baseline_loss": 0.001, "holdout_loss": 0.002}\n'
+    )
+    
+    response = client.post("/retrain?timeframe=4h&mode=incremental")
+    data = response.json()
+    
+    assert data["status"] == "success"
+    assert data["training"]["promoted"] is False
+    assert "--incremental" in mock_subprocess.call_args[0][0]
+    mock_load.assert_not_called()
+    
+    assert client.post("/retrain?timeframe=4h&mode=partial").json()["status"] == "error"
+
+@patch("main.predict_with_history")
+def test_predict_conditional_get(mock_predict):
+    """ทดสอบ ETag: ส่ง If-None-Match ซ้ำต้องได้ 304 โดยไม่รัน pipeline"""
+    mock_predict.return_value = {
+        "current": 50000.0,
+        "predicted": 50500.0,
+        "times": ["10:00"],
+        "actual_prices": [50000.0],
+        "predicted_prices": [50500.0],
+        "stale": False
+    }
+    
+    first = client.get("/predict?coin=BTC&timeframe=1h")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert "last-modified" in first.headers
+    max_age = int(first.headers["cache-control"].split("max-age=")[1])
+    assert 0 < max_age <= 3600
+    
+    second = client.get("/predict?coin=BTC&timeframe=1h", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+    assert mock_predict.call_count == 1
+    
+    # Timeframe อื่นต้องได้ ETag คนละตัว
+    other = client.get("/predict?coin=BTC&timeframe=5m", headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert other.headers["etag"] != etag
+
+@patch("main.predict_with_history")
+def test_predict_stale_response_not_cached(mock_predict):
+    """ทดสอบข้อมูลสำรอง (stale): ห้าม cache และหลัง Binance กลับมาต้องได้ข้อมูลใหม่"""
+    import main
+    fresh_etag = main._cache_headers("predict", "BTCUSDT", "1h", None, 1, 0.0)["ETag"]
+    
+    # Binance ล่ม: สถานะ stale มากับผลของคำขอนี้เอง (ไม่ใช่สถานะกลางของ process)
+    mock_predict.return_value = {"current": 49000.0, "predicted": 49100.0, "stale": True}
+    stale = client.get("/predict?coin=BTC&timeframe=1h")
+    assert stale.status_code == 200
+    assert stale.json()["stale"] is True
+    assert stale.headers["cache-control"] == "no-store"
+    assert "etag" not in stale.headers
+    assert "last-modified" not in stale.headers
+    
+    # Binance กลับมา: client ไม่มี ETag ของข้อมูลสำรองจึงได้ข้อมูลใหม่ แล้ว revalidate ได้ตามปกติ
+    mock_predict.return_value = {"current": 50000.0, "predicted": 50500.0, "stale": False}
+    fresh = client.get("/predict?coin=BTC&timeframe=1h")
+    assert fresh.status_code == 200
+    assert fresh.json()["stale"] is False
+    assert fresh.json()["current"] == 50000.0
+    assert fresh.headers["etag"] == fresh_etag
+    assert fresh.headers["cache-control"].startswith("public")
+    
+    revalidated = client.get("/predict?coin=BTC&timeframe=1h", headers={"If-None-Match": fresh.headers["etag"]})
+    assert revalidated.status_code == 304
+
+@patch("main.predict_with_history")
+def test_predict_multi_worker_shared_store(mock_predict, tmp_path, monkeypatch):
+    """ทดสอบโหมดหลาย worker: ผลทำนายของแท่งปัจจุบันถูกคำนวณครั้งเดียวแล้วอ่านจากตาราง latest_predictions"""
+    import db
+    import leader
+    import main
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "shared.db"))
+    monkeypatch.setattr(leader, "MULTI_WORKER", True)
+    db.init_db()
+    
+    open_time, _ = main._candle_window("1h")
+    step = 3600000
+    timestamps = [open_time - 2 * step, open_time - step, open_time, open_time + step]
+    mock_predict.return_value = {
+        "current": 50000.0,
+        "predicted": 50500.0,
+        "times": ["09:00", "10:00", "11:00", "12:00"],
+        "timestamps": timestamps,
+        "actual_prices": [49000.0, 49500.0, 50000.0, 50000.0],
+        "predicted_prices": [49100.0, 49400.0, 50100.0, 50500.0],
+        "next_cursor": open_time,
+        "stale": False
+    }
+    
+    first = client.get("/predict?coin=BTC&timeframe=1h").json()
+    assert first["timestamps"] == timestamps
+    
+    # worker อื่น (หรือคำขอถัดไป) อ่านจากตารางโดยไม่รันโมเดลซ้ำ และตัดตาม since ได้ถูกต้อง
+    incremental = client.get(f"/predict?coin=BTC&timeframe=1h&since={open_time}").json()
+    assert incremental["timestamps"] == timestamps[2:]
+    assert incremental["predicted_prices"] == [50100.0, 50500.0]
+    assert incremental["predicted"] == 50500.0
+    assert mock_predict.call_count == 1
+    
+    # horizon ต่างกันเก็บแยกแถว
+    client.get("/predict?coin=BTC&timeframe=1h&horizon=3")
+    assert mock_predict.call_count == 2
+
+@patch("main.predict_batch")
+def test_predict_batch_endpoint(mock_batch):
+    """ทดสอบ API Batch Prediction (/predict/batch) คืนผลตามลำดับคำขอ"""
+    mock_batch.return_value = {
+        ("BTCUSDT", "1h"): {"current": 50000.0, "predicted": 50500.0},
+        ("ETHUSDT", "5m"): {"current": 3000.0, "predicted": 2990.0}
+    }
+    
+    response = client.post("/predict/batch", json={"pairs": [
+        {"coin": "BTC", "timeframe": "1h"},
+        {"coin": "DOGE", "timeframe": "1h"},
+        {"coin": "eth", "timeframe": "5m"}
+    ]})
+    assert response.status_code == 200
+    data = response.json()
+    
+    assert data["count"] == 3
+    assert data["results"][0]["predicted"] == 50500.0
+    assert "error" in data["results"][1]
+    assert data["results"][2]["coin"] == "ETH"
+    mock_batch.assert_called_once_with([("BTCUSDT", "1h"), ("ETHUSDT", "5m")], horizon=1)
+    
+    import main
+    too_many = [{"coin": "BTC", "timeframe": "1h"}] * (main.MAX_BATCH_PAIRS + 1)
+    assert client.post("/predict/batch", json={"pairs": too_many}).status_code == 422
+    assert mock_batch.call_count == 1
+
+def test_load_test_harness_report():
+    """ทดสอบ Load Test แบบสั้นๆ กับ ASGI app + Stub Exchange ต้องได้รายงานครบและไม่มี error"""
+    from loadtest import run_load_test
+    
+    report = run_load_test(concurrency=2, duration=30, max_scenarios=6, seed=1)
+    
+    assert report["overall"]["requests"] >= 6
+    assert report["overall"]["error_rate"] == 0.0
+    assert report["overall"]["p99_ms"] >= report["overall"]["p50_ms"]
+    assert report["throughput_rps"] > 0
+    assert report["workers"][0]["rss_mb"] > 0
@@ -0,0 +1,170 @@
+"""
+Training Orchestrator: เทรนโมเดลเฉพาะเหรียญ (lstm_{symbol}_{tf}.h5) ของทุกเหรียญและทุก timeframe แบบขนาน
+- ดึง/คำนวณ Features ของแต่ละ (symbol, timeframe) ครั้งเดียวแล้ว cache เป็น .npz ให้ทุก worker ใช้ร่วมกัน
+- กระจายงานไปยัง Process Pool โดยจำกัดจำนวน thread ของ TensorFlow ต่อ worker ไม่ให้แย่ง core กัน
+- สรุปเวลาและ metrics ของทุกงาน (บันทึกที่ models/training_summary.json ด้วย)
+
+เรียกใช้:
+    python train_all.py --symbols BTCUSDT ETHUSDT --timeframes 5m 1h 4h --workers 3
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+import clock
+import rate_limit
+import scheduler
+from data_service import FEATURE_COLUMNS, interval_to_ms
+from feature_store import get_features
+
+# ต้องเท่ากับ train_model.TRAINING_CANDLES (ไม่ import train_model ใน process หลัก เพราะจะโหลด TensorFlow)
+TRAINING_CANDLES = 1000
+DATASET_CACHE_DIR = "datasets"
+MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+
+
+def dataset_path(symbol, timeframe, limit):
+    """path ของ cache - ผูกกับแท่งที่ปิดล่าสุด จึงหมดอายุเองเมื่อมีแท่งใหม่ปิด"""
+    step = interval_to_ms(timeframe)
+    last_closed = clock.now_ms() // step * step - step
+    return os.path.join(DATASET_CACHE_DIR, f"{symbol}_{timeframe}_{limit}_{last_closed}.npz")
+
+
+@rate_limit.with_priority(rate_limit.BULK)
+def prepare_dataset(symbol, timeframe, limit=TRAINING_CANDLES):
+    """ดึง Features (เฉพาะแท่งที่ปิดแล้ว) ครั้งเดียวต่อ (symbol, timeframe) และบันทึกเป็น .npz"""
+    path = dataset_path(symbol, timeframe, limit)
+    if not os.path.exists(path):
+        df, _ = get_features(symbol, timeframe, limit, closed_only=True)
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        tmp_path = path[:-len(".npz")] + ".tmp.npz"
+        np.savez(tmp_path, time=df["time"].to_numpy(), data=df[FEATURE_COLUMNS].to_numpy())
+        os.replace(tmp_path, path)
+    return path
+
+
+def load_dataset(path):
+    """อ่าน cache กลับเป็น (DataFrame, feature_columns) รูปแบบเดียวกับ get_features"""
+    cached = np.load(path)
+    df = pd.DataFrame(cached["data"], columns=FEATURE_COLUMNS)
+    df.insert(0, "time", cached["time"])
+    return df, list(FEATURE_COLUMNS)
+
+
+# ============================================================================
+# Worker
+# ============================================================================
+
+def _init_worker(threads):
+    """initializer ของ worker: จำกัด thread ของ TensorFlow ก่อน import ครั้งแรก"""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(min(2, threads))
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(2, threads))
+
+
+def _train_job(symbol, timeframe, path):
+    """เทรนโมเดลเฉพาะเหรียญหนึ่งงานจาก dataset ที่ cache ไว้"""
+    import train_model
+
+    start = time.perf_counter()
+    result = train_model.train_full(timeframe, symbol, per_symbol=True, dataset=load_dataset(path), verbose=0)
+    return {"symbol": symbol, "timeframe": timeframe, "seconds": round(time.perf_counter() - start, 2), **result}
+
+
+# ============================================================================
+# ตัวรันหลัก
+# ============================================================================
+
+def run_training(symbols, timeframes, workers=None, limit=TRAINING_CANDLES):
+    """
+    เทรนทุกคู่ (symbol, timeframe) แบบขนาน
+
+    Returns:
+        Dict สรุปผลรายงาน: jobs (เวลาและ metrics ต่องาน), wall_seconds, job_seconds, speedup
+    """
+    pairs = [(symbol, tf) for tf in timeframes for symbol in symbols]
+    workers = max(1, min(workers or os.cpu_count(), len(pairs)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"Training {len(pairs)} models with {workers} workers x {threads} TensorFlow threads")
+
+    wall_start = time.perf_counter()
+    datasets = {}
+    for symbol, tf in pairs:
+        datasets[(symbol, tf)] = prepare_dataset(symbol, tf, limit)
+    prepare_seconds = time.perf_counter() - wall_start
+
+    jobs = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads,)
+    ) as pool:
+        futures = {pool.submit(_train_job, symbol, tf, datasets[(symbol, tf)]): (symbol, tf) for symbol, tf in pairs}
+        for future in as_completed(futures):
+            symbol, tf = futures[future]
+            try:
+                job = future.result()
+            except Exception as e:
+                job = {"symbol": symbol, "timeframe": tf, "error": f"{type(e).__name__}: {e}"}
+            print(f"  {'✗' if 'error' in job else '✓'} {symbol} {tf}: {job.get('seconds', '-')}s")
+            jobs.append(job)
+
+    wall_seconds = time.perf_counter() - wall_start
+    job_seconds = sum(job.get("seconds", 0) for job in jobs)
+    summary = {
+        "workers": workers,
+        "threads_per_worker": threads,
+        "prepare_seconds": round(prepare_seconds, 2),
+        "wall_seconds": round(wall_seconds, 2),
+        "job_seconds": round(job_seconds, 2),
+        "speedup": round(job_seconds / wall_seconds, 2) if wall_seconds > 0 else None,
+        "failed": sum(1 for job in jobs if "error" in job),
+        "jobs": sorted(jobs, key=lambda job: (job["timeframe"], job["symbol"]))
+    }
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    with open(os.path.join(MODELS_DIR, "training_summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def print_summary(summary):
+    print("=" * 64)
+    print(f"{'model':<16}{'seconds':>10}{'epochs':>8}{'samples':>9}{'val_loss':>11}{'val_mae':>10}")
+    print("-" * 64)
+    for job in summary["jobs"]:
+        name = f"{job['symbol']}_{job['timeframe']}"
+        if "error" in job:
+            print(f"{name:<16}  {job['error']}")
+            continue
+        print(f"{name:<16}{job['seconds']:>10.2f}{job['epochs']:>8}{job['samples']:>9}"
+              f"{job['val_loss']:>11.6f}{job['val_mae']:>10.6f}")
+    print("-" * 64)
+    print(f"Datasets prepared in {summary['prepare_seconds']}s; wall time {summary['wall_seconds']}s "
+          f"for {summary['job_seconds']}s of training (speedup x{summary['speedup']})")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description='Train symbol-specific models for every timeframe in parallel')
+    parser.add_argument('--symbols', nargs='+', default=list(scheduler.COINS.values()))
+    parser.add_argument('--timeframes', nargs='+', default=list(scheduler.TIMEFRAMES.keys()))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--limit', type=int, default=TRAINING_CANDLES, help='Candles per training dataset')
+    args = parser.parse_args()
+
+    print_summary(run_training(args.symbols, args.timeframes, args.workers, args.limit))
@@ -1,9 +1,11 @@
 """
 สคริปต์ Training LSTM แบบ Generic รองรับทุก Timeframe
 เรียกใช้: python train_model.py --timeframe 1h
+          python train_model.py --timeframe 1h --incremental   (fine-tune ต่อจากโมเดลเดิมด้วยแท่งใหม่)
 """
 
 import argparse
+import json
 import os
 import sys
 
@@ -12,135 +14,363 @@ sys.stdout.reconfigure(encoding='utf-8')
 
 import numpy as np
 import joblib
-from data_service import get_training_data
+import clock
+import rate_limit
+from drift import drift_profile
+from feature_store import get_features
+from data_service import interval_to_ms, INDICATOR_WARMUP
+from shared_weights import export_weights, weights_path
 from sklearn.preprocessing import MinMaxScaler
-from tensorflow.keras.models import Sequential
+from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import LSTM, Dense, Dropout, BatchNormalization
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
 from tensorflow.keras.optimizers import Adam
 
-# ===== Parse Arguments =====
-parser = argparse.ArgumentParser(description='Train LSTM Model for Crypto AI')
-parser.add_argument('--timeframe', type=str, required=True, help='Timeframe to train (e.g., 5m, 1h, 4h)')
-args = parser.parse_args()
-
 # ===== การตั้งค่า Configuration =====
-TIMEFRAME = args.timeframe
 WINDOW = 20  # จำนวนแท่งเทียนที่ใช้เป็น input
 EPOCHS = 100
 BATCH_SIZE = 32
 VALIDATION_SPLIT = 0.2
+TRAINING_CANDLES = 1000
+
+# Incremental (Warm-start) Fine-tuning
+INCREMENTAL_EPOCHS = 5
+INCREMENTAL_LEARNING_RATE = 0.0001
+HOLDOUT_SPLIT = 0.2          # สัดส่วนแท่งใหม่ล่าสุดที่กันไว้ตรวจก่อน promote
+MIN_NEW_SAMPLES = 10         # จำนวน sequence ใหม่ขั้นต่ำที่คุ้มกับการ fine-tune
+MIN_HOLDOUT_SAMPLES = WINDOW # ขนาด holdout ขั้นต่ำ - holdout เล็กเกินไปทำให้การตัดสิน promote เป็นแค่ noise
+MAX_INCREMENTAL_CANDLES = 5000
 
 # ใช้ absolute path จากตำแหน่งของไฟล์นี้
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 MODELS_DIR = os.path.join(os.path.dirname(CURRENT_DIR), "models")
-MODEL_PATH = os.path.join(MODELS_DIR, f"lstm_{TIMEFRAME}.h5")
-SCALER_PATH = os.path.join(MODELS_DIR, f"scaler_{TIMEFRAME}.pkl")
-
-print(f"Training LSTM model for {TIMEFRAME} timeframe...")
-print("=" * 50)
-
-# ===== สร้างโฟลเดอร์ models ถ้ายังไม่มี =====
-os.makedirs(MODELS_DIR, exist_ok=True)
-
-# ===== ดึงข้อมูล Training Data =====
-print("Fetching training data with multiple features...")
-df, feature_columns = get_training_data(symbol="BTCUSDT", interval=TIMEFRAME, limit=1000)
-data = df[feature_columns].values
-print(f"Got {len(data)} samples with {len(feature_columns)} features")
-print(f"Features: {feature_columns}")
-
-# ===== Scale ข้อมูลทุก Features =====
-scaler = MinMaxScaler(feature_range=(0, 1))
-scaled_data = scaler.fit_transform(data)
-
-# ===== สร้าง Sequences =====
-X, y = [], []
-for i in range(WINDOW, len(scaled_data)):
-    X.append(scaled_data[i-WINDOW:i])  # ใช้ทุก features
-    y.append(scaled_data[i, 0])  # ทำนายราคาปิด (close price) ที่คอลัมน์แรก
-
-X, y = np.array(X), np.array(y)
-print(f"Created {len(X)} sequences with shape {X.shape}")
-
-# ===== แบ่งข้อมูล Train/Validation =====
-split_idx = int(len(X) * (1 - VALIDATION_SPLIT))
-X_train, X_val = X[:split_idx], X[split_idx:]
-y_train, y_val = y[:split_idx], y[split_idx:]
-print(f"Training samples: {len(X_train)}, Validation samples: {len(X_val)}")
-
-# ===== สร้างโมเดล =====
-print("\nBuilding enhanced LSTM model...")
-n_features = X.shape[2]
-
-model = Sequential([
-    # LSTM layer แรก
-    LSTM(128, return_sequences=True, input_shape=(WINDOW, n_features)),
-    BatchNormalization(),
-    Dropout(0.2),
-    
-    # LSTM layer ที่สอง
-    LSTM(64, return_sequences=True),
-    BatchNormalization(),
-    Dropout(0.2),
-    
-    # LSTM layer ที่สาม
-    LSTM(32, return_sequences=False),
-    BatchNormalization(),
-    Dropout(0.2),
-    
-    # Dense layers
-    Dense(32, activation='relu'),
-    Dropout(0.1),
-    Dense(16, activation='relu'),
-    Dense(1)
-])
-
-# Compile โมเดล
-optimizer = Adam(learning_rate=0.001)
-model.compile(optimizer=optimizer, loss='mse', metrics=['mae'])
-
-model.summary()
-
-# ===== Callbacks =====
-early_stop = EarlyStopping(
-    monitor='val_loss',  # ติดตามค่า validation loss
-    patience=15,         # หยุดถ้าไม่ดีขึ้นใน 15 epochs
-    restore_best_weights=True,
-    verbose=1
-)
-
-reduce_lr = ReduceLROnPlateau(
-    monitor='val_loss',  # ลด learning rate เมื่อ validation loss ไม่ลดลง
-    factor=0.5,
-    patience=5,
-    min_lr=0.00001,
-    verbose=1
-)
-
-# ===== Train โมเดล =====
-print("\nTraining model...")
-history = model.fit(
-    X_train, y_train,
-    epochs=EPOCHS,
-    batch_size=BATCH_SIZE,
-    validation_data=(X_val, y_val),
-    callbacks=[early_stop, reduce_lr],
-    verbose=1
-)
-
-# ===== ประเมินผล =====
-print("\n" + "=" * 50)
-train_loss, train_mae = model.evaluate(X_train, y_train, verbose=0)
-val_loss, val_mae = model.evaluate(X_val, y_val, verbose=0)
-print(f"Training   - Loss: {train_loss:.6f}, MAE: {train_mae:.6f}")
-print(f"Validation - Loss: {val_loss:.6f}, MAE: {val_mae:.6f}")
-
-# ===== บันทึกโมเดลและ Scaler =====
-model.save(MODEL_PATH)
-joblib.dump(scaler, SCALER_PATH)
-print(f"\n[OK] Model saved to: {MODEL_PATH}")
-print(f"[OK] Scaler saved to: {SCALER_PATH}")
-print(f"[OK] Features: {n_features}")
-print(f"[OK] Window size: {WINDOW}")
-print("Training complete!")
+
+
+def model_key(timeframe, symbol=None):
+    """ชื่อโมเดล (ตรงกับคีย์ใน ai_engine.models): "{symbol}_{timeframe}" หรือ timeframe สำหรับโมเดลรวม"""
+    return f"{symbol}_{timeframe}" if symbol else timeframe
+
+
+def model_paths(key):
+    """path ของไฟล์โมเดล, Scaler และ metadata ของโมเดล key"""
+    return (
+        os.path.join(MODELS_DIR, f"lstm_{key}.h5"),
+        os.path.join(MODELS_DIR, f"scaler_{key}.pkl"),
+        os.path.join(MODELS_DIR, f"lstm_{key}.json")
+    )
+
+
+def load_metadata(key):
+    """อ่าน metadata ของการเทรนครั้งล่าสุด (None ถ้ายังไม่มี)"""
+    path = model_paths(key)[2]
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_metadata(key, metadata):
+    """บันทึก metadata แบบ atomic (เขียนไฟล์ชั่วคราวแล้ว rename)"""
+    path = model_paths(key)[2]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def build_sequences(scaled_data, window=WINDOW):
+    """สร้าง Sequences: input = window แท่งก่อนหน้า (ทุก features), เป้าหมาย = close ของแท่งถัดไป"""
+    X, y = [], []
+    for i in range(window, len(scaled_data)):
+        X.append(scaled_data[i-window:i])  # ใช้ทุก features
+        y.append(scaled_data[i, 0])  # ทำนายราคาปิด (close price) ที่คอลัมน์แรก
+    return np.array(X), np.array(y)
+
+
+def build_model(n_features):
+    """สร้างโมเดล LSTM ใหม่ (น้ำหนักสุ่ม)"""
+    model = Sequential([
+        # LSTM layer แรก
+        LSTM(128, return_sequences=True, input_shape=(WINDOW, n_features)),
+        BatchNormalization(),
+        Dropout(0.2),
+
+        # LSTM layer ที่สอง
+        LSTM(64, return_sequences=True),
+        BatchNormalization(),
+        Dropout(0.2),
+
+        # LSTM layer ที่สาม
+        LSTM(32, return_sequences=False),
+        BatchNormalization(),
+        Dropout(0.2),
+
+        # Dense layers
+        Dense(32, activation='relu'),
+        Dropout(0.1),
+        Dense(16, activation='relu'),
+        Dense(1)
+    ])
+
+    # Compile โมเดล
+    optimizer = Adam(learning_rate=0.001)
+    model.compile(optimizer=optimizer, loss='mse', metrics=['mae'])
+    return model
+
+
+def feature_stats(data, feature_columns):
+    """สถิติของ Features ที่ใช้เทรน (เก็บใน metadata ไว้เทียบกับข้อมูลจริงภายหลัง)"""
+    return {
+        "columns": list(feature_columns),
+        "mean": [float(v) for v in np.nanmean(data, axis=0)],
+        "std": [float(v) for v in np.nanstd(data, axis=0)],
+        "min": [float(v) for v in np.nanmin(data, axis=0)],
+        "max": [float(v) for v in np.nanmax(data, axis=0)]
+    }
+
+
+def save_model(model, key):
+    """
+    บันทึกโมเดลแบบ atomic เพื่อให้ API ไม่โหลดไฟล์ที่เขียนไม่ครบ
+    พร้อมไฟล์น้ำหนักที่ map ได้ (worker ในโหมด SHARED_WEIGHTS จะ map ไฟล์ใหม่เองเมื่อเห็นว่าถูกแทนที่)
+    """
+    model_path = model_paths(key)[0]
+    tmp_path = model_path.replace(".h5", ".tmp.h5")
+    model.save(tmp_path)
+    os.replace(tmp_path, model_path)
+    export_weights(model, weights_path(MODELS_DIR, key))
+
+
+def train_full(timeframe, symbol="BTCUSDT", per_symbol=False, dataset=None, verbose=1):
+    """
+    เทรนโมเดลใหม่ทั้งหมดจากน้ำหนักสุ่มบน TRAINING_CANDLES แท่งล่าสุด
+
+    Args:
+        per_symbol: บันทึกเป็นโมเดลเฉพาะเหรียญ (lstm_{symbol}_{tf}.h5) แทนโมเดลรวมของ timeframe
+        dataset: (df, feature_columns) ที่เตรียมไว้แล้ว (None = ดึงข้อมูลเอง)
+    """
+    key = model_key(timeframe, symbol if per_symbol else None)
+    model_path, scaler_path, _ = model_paths(key)
+
+    print(f"Training LSTM model {key} on {symbol} {timeframe}...")
+    print("=" * 50)
+
+    # ===== สร้างโฟลเดอร์ models ถ้ายังไม่มี =====
+    os.makedirs(MODELS_DIR, exist_ok=True)
+
+    # ===== ดึงข้อมูล Training Data =====
+    print("Fetching training data with multiple features...")
+    df, feature_columns = dataset or get_features(symbol, timeframe, TRAINING_CANDLES, closed_only=True)
+    data = df[feature_columns].values
+    print(f"Got {len(data)} samples with {len(feature_columns)} features")
+    print(f"Features: {feature_columns}")
+
+    # ===== Scale ข้อมูลทุก Features =====
+    scaler = MinMaxScaler(feature_range=(0, 1))
+    scaled_data = scaler.fit_transform(data)
+
+    # ===== สร้าง Sequences =====
+    X, y = build_sequences(scaled_data)
+    print(f"Created {len(X)} sequences with shape {X.shape}")
+
+    # ===== แบ่งข้อมูล Train/Validation =====
+    split_idx = int(len(X) * (1 - VALIDATION_SPLIT))
+    X_train, X_val = X[:split_idx], X[split_idx:]
+    y_train, y_val = y[:split_idx], y[split_idx:]
+    print(f"Training samples: {len(X_train)}, Validation samples: {len(X_val)}")
+
+    # ===== สร้างโมเดล =====
+    print("\nBuilding enhanced LSTM model...")
+    n_features = X.shape[2]
+    model = build_model(n_features)
+    if verbose:
+        model.summary()
+
+    # ===== Callbacks =====
+    early_stop = EarlyStopping(
+        monitor='val_loss',  # ติดตามค่า validation loss
+        patience=15,         # หยุดถ้าไม่ดีขึ้นใน 15 epochs
+        restore_best_weights=True,
+        verbose=1
+    )
+
+    reduce_lr = ReduceLROnPlateau(
+        monitor='val_loss',  # ลด learning rate เมื่อ validation loss ไม่ลดลง
+        factor=0.5,
+        patience=5,
+        min_lr=0.00001,
+        verbose=1
+    )
+
+    # ===== Train โมเดล =====
+    print("\nTraining model...")
+    history = model.fit(
+        X_train, y_train,
+        epochs=EPOCHS,
+        batch_size=BATCH_SIZE,
+        validation_data=(X_val, y_val),
+        callbacks=[early_stop, reduce_lr],
+        verbose=verbose
+    )
+
+    # ===== ประเมินผล =====
+    print("\n" + "=" * 50)
+    train_loss, train_mae = model.evaluate(X_train, y_train, verbose=0)
+    val_loss, val_mae = model.evaluate(X_val, y_val, verbose=0)
+    print(f"Training   - Loss: {train_loss:.6f}, MAE: {train_mae:.6f}")
+    print(f"Validation - Loss: {val_loss:.6f}, MAE: {val_mae:.6f}")
+
+    # MAPE ของราคาปิดบนชุด validation (หน่วยเดียวกับความคลาดเคลื่อนจริงที่ Drift Monitor ใช้เทียบ)
+    close_min, close_range = scaler.data_min_[0], scaler.data_range_[0]
+    val_pred = model.predict(X_val, verbose=0)[:, 0] * close_range + close_min
+    val_actual = y_val * close_range + close_min
+    val_mape = float(np.mean(np.abs(val_pred - val_actual) / val_actual) * 100)
+    print(f"Validation - MAPE: {val_mape:.4f}%")
+
+    # ===== บันทึกโมเดลและ Scaler =====
+    save_model(model, key)
+    joblib.dump(scaler, scaler_path)
+    save_metadata(key, {
+        "mode": "full",
+        "symbol": symbol,
+        "trained_at": int(clock.time()),
+        "last_candle_time": int(df["time"].iloc[-1]),
+        "samples": int(len(X)),
+        "epochs": len(history.history["loss"]),
+        "train_loss": float(train_loss),
+        "val_loss": float(val_loss),
+        "val_mae": float(val_mae),
+        "val_mape": val_mape,
+        "feature_stats": feature_stats(data, feature_columns),
+        "drift_profile": drift_profile(df)
+    })
+    print(f"\n[OK] Model saved to: {model_path}")
+    print(f"[OK] Scaler saved to: {scaler_path}")
+    print(f"[OK] Features: {n_features}")
+    print(f"[OK] Window size: {WINDOW}")
+    print("Training complete!")
+    return {
+        "mode": "full", "promoted": True, "model": key, "samples": int(len(X)),
+        "epochs": len(history.history["loss"]), "val_loss": float(val_loss), "val_mae": float(val_mae),
+        "val_mape": val_mape
+    }
+
+
+def train_incremental(timeframe, symbol="BTCUSDT", epochs=INCREMENTAL_EPOCHS, per_symbol=False):
+    """
+    Warm-start: โหลดโมเดลปัจจุบันแล้ว fine-tune เฉพาะแท่งที่ปิดหลังการเทรนครั้งล่าสุด
+
+    แท่งใหม่ช่วงท้ายสุด (HOLDOUT_SPLIT แต่ไม่น้อยกว่า MIN_HOLDOUT_SAMPLES) ถูกกันไว้เป็น holdout และจะ promote โมเดลใหม่
+    ก็ต่อเมื่อ loss บน holdout ไม่แย่กว่าโมเดลเดิม ถ้ายังไม่เคยเทรนหรือโหลดโมเดลเดิมไม่ได้จะเทรนใหม่ทั้งหมด
+    ใช้ Scaler เดิมเพื่อให้ input อยู่ในสเกลเดียวกับที่โมเดลเคยเรียนรู้
+    """
+    key = model_key(timeframe, symbol if per_symbol else None)
+    model_path, scaler_path, _ = model_paths(key)
+    metadata = load_metadata(key)
+    if metadata is None or not os.path.exists(model_path) or not os.path.exists(scaler_path):
+        print("No previous training metadata - running full training instead")
+        return train_full(timeframe, symbol, per_symbol)
+
+    try:
+        model = load_model(model_path, compile=False)
+        scaler = joblib.load(scaler_path)
+    except Exception as e:
+        print(f"Cannot load current model ({type(e).__name__}: {e}) - running full training instead")
+        return train_full(timeframe, symbol, per_symbol)
+
+    print(f"Fine-tuning LSTM model {key} on {symbol} {timeframe}...")
+    print("=" * 50)
+
+    # ===== ดึงเฉพาะแท่งใหม่ + บริบทของ window/indicators =====
+    last_time = metadata["last_candle_time"]
+    new_candles = int((clock.now_ms() - last_time) // interval_to_ms(timeframe))
+    limit = min(new_candles + WINDOW + INDICATOR_WARMUP + 1, MAX_INCREMENTAL_CANDLES)
+    df, feature_columns = get_features(symbol, timeframe, limit, closed_only=True)
+    data = df[feature_columns].values
+    times = df["time"].values
+
+    X, y = build_sequences(scaler.transform(data))
+    target_times = times[WINDOW:]
+    new = target_times > last_time
+    X, y, target_times = X[new], y[new], target_times[new]
+    print(f"Got {len(X)} new sequences since last training")
+
+    # holdout = HOLDOUT_SPLIT ของแท่งใหม่ แต่ไม่น้อยกว่า MIN_HOLDOUT_SAMPLES
+    holdout_size = max(len(X) - int(len(X) * (1 - HOLDOUT_SPLIT)), MIN_HOLDOUT_SAMPLES)
+    if len(X) - holdout_size < MIN_NEW_SAMPLES:
+        needed = MIN_NEW_SAMPLES + MIN_HOLDOUT_SAMPLES
+        print(f"Not enough new candles (need {needed}) - keeping current model")
+        return {"mode": "incremental", "promoted": False, "reason": "not enough new candles", "samples": int(len(X))}
+
+    # ===== แบ่ง Fine-tune / Holdout ตามเวลา =====
+    split_idx = len(X) - holdout_size
+    X_train, X_hold = X[:split_idx], X[split_idx:]
+    y_train, y_hold = y[:split_idx], y[split_idx:]
+    print(f"Fine-tune samples: {len(X_train)}, Holdout samples: {len(X_hold)}")
+
+    model.compile(optimizer=Adam(learning_rate=INCREMENTAL_LEARNING_RATE), loss='mse', metrics=['mae'])
+    baseline_loss, baseline_mae = model.evaluate(X_hold, y_hold, verbose=0)
+
+    history = model.fit(X_train, y_train, epochs=epochs, batch_size=BATCH_SIZE, shuffle=False, verbose=1)
+    holdout_loss, holdout_mae = model.evaluate(X_hold, y_hold, verbose=0)
+
+    print("\n" + "=" * 50)
+    print(f"Holdout (current model)    - Loss: {baseline_loss:.6f}, MAE: {baseline_mae:.6f}")
+    print(f"Holdout (fine-tuned model) - Loss: {holdout_loss:.6f}, MAE: {holdout_mae:.6f}")
+
+    result = {
+        "mode": "incremental",
+        "promoted": bool(holdout_loss <= baseline_loss),
+        "samples": int(len(X)),
+        "holdout_samples": int(len(X_hold)),
+        "baseline_loss": float(baseline_loss),
+        "holdout_loss": float(holdout_loss)
+    }
+    if not result["promoted"]:
+        print("Fine-tuned model is worse on holdout - keeping current model")
+        return result
+
+    # ===== Promote: บันทึกโมเดลและ metadata ใหม่ (Scaler เดิม) =====
+    save_model(model, key)
+    save_metadata(key, {
+        **metadata,
+        "mode": "incremental",
+        "trained_at": int(clock.time()),
+        "last_candle_time": int(times[-1]),
+        "samples": int(len(X)),
+        "epochs": len(history.history["loss"]),
+        "baseline_loss": float(baseline_loss),
+        "holdout_loss": float(holdout_loss),
+        "holdout_mae": float(holdout_mae)
+    })
+    print(f"\n[OK] Model promoted: {model_path}")
+    print("Training complete!")
+    return result
+
+
+# ข้อมูลเทรนเป็นงาน bulk - ใช้งบ request weight ได้เฉพาะส่วนที่ไม่ได้เว้นไว้ให้ API และ Scheduler
+@rate_limit.with_priority(rate_limit.BULK)
+def main(argv=None):
+    # ===== Parse Arguments =====
+    parser = argparse.ArgumentParser(description='Train LSTM Model for Crypto AI')
+    parser.add_argument('--timeframe', type=str, required=True, help='Timeframe to train (e.g., 5m, 1h, 4h)')
+    parser.add_argument('--symbol', type=str, default="BTCUSDT", help='Symbol to train on')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Fine-tune the current model on candles since the last training run')
+    parser.add_argument('--epochs', type=int, default=INCREMENTAL_EPOCHS, help='Epoch budget for --incremental')
+    parser.add_argument('--per-symbol', action='store_true',
+                        help='Save as a symbol-specific model (lstm_{symbol}_{tf}.h5) instead of the timeframe model')
+    args = parser.parse_args(argv)
+
+    if args.incremental:
+        result = train_incremental(args.timeframe, args.symbol, args.epochs, args.per_symbol)
+    else:
+        result = train_full(args.timeframe, args.symbol, args.per_symbol)
+
+    # บรรทัดสุดท้ายเป็นผลลัพธ์แบบ JSON ให้ /retrain อ่าน
+    print("RESULT " + json.dumps(result))
+    return result
+
+
+if __name__ == "__main__":
+    main()
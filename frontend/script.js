@@ -10,6 +10,11 @@ let syncCountdownInterval = null;
 let isAutoSyncOn = false;
 let nextSyncTime = 0;
 
+// ===== Cursor สำหรับอัปเดตข้อมูลแบบ Incremental =====
+// เก็บ cursor (เวลาแท่งเทียนล่าสุด) ของแต่ละกราฟ/ตาราง เพื่อขอเฉพาะแท่งใหม่จาก API
+const chartCursors = new Map();
+let historyState = { key: null, cursor: null, rows: [] };
+
 // ===== ข้อมูลเหรียญ (Coin Data) =====
 const COINS = {
     BTC: { name: "Bitcoin", pair: "BTC/USDT", color: "#F7931A" },
@@ -220,14 +225,14 @@ async function loadPrediction() {
 
     try {
         const [predRes, btRes] = await Promise.all([
-            fetch(`${API_URL}/predict?coin=${selectedCoin}&timeframe=${timeframe}`),
+            fetch(predictUrl(priceChart, selectedCoin, timeframe)),
             fetch(`${API_URL}/backtest?coin=${selectedCoin}&timeframe=${timeframe}`)
         ]);
 
         const predData = await predRes.json();
         const btData = await btRes.json();
 
-        updateChartWithHistory(predData);
+        applyPredictionToChart(priceChart, `${selectedCoin}|${timeframe}`, predData, "default");
         updateStats(predData, btData, timeframe);
         updateTrend(predData);
 
@@ -240,12 +245,54 @@ async function loadPrediction() {
     }
 }
 
-function updateChartWithHistory(data) {
-    if (!data.times) return;
-    priceChart.data.labels = data.times;
-    priceChart.data.datasets[0].data = data.actual_prices;
-    priceChart.data.datasets[1].data = data.predicted_prices;
-    priceChart.update("default");
+// สร้าง URL /predict พร้อม since ถ้ากราฟนี้แสดงเหรียญ/timeframe เดิมอยู่แล้ว
+function predictUrl(chart, coin, timeframe) {
+    const state = chartCursors.get(chart);
+    let url = `${API_URL}/predict?coin=${coin}&timeframe=${timeframe}`;
+    if (state && state.key === `${coin}|${timeframe}` && state.cursor !== null) {
+        url += `&since=${state.cursor}`;
+    }
+    return url;
+}
+
+// อัปเดตกราฟ: โหลดใหม่ทั้งหมดเมื่อเปลี่ยนเหรียญ/timeframe มิฉะนั้น Patch เฉพาะแท่งใหม่ในที่เดิม
+function applyPredictionToChart(chart, key, data, mode) {
+    if (!chart || !data.times) return;
+    const state = chartCursors.get(chart);
+    const labels = chart.data.labels;
+    const actual = chart.data.datasets[0].data;
+    const predicted = chart.data.datasets[1].data;
+
+    if (!state || state.key !== key || !data.timestamps) {
+        chart.data.labels = data.times.slice();
+        chart.data.datasets[0].data = data.actual_prices.slice();
+        chart.data.datasets[1].data = data.predicted_prices.slice();
+        chartCursors.set(chart, {
+            key: key,
+            cursor: data.next_cursor ?? null,
+            timestamps: (data.timestamps || []).slice()
+        });
+        chart.update(mode);
+        return;
+    }
+
+    // ตัดจุดตั้งแต่แท่งแรกของ delta ออก (รวมจุดอนาคตเดิมและแท่งที่ยังไม่ปิด) แล้วต่อท้ายด้วยข้อมูลใหม่
+    const windowSize = state.timestamps.length;
+    let cut = state.timestamps.findIndex(t => t >= data.timestamps[0]);
+    if (cut < 0) cut = state.timestamps.length;
+
+    [labels, actual, predicted, state.timestamps].forEach(arr => arr.splice(cut));
+    labels.push(...data.times);
+    actual.push(...data.actual_prices);
+    predicted.push(...data.predicted_prices);
+    state.timestamps.push(...data.timestamps);
+
+    const overflow = state.timestamps.length - windowSize;
+    if (overflow > 0) {
+        [labels, actual, predicted, state.timestamps].forEach(arr => arr.splice(0, overflow));
+    }
+    state.cursor = data.next_cursor ?? state.cursor;
+    chart.update("none");
 }
 
 function updateStats(predData, btData, timeframe) {
@@ -301,7 +348,7 @@ async function runPrediction() {
 
     try {
         const [predRes, btRes] = await Promise.all([
-            fetch(`${API_URL}/predict?coin=${coin}&timeframe=${timeframe}`),
+            fetch(predictUrl(predictionChart, coin, timeframe)),
             fetch(`${API_URL}/backtest?coin=${coin}&timeframe=${timeframe}`)
         ]);
 
@@ -309,12 +356,7 @@ async function runPrediction() {
         const bt = await btRes.json();
 
         // อัปเดตกราฟ
-        if (predictionChart && pred.times) {
-            predictionChart.data.labels = pred.times;
-            predictionChart.data.datasets[0].data = pred.actual_prices;
-            predictionChart.data.datasets[1].data = pred.predicted_prices;
-            predictionChart.update();
-        }
+        applyPredictionToChart(predictionChart, `${coin}|${timeframe}`, pred);
 
         // อัปเดตค่าต่างๆ
         const formatPrice = (n) => "$" + n.toLocaleString(undefined, { minimumFractionDigits: 2 });
@@ -336,18 +378,39 @@ async function loadHistoryData() {
     const limit = document.getElementById("hist-limit").value;
 
     const tbody = document.getElementById("historyTableBody");
-    tbody.innerHTML = '<tr><td colspan="8" class="loading-text">Loading...</td></tr>';
+    const key = `${coin}|${timeframe}|${limit}`;
+    const isDelta = historyState.key === key && historyState.cursor !== null;
+
+    let url = `${API_URL}/ohlcv?coin=${coin}&timeframe=${timeframe}&limit=${limit}`;
+    if (isDelta) {
+        url += `&since=${historyState.cursor}`;
+    } else {
+        tbody.innerHTML = '<tr><td colspan="8" class="loading-text">Loading...</td></tr>';
+    }
 
     try {
-        const res = await fetch(`${API_URL}/ohlcv?coin=${coin}&timeframe=${timeframe}&limit=${limit}`);
+        const res = await fetch(url);
         const data = await res.json();
+        const newRows = data.data || [];
+
+        if (isDelta && newRows.length > 0) {
+            // แทนที่แท่งที่ยังไม่ปิดและเพิ่มแท่งใหม่ไว้ด้านบน (ข้อมูลเรียงจากใหม่ไปเก่า)
+            const oldest = newRows[newRows.length - 1].timestamp;
+            const kept = historyState.rows.filter(row => row.timestamp < oldest);
+            historyState.rows = newRows.concat(kept).slice(0, parseInt(limit));
+        } else if (!isDelta) {
+            historyState.rows = newRows;
+        }
+        historyState.key = key;
+        historyState.cursor = data.next_cursor ?? historyState.cursor;
 
-        if (data.data && data.data.length > 0) {
+        const rows = historyState.rows;
+        if (rows.length > 0) {
             // อัปเดตจำนวน sync records
             const recordCountEl = document.getElementById("syncRecordCount");
-            if (recordCountEl) recordCountEl.textContent = data.data.length;
+            if (recordCountEl) recordCountEl.textContent = rows.length;
 
-            tbody.innerHTML = data.data.map(row => `
+            tbody.innerHTML = rows.map(row => `
                 <tr>
                     <td>${row.date}</td>
                     <td>${row.time}</td>
@@ -364,6 +427,7 @@ async function loadHistoryData() {
         }
     } catch (error) {
         console.error("Error:", error);
+        historyState = { key: null, cursor: null, rows: [] };
         tbody.innerHTML = '<tr><td colspan="8" class="loading-text">Error loading data</td></tr>';
     }
 }